@@ -0,0 +1,190 @@
+"""不連網的 gspread Worksheet 替身：資料放記憶體，每次 API 呼叫可加上固定延遲並計數。"""
+import time
+from collections import Counter
+
+from gspread.utils import a1_range_to_grid_range, numericise_all, rowcol_to_a1
+
+from services.storage import SHEET_COLUMNS
+
+LONG_TEXT = "我們的目標客群是 25-40 歲、重視生活品質的上班族，" * 8
+
+
+def make_rows(count, long_text=LONG_TEXT):
+    rows = []
+    for i in range(count):
+        rows.append([
+            f"client{i}@gmail.com", f"客戶{i}_20260101", f"客戶{i}", "高如慧",
+            "17,000元/月（每月付款）" if i % 3 else "45,000元/三個月（一次付款）",
+            f"2026-{1 + i % 12:02d}-{1 + i % 28:02d}", str(1 + i % 28), "" if i % 3 else "2026-01-01",
+            "TRUE", "FALSE", "TRUE", "FALSE", f"https://facebook.com/page{i}", f"https://example.com/lp{i}",
+            "競品A", "競品B", "競品C", long_text, long_text, long_text, "30000",
+            "2026-01-01 10:00:00", "contract", "17,000元/月（每月付款）", f"客戶{i}_20260101 (客戶{i})",
+            "FALSE", "FALSE", "8d969eef6ecad3c29a3a629280e686cf0c3f5d5a86aff3ca12020c923adc6c92",
+        ])
+    return rows
+
+
+class FakeSpreadsheet:
+    """多個分頁共用同一個呼叫計數；支援封存用到的 worksheets / add_worksheet / deleteDimension。"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.tabs = []
+
+    def _api(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def worksheets(self, **kwargs):
+        self._api("worksheets")
+        return list(self.tabs)
+
+    def worksheet(self, title):
+        from gspread.exceptions import WorksheetNotFound
+
+        self._api("worksheet")
+        for ws in self.tabs:
+            if ws.title == title:
+                return ws
+        raise WorksheetNotFound(title)
+
+    def get_worksheet(self, index):
+        return self.tabs[index]
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self._api("add_worksheet")
+        ws = FakeWorksheet([], headers=[], latency=self.latency, title=title, spreadsheet=self)
+        ws.values = []
+        return ws
+
+    def batch_update(self, body):
+        self._api("spreadsheet.batch_update")
+        for request in body["requests"]:
+            grid = request["deleteDimension"]["range"]
+            ws = next(w for w in self.tabs if w.id == grid["sheetId"])
+            del ws.values[grid["startIndex"]:grid["endIndex"]]
+        return {}
+
+
+class FakeWorksheet:
+    def __init__(self, rows, headers=SHEET_COLUMNS, latency=0.0, title="工作表1", spreadsheet=None):
+        self.latency = latency
+        self.title = title
+        self.values = [list(headers)] + [list(r) for r in rows]
+        self.spreadsheet = spreadsheet or FakeSpreadsheet(latency)
+        self.id = len(self.spreadsheet.tabs)
+        self.spreadsheet.tabs.append(self)
+        # 同一份試算表的分頁共用計數
+        self.calls = self.spreadsheet.calls
+
+    def _api(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def api_calls(self):
+        return sum(self.calls.values())
+
+    def _cell(self, r, c):
+        row = self.values[r] if r < len(self.values) else []
+        return row[c] if c < len(row) else ""
+
+    def _set(self, r, c, value):
+        while len(self.values) <= r:
+            self.values.append([])
+        row = self.values[r]
+        row.extend([""] * (c + 1 - len(row)))
+        row[c] = "" if value is None else str(value)
+
+    def _grid(self, a1):
+        a1 = a1.split("!")[-1]
+        grid = a1_range_to_grid_range(a1)
+        r0, r1 = grid.get("startRowIndex", 0), grid.get("endRowIndex", len(self.values))
+        c0, c1 = grid.get("startColumnIndex", 0), grid.get("endColumnIndex", len(self.values[0]))
+        return r0, min(r1, len(self.values)), c0, c1
+
+    # --- 讀 ---
+    def get_all_records(self, **kwargs):
+        self._api("get_all_records")
+        headers = self.values[0]
+        return [dict(zip(headers, numericise_all(row + [""] * (len(headers) - len(row)))))
+                for row in self.values[1:]]
+
+    def get_all_values(self, **kwargs):
+        self._api("get_all_values")
+        return [list(r) for r in self.values]
+
+    def row_values(self, row, **kwargs):
+        self._api("row_values")
+        values = list(self.values[row - 1]) if row <= len(self.values) else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def col_values(self, col, **kwargs):
+        self._api("col_values")
+        return [self._cell(r, col - 1) for r in range(len(self.values))]
+
+    def batch_get(self, ranges, **kwargs):
+        self._api("batch_get")
+        out = []
+        for a1 in ranges:
+            r0, r1, c0, c1 = self._grid(a1)
+            block = [[self._cell(r, c) for c in range(c0, c1)] for r in range(r0, r1)]
+            # 與 API 一樣去掉尾端空白
+            block = [row[:max((i + 1 for i, v in enumerate(row) if v != ""), default=0)] for row in block]
+            while block and not block[-1]:
+                block.pop()
+            out.append(block)
+        return out
+
+    def find(self, query, **kwargs):
+        self._api("find")
+        for r, row in enumerate(self.values):
+            for c, value in enumerate(row):
+                if value == query:
+                    return type("Cell", (), {"row": r + 1, "col": c + 1, "value": value})()
+        return None
+
+    # --- 寫 ---
+    def batch_update(self, data, **kwargs):
+        self._api("batch_update")
+        for item in data:
+            r0, _, c0, _ = self._grid(item["range"])
+            for dr, row in enumerate(item["values"]):
+                for dc, value in enumerate(row):
+                    self._set(r0 + dr, c0 + dc, value)
+        return {}
+
+    def update_cells(self, cells, **kwargs):
+        self._api("update_cells")
+        for cell in cells:
+            self._set(cell.row - 1, cell.col - 1, cell.value)
+        return {}
+
+    def update_cell(self, row, col, value):
+        self._api("update_cell")
+        self._set(row - 1, col - 1, value)
+        return {}
+
+    def _append(self, rows):
+        if not any(self.values):
+            # 整張表都是空的 (連表頭都沒有)：和 Sheets 一樣從第 1 列開始寫
+            self.values = []
+        first = len(self.values) + 1
+        for row in rows:
+            self.values.append(["" if v is None else str(v) for v in row])
+        last = len(self.values)
+        width = max(len(r) for r in rows) if rows else 1
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:{rowcol_to_a1(last, width)}"}}
+
+    def append_row(self, row, **kwargs):
+        self._api("append_row")
+        return self._append([row])
+
+    def append_rows(self, rows, **kwargs):
+        self._api("append_rows")
+        return self._append(rows)
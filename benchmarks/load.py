@@ -0,0 +1,301 @@
+"""多 session 壓測：同一個程序裡開 N 條執行緒，各自用 streamlit.testing 的 AppTest 跑真正的 app.py 流程。
+
+    python -m benchmarks.load                               # 並行 1 / 5 / 10 / 20 個 session
+    python -m benchmarks.load --sessions 1,10,50 --rows 10000 --latency-ms 80
+    python -m benchmarks.load --read-per-minute 600 --write-per-minute 600
+
+和正式環境一樣，所有 session 在同一個程序裡共用同一份假工作表、索引、寫入日誌與寄信佇列；
+Sheets 呼叫經過依 st.secrets["sheets"] 建立的 QuotaGate，照每分鐘上限排隊 (預設 60，與 Sheets API 的預設配額相同)。
+通知信寄到本機的 aiosmtpd 收信端 (benchmarks.smtp_sink)。
+
+每個 session：建檔 -> 登出再登入 -> 更新合約方案 -> 生成 Word 合約 -> 第二階段送出。
+每個並行度回報 session/秒、各步驟延遲的 p50/p95/p99，以及這個程序跑完該並行度後的 RSS 與最高 RSS。
+注意「更新合約方案」在 app.py 裡固定 sleep 1 秒讓使用者看到訊息，該步驟延遲至少 1000 ms。
+錯誤分兩種：app 錯誤 (app.py 本身丟出例外) 與 harness 錯誤 (找不到元件、逾時等壓測本身的問題)。
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from benchmarks.fake_sheet import FakeWorksheet, make_rows
+from benchmarks.smtp_sink import SMTPSink
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+STEPS = ["open", "register", "login", "update_plan", "contract", "phase2"]
+QUARTERLY = "45,000元/三個月（一次付款）"
+
+
+class AppError(Exception):
+    """app.py 在某一步丟出例外 (相對於壓測本身的問題)。"""
+
+
+def peak_rss_mb():
+    # 本程序生涯最高的常駐記憶體 (macOS 的單位是 bytes，Linux 是 KB)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def rss_mb():
+    # 目前的常駐記憶體；沒有 /proc (macOS) 時退回最高值
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _click(at, label):
+    for button in at.button:
+        if button.label == label:
+            return button.click().run()
+    raise AssertionError(f"button not found: {label}")
+
+
+def _by_label(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise AssertionError(f"widget not found: {label}")
+
+
+def run_session(session_id, timeout):
+    """跑完整流程，回傳 {步驟: 秒}；任何一步出錯就丟例外。"""
+    from streamlit.testing.v1 import AppTest
+
+    email, name = f"load{session_id}@gmail.com", f"壓測{session_id}"
+    timings = {}
+
+    def step(name_, fn):
+        started = time.perf_counter()
+        at = fn()
+        timings[name_] = time.perf_counter() - started
+        if at.exception:
+            raise AppError(f"{name_}: {at.exception[0].value}")
+        return at
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    step("open", at.run)
+
+    def register():
+        _by_label(at.radio, "模式").set_value("新客戶建檔")
+        at.run()
+        _by_label(at.text_input, "客戶名稱").set_value(name)
+        _by_label(at.text_input, "聯絡信箱 (限 Gmail)").set_value(email)
+        _click(at, "開始建檔")
+        return _click(at, "🎲 生成案件編號並存檔")
+    step("register", register)
+
+    def login():
+        _click(at, "登出系統")
+        _by_label(at.text_input, "信箱").set_value(email)
+        _by_label(at.text_input, "密碼").set_value("dennis")
+        return _click(at, "登入")
+    step("login", login)
+
+    def update_plan():
+        _by_label(at.radio, "方案選擇：").set_value(QUARTERLY)
+        at.run()
+        return _click(at, "💾 更新合約方案")
+    step("update_plan", update_plan)
+
+    step("contract", lambda: _click(at, "📝 生成 Word 合約"))
+
+    def phase2():
+        _by_label(at.radio, "流程：").set_value("第二階段｜啟動前確認")
+        at.run()
+        _by_label(at.text_input, "粉專網址").set_value(f"https://facebook.com/{session_id}")
+        _by_label(at.text_input, "第一個月預算").set_value("20000")
+        return _click(at, "💾 更新資料並通知")
+    step("phase2", phase2)
+    return timings
+
+
+def use_secrets(secrets):
+    """所有 session 共用的 st.secrets。
+
+    AppTest 帶著自己的 secrets 時會在每次 run 前後換掉全域的 st.secrets，多條執行緒同時 run 會互相蓋掉，
+    所以在開始前設一次，AppTest 本身不帶 secrets。
+    """
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+
+
+@contextmanager
+def shared_runtime():
+    """讓同一個程序裡的多個 AppTest 可以同時 run。
+
+    AppTest 每次 run 前換一個 Runtime 單例、run 完設回 None，也會暫時打開 global.appTest：
+    一個 session 跑完會讓其他還在跑的 session 找不到 Runtime (widget 不註冊、寫不進媒體檔)。
+    每次 run 也各自重新編譯 app.py，而 Python 3.11 的 ast.parse 在多條執行緒同時呼叫時會壞掉。
+    正式環境本來就是所有 session 共用一個 Runtime 與一份編譯好的腳本，壓測期間照做：
+    Runtime 被清掉時沿用最近一個、global.appTest 一直開著、腳本只編譯一次；離開時全部還原。
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    original = Runtime.__dict__["instance"], Runtime.__dict__["exists"]
+    get_bytecode = ScriptCache.get_bytecode
+    app_test = config.get_option("global.appTest")
+    last = []
+    compiled, compile_lock = {}, threading.Lock()
+
+    def current(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+        return cls._instance or (last[0] if last else None)
+
+    def instance(cls):
+        runtime = current(cls)
+        if runtime is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return runtime
+
+    def shared_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in compiled:
+                compiled[script_path] = get_bytecode(self, script_path)
+            return compiled[script_path]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: current(cls) is not None)
+    ScriptCache.get_bytecode = shared_bytecode
+    config.set_option("global.appTest", True)
+    try:
+        yield
+    finally:
+        Runtime.instance, Runtime.exists = original
+        ScriptCache.get_bytecode = get_bytecode
+        config.set_option("global.appTest", app_test)
+
+
+def setup(rows, latency, journal_dir):
+    """接上共用的假工作表與寫入日誌；配額關卡照 secrets 建立。回傳工作表。"""
+    from services.sheet_client import configured_sheet_url, get_connection
+    from services.storage import get_storage
+    from services.write_coordinator import WriteCoordinator, set_coordinator
+
+    sheet_url = configured_sheet_url()
+    ws = FakeWorksheet(make_rows(rows), latency=latency)
+    get_connection(sheet_url).attach(ws)
+    set_coordinator(WriteCoordinator(get_storage(sheet_url), journal_path=os.path.join(journal_dir, "journal.jsonl")),
+                    sheet_url)
+    return ws
+
+
+def run_level(level, timeout):
+    """level 條執行緒同時開始各跑一個 session；回傳這一輪的統計。"""
+    start = threading.Barrier(level + 1)
+    results = {}
+
+    def session(session_id):
+        result = {"timings": None, "error": None, "kind": None}
+        try:
+            start.wait()
+            result["timings"] = run_session(session_id, timeout)
+        except AppError as e:
+            result["error"], result["kind"] = str(e), "app"
+        except Exception as e:
+            result["error"], result["kind"] = f"{type(e).__name__}: {e}", "harness"
+        results[session_id] = result
+
+    threads = [threading.Thread(target=session, args=(f"{level}_{i}",), name=f"session-{level}_{i}", daemon=True)
+               for i in range(level)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout * len(STEPS) + 60
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results.values() if r["error"] is None]
+    errors = {"app": [], "harness": []}
+    for session_id, r in results.items():
+        if r["error"] is not None:
+            errors[r["kind"]].append(f"{session_id}: {r['error']}")
+    errors["harness"] += [f"{t.name}: still running after the deadline" for t in threads if t.is_alive()]
+    return {"sessions": level, "ok": len(ok), "app_errors": errors["app"], "harness_errors": errors["harness"],
+            "seconds": elapsed, "throughput": len(ok) / elapsed if elapsed else 0.0,
+            "rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb(),
+            "steps": {s: [r["timings"][s] * 1000 for r in ok] for s in STEPS}}
+
+
+def sink_secrets(sink, read_per_minute, write_per_minute):
+    """通知信寄到本機收信端；Sheets 配額照參數。"""
+    return {
+        "email": {"sender_email": "load@example.com", "sender_password": "", "receiver_email": "ops@example.com",
+                  "smtp_host": "127.0.0.1", "smtp_port": sink.port, "smtp_ssl": False},
+        "sheets": {"read_per_minute": read_per_minute, "write_per_minute": write_per_minute},
+        "admin": {"emails": []},
+        "session": {"secret": "load-test"},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以 AppTest 模擬多個 session 在同一個程序裡同時走完整流程")
+    parser.add_argument("--sessions", default="1,5,10,20", help="逗號分隔的並行 session 數")
+    parser.add_argument("--rows", type=int, default=1000, help="假工作表的既有資料列數")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="每次假 Sheets API 呼叫的延遲")
+    parser.add_argument("--read-per-minute", type=int, default=60, help="Sheets 讀取配額 (每分鐘)")
+    parser.add_argument("--write-per-minute", type=int, default=60, help="Sheets 寫入配額 (每分鐘)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="單次 rerun 的逾時秒數")
+    args = parser.parse_args(argv)
+
+    import streamlit.testing.v1  # noqa: F401  先 import，不算進第一輪的計時
+    from streamlit import config
+    from streamlit.logger import set_log_level
+
+    logging.getLogger("service.metrics").setLevel(logging.WARNING)
+    # session 執行緒不是腳本執行緒，每個都會警告一次 missing ScriptRunContext；
+    # AppTest 每次 run 會依 logger.level 重設 streamlit 各 logger 的等級，所以設定值也要改
+    config.set_option("logger.level", "error")
+    set_log_level("error")
+
+    from services.mailer import get_dispatcher
+    from services.write_coordinator import get_coordinator
+
+    with SMTPSink() as sink, tempfile.TemporaryDirectory() as journal_dir, shared_runtime():
+        use_secrets(sink_secrets(sink, args.read_per_minute, args.write_per_minute))
+        ws = setup(args.rows, args.latency_ms / 1000.0, journal_dir)
+        print(f"{'sessions':>8} {'ok':>4} {'app':>4} {'harn':>4} {'sess/s':>7} {'RSS MB':>7} {'peak MB':>8}  " +
+              "  ".join(f"{s + ' p50/p95/p99 ms':>30}" for s in STEPS))
+        failed = False
+        for level in [int(n) for n in args.sessions.split(",") if n]:
+            r = run_level(level, args.timeout)
+            cells = "  ".join(f"{percentile(r['steps'][s], 50):>9.0f} {percentile(r['steps'][s], 95):>9.0f} "
+                              f"{percentile(r['steps'][s], 99):>9.0f}" for s in STEPS)
+            print(f"{level:>8} {r['ok']:>4} {len(r['app_errors']):>4} {len(r['harness_errors']):>4} "
+                  f"{r['throughput']:>7.2f} {r['rss_mb']:>7.1f} {r['peak_rss_mb']:>8.1f}  {cells}", flush=True)
+            for kind in ("app", "harness"):
+                for error in r[f"{kind}_errors"][:3]:
+                    print(f"  {kind} error: {error}", file=sys.stderr)
+            failed = failed or bool(r["app_errors"] or r["harness_errors"])
+        # 等日誌重播完、通知信寄出，API 呼叫數與收信數才完整
+        get_coordinator().journal.flush(timeout=60)
+        get_dispatcher().flush(timeout=60)
+        print(f"Sheets API 呼叫 {ws.api_calls} 次 {dict(ws.calls)}；SMTP 收到 {sink.messages} 封", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
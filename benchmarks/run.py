@@ -0,0 +1,172 @@
+"""讀寫熱路徑的 microbenchmark，對假的 Worksheet 執行，不需要網路。
+
+    python -m benchmarks.run                          # 1k / 10k 列
+    python -m benchmarks.run --rows 100000            # 大表 (冷索引一次就要十幾秒)，需要時再跑
+    python -m benchmarks.run --rows 1000 --latency-ms 50
+    python -m benchmarks.run --update-baseline        # 把這次結果存成基準
+
+每個情境回報每次操作的 API 呼叫數與平均耗時；與 baseline.json 比較，
+API 呼叫數變多、或耗時超過基準 (1 + tolerance) 倍即標記為退步並以 exit code 1 結束。
+一次性的成本 (冷索引、第一次連線) 會被平均進去，所以 --iterations / --latency-ms 與基準不同時不比較。
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date
+
+from benchmarks.fake_sheet import FakeWorksheet, make_rows
+from services import clients
+from services.document_utils import generate_docx_bytes
+from services.quota import QuotaGate
+from services.sheet_client import configured_sheet_url, get_connection, set_gate
+from services.sheet_index import get_index
+from services.storage import get_storage
+from services.write_coordinator import WriteCoordinator, set_coordinator
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+P2_DATA = {
+    "chk_ad_account": True, "chk_pixel": False, "chk_fanpage": True, "chk_bm": True, "chk_remote": False,
+    "chk_creatives": True, "fanpage_url": "https://facebook.com/x", "landing_url": "https://example.com",
+    "comp1": "a", "comp2": "b", "comp3": "c", "who_problem": "誰", "what_problem": "什麼", "how_solve": "如何",
+    "budget": "30000",
+}
+
+
+def _bench(ws, fn, iterations):
+    before = ws.api_calls if ws is not None else 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    elapsed = time.perf_counter() - started
+    calls = (ws.api_calls - before) if ws is not None else 0
+    return {"ms": round(elapsed * 1000 / iterations, 3), "api_calls": round(calls / iterations, 3)}
+
+
+def run_size(size, latency, iterations, rng):
+    from google_sheet import GoogleSheetService
+
+    sheet_url = configured_sheet_url()
+    ws = FakeWorksheet(make_rows(size), latency=latency)
+    get_connection(sheet_url).attach(ws)
+    # 量的是同步寫入 Sheet 的成本：不經本機寫入日誌，免得背景重播混進 API 計數
+    set_coordinator(WriteCoordinator(get_storage(sheet_url)), sheet_url)
+    index = get_index(sheet_url, "full")
+    # 封存分頁清單只在第一次查不到客戶時列一次 (之後快取 ARCHIVE_TTL)：先列好，不算進任何情境
+    get_storage(sheet_url).archive.titles()
+    emails = [f"client{rng.randrange(size)}@gmail.com" for _ in range(iterations)]
+    results = {}
+
+    def cold(mode):
+        def op(i):
+            get_index(sheet_url, mode).invalidate()
+            clients.find_user_row(emails[i])
+        return op
+
+    results["find_user_row.cold"] = _bench(ws, cold("full"), max(1, iterations // 10))
+    results["find_user_row.warm"] = _bench(ws, lambda i: clients.find_user_row(emails[i]), iterations)
+    results["find_user_row.projected.cold"] = _bench(ws, cold("projected"), max(1, iterations // 10))
+    results["find_user_row.projected.warm"] = _bench(ws, lambda i: clients.find_user_row(emails[i]), iterations)
+    get_index(sheet_url, "full")
+
+    service = GoogleSheetService()
+    results["GoogleSheetService.get_user_by_email"] = _bench(
+        ws, lambda i: service.get_user_by_email(emails[i]), iterations)
+    results["GoogleSheetService.create_or_update_user.update"] = _bench(
+        ws, lambda i: service.create_or_update_user({"Email": emails[i], "budget": str(i)}), iterations)
+    results["GoogleSheetService.create_or_update_user.insert"] = _bench(
+        ws, lambda i: service.create_or_update_user({"Email": f"svc{size}_{i}@gmail.com", "party_a": "新"}), iterations)
+
+    results["save_phase1_new"] = _bench(ws, lambda i: clients.save_phase1_new({
+        "Email": f"new{size}_{i}@gmail.com", "case_id": f"new{size}_{i}", "party_a": "新客戶",
+        "plan": "17,000元/月（每月付款）", "start_date": date(2026, 1, 1), "pay_day": 5, "pay_date": None,
+    }), iterations)
+    cases = [clients.find_user_row(e)[1]["case_id"] for e in emails]
+    results["update_phase1"] = _bench(ws, lambda i: clients.update_phase1(
+        cases[i], "45,000元/三個月（一次付款）", date(2026, 2, 1), 5, date(2026, 1, 25)), iterations)
+    results["update_phase2"] = _bench(ws, lambda i: clients.update_phase2(cases[i], P2_DATA), iterations)
+    index.invalidate()
+    return results
+
+
+def run_docx(iterations):
+    def cold(i):
+        generate_docx_bytes(f"客戶{i}_{time.perf_counter_ns()}", "x@gmail.com", "17,000元/月（每月付款）",
+                            date(2026, 1, 1), 5, None, f"case_{i}")
+    return {
+        "generate_docx_bytes.cold": _bench(None, cold, iterations),
+        "generate_docx_bytes.cached": _bench(None, lambda i: generate_docx_bytes(
+            "客戶", "x@gmail.com", "17,000元/月（每月付款）", date(2026, 1, 1), 5, None, "case"), iterations),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for size, scenarios in results.items():
+        for name, now in scenarios.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            if now["api_calls"] > base["api_calls"]:
+                regressions.append(f"{size} {name}: API 呼叫 {base['api_calls']} -> {now['api_calls']}")
+            # 1 ms 以內的差異視為雜訊
+            if now["ms"] > base["ms"] * (1 + tolerance) and now["ms"] - base["ms"] > 1.0:
+                regressions.append(f"{size} {name}: {base['ms']} ms -> {now['ms']} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sheets / 合約熱路徑 benchmark (假工作表，不連網)")
+    parser.add_argument("--rows", default="1000,10000", help="逗號分隔的列數 (baseline 也有 100000)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每次假 API 呼叫的延遲")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="耗時允許超過基準的比例")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    logging.getLogger("service.metrics").setLevel(logging.WARNING)
+    set_gate(QuotaGate(read_per_minute=10 ** 9, write_per_minute=10 ** 9))
+    rng = random.Random(args.seed)
+
+    results = {}
+    for size in [int(s) for s in args.rows.split(",") if s]:
+        results[str(size)] = run_size(size, args.latency_ms / 1000.0, args.iterations, rng)
+    results["docx"] = run_docx(args.iterations)
+
+    print(f"{'rows':>8}  {'scenario':<48} {'ms/op':>10} {'api/op':>8}")
+    for size, scenarios in results.items():
+        for name, r in scenarios.items():
+            print(f"{size:>8}  {name:<48} {r['ms']:>10.3f} {r['api_calls']:>8.2f}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        baseline.update(results)
+        baseline["latency_ms"] = args.latency_ms
+        baseline["iterations"] = args.iterations
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"baseline 已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("latency_ms", 0.0) != args.latency_ms:
+        print("延遲設定與 baseline 不同，略過比較", file=sys.stderr)
+        return 0
+    if baseline and baseline.get("iterations", 20) != args.iterations:
+        print(f"--iterations 與 baseline ({baseline.get('iterations', 20)}) 不同，略過比較", file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
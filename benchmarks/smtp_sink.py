@@ -0,0 +1,58 @@
+"""本機 SMTP 收信端：什麼都收、只計數，壓測時讓 MailDispatcher 真的走完 SMTP 對話。
+
+需要 aiosmtpd (pip install aiosmtpd)；收信端在 aiosmtpd.controller.Controller 的背景執行緒裡跑。
+"""
+import socket
+import threading
+
+
+def _free_port(host):
+    # Controller 啟動時會自己連一次 port 確認服務起來了，不能給 0：先向系統要一個空的
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class _CountingHandler:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(envelope.original_content or b"")
+        return "250 Message accepted for delivery"
+
+
+class SMTPSink:
+    """with SMTPSink() as sink: ...；port 預設 0 表示由系統挑一個空的。"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        from aiosmtpd.controller import Controller
+
+        self.handler = _CountingHandler()
+        self.port = port or _free_port(host)
+        self.controller = Controller(self.handler, hostname=host, port=self.port)
+
+    @property
+    def messages(self):
+        return self.handler.messages
+
+    @property
+    def bytes(self):
+        return self.handler.bytes
+
+    def start(self):
+        self.controller.start()
+        return self
+
+    def shutdown(self):
+        self.controller.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -1,8 +1,10 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import streamlit as st
 import json
 from datetime import datetime
+from services.metrics import timed
+from services.sheet_client import configured_sheet_url, get_connection
+from services.storage import get_storage
+from services.write_coordinator import ClientNotFoundError, DuplicateClientError, get_coordinator
 
 class GoogleSheetService:
     def __init__(self):
@@ -13,6 +15,8 @@ class GoogleSheetService:
         self.creds = None
         self.client = None
         self.sheet = None
+        self.sheet_url = None
+        self.storage = None
         self.columns = [
             "Email", "case_id", "party_a", "provider", "plan", "start_date", "pay_day", "pay_date",
             "chk_ad_account", "chk_pixel", "chk_fanpage", "chk_bm", "fanpage_url", "landing_url",
@@ -21,34 +25,32 @@ class GoogleSheetService:
         ]
         self._connect()
 
+    @timed()
     def _connect(self):
         try:
-            if "gcp_service_account" in st.secrets:
-                creds_dict = dict(st.secrets["gcp_service_account"])
-                self.creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, self.scope)
-            else:
-                self.creds = ServiceAccountCredentials.from_json_keyfile_name("service_account.json", self.scope)
-            
-            self.client = gspread.authorize(self.creds)
-            
-            sheet_url = st.secrets["sheets"]["url"] if "sheets" in st.secrets and "url" in st.secrets["sheets"] else "https://docs.google.com/spreadsheets/d/1zXHavJqhOBq1-m_VR7sxMkeOHdXoD9EmQCEM1Nl816I/edit?usp=sharing"
-            self.sheet = self.client.open_by_url(sheet_url).sheet1
+            # Reuse the process-wide connection instead of re-authorizing per instance
+            self.sheet_url = configured_sheet_url()
+            conn = get_connection(self.sheet_url)
+            self.client = conn.client()
+            self.creds = conn.creds
+            self.sheet = conn.worksheet()
+            self.storage = get_storage(self.sheet_url)
         except Exception as e:
             st.error(f"Google Sheet Connection Error: {e}")
 
+    @timed()
     def get_user_by_email(self, email):
         if not self.sheet:
             return None
         try:
-            records = self.sheet.get_all_records()
-            for row in records:
-                if str(row.get("Email", "")).strip().lower() == str(email).strip().lower():
-                    return row
-            return None
+            # Include writes still waiting in the local journal
+            _, row = get_coordinator(self.sheet_url).find_by_email(email)
+            return row
         except Exception as e:
             st.error(f"Error reading sheet: {e}")
             return None
 
+    @timed()
     def create_or_update_user(self, client_data):
         if not self.sheet:
             return False
@@ -60,53 +62,36 @@ class GoogleSheetService:
 
             client_data['last_update_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            try:
-                cell = self.sheet.find(email)
-            except:
-                cell = None
-
-            headers = self.sheet.row_values(1)
-            
-            # Prepare row data maintaining column order
-            row_values = []
-            
-            if cell:
-                # Update existing row
-                row_idx = cell.row
-                # We update each cell that exists in client_data
-                # But to save API calls, constructing the whole row is tricky if we don't know the exact order 
-                # or if we don't want to overwrite other columns.
-                # safely update only provided fields
-                
-                for key, value in client_data.items():
-                    if key in headers:
-                        col_idx = headers.index(key) + 1
-                        if isinstance(value, (dict, list)):
-                            value = json.dumps(value, ensure_ascii=False)
-                        self.sheet.update_cell(row_idx, col_idx, value)
-            else:
-                # New Row
-                # Ensure all headers exist or map strictly to self.columns
-                new_row = []
-                # If sheet headers are empty, we might should init them?
-                # Assuming sheet is prepared as per user request.
-                
-                if not headers:
-                    # Init headers if empty (optional safety)
-                    self.sheet.append_row(self.columns)
-                    headers = self.columns
-
-                for h in headers:
-                    val = client_data.get(h, "")
-                    if isinstance(val, (dict, list)):
-                        val = json.dumps(val, ensure_ascii=False)
-                    new_row.append(val)
-                self.sheet.append_row(new_row)
-                
-            return True
+            return self._upsert(email, client_data)
         except Exception as e:
             st.error(f"Error saving to sheet: {e}")
             return False
 
+    def _upsert(self, email, client_data):
+        # Go through the same coordinator as app.py: per-email locks, the write journal and version stamps
+        coordinator = get_coordinator(self.sheet_url)
+        values = {}
+        for key, value in client_data.items():
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False)
+            values[key] = value
+        try:
+            # Update existing row: only the provided fields, in one batched request
+            coordinator.update(values, email=email)
+        except ClientNotFoundError:
+            # New Row, laid out by the sheet's own headers (written from self.columns on an empty sheet);
+            # through storage so the shared index is reloaded with the new headers
+            headers = self.storage.ensure_headers(self.columns)
+            new_row = []
+            for h in headers:
+                new_row.append(values.get(h, ""))
+            try:
+                coordinator.register(new_row, email)
+            except DuplicateClientError:
+                # Someone registered this email between our lookup and the insert
+                coordinator.update(values, email=email)
+
+        return True
+
 def get_sheet_service():
     return GoogleSheetService()
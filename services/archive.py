@@ -0,0 +1,195 @@
+"""冷熱分頁：合約期已結束的案件搬到每年一個的封存分頁 (archive_2025 …)，第 0 個工作表只留進行中的客戶。
+
+    python -m services.archive --dry-run            # 只列出會搬走哪些案件
+    python -m services.archive --grace-days 60      # 結束滿 60 天才封存
+
+查詢先找熱分頁，找不到才依年份由新到舊查封存分頁；封存的客戶再次寫入時會先搬回熱分頁。
+搬移會改變熱分頁的列號：整段持有 RowEpoch 的獨佔檔案鎖 (SheetStorage.moving_rows)，
+同一台主機上 app 程序依列號的寫入會先等它做完；刪列後換列號世代，各程序寫入前發現世代變了就先重載索引。
+命令列要和 app 在同一台主機、用同一份 secrets (shared_cache.rows_dir) 執行。
+"""
+import argparse
+import logging
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from services.sheet_client import get_connection
+from services.sheet_index import DEFAULT_TTL, STALE_RETRY, get_index
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = "archive_"
+# 與熱分頁索引同樣的存活時間：命令列封存後，兩邊在同一段時間內對上新內容。
+# 封存索引只抓兩欄，而且只在熱分頁找不到時才會讀
+ARCHIVE_TTL = DEFAULT_TTL
+# 合約結束後保留在熱分頁的天數：剛結束的客戶通常還會回來看資料或續約
+DEFAULT_GRACE_DAYS = 30
+
+_TITLE_RE = re.compile(rf"^{ARCHIVE_PREFIX}(\d{{4}})$")
+
+
+def archive_title(year):
+    return f"{ARCHIVE_PREFIX}{year}"
+
+
+def delete_rows(conn, row_nums, title=None):
+    """一次 spreadsheet.batch_update 刪掉多列 (由下往上刪，前面的列號不受影響)；連續的列合成一段。"""
+    spans = []
+    for row in sorted(set(row_nums), reverse=True):
+        if spans and spans[-1][0] == row + 1:
+            spans[-1][0] = row
+        else:
+            spans.append([row, row])
+    if not spans:
+        return
+
+    def run(ws):
+        requests = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS",
+                                                   "startIndex": start - 1, "endIndex": end}}}
+                    for start, end in spans]
+        return ws.spreadsheet.batch_update({"requests": requests})
+    conn.call(run, "write", title=title, idempotent=False)
+
+
+class ArchiveShelf:
+    """一份試算表的所有封存分頁；每個分頁各有一個 projected 索引 (只抓 Email / case_id 兩欄)。"""
+
+    def __init__(self, sheet_url, ttl=ARCHIVE_TTL):
+        self.sheet_url = sheet_url
+        self.ttl = ttl
+        self.conn = get_connection(sheet_url)
+        self._lock = threading.Lock()
+        self._titles = None
+        self._listed_at = None
+
+    def titles(self):
+        """封存分頁名稱，新的年份在前。"""
+        with self._lock:
+            if self._titles is None or time.monotonic() - self._listed_at >= self.ttl:
+                try:
+                    names = self.conn.call(lambda ws: [w.title for w in ws.spreadsheet.worksheets()])
+                except Exception:
+                    # 跟索引一樣：列過一次的話，Sheet 連不上時先用舊清單
+                    if self._titles is None:
+                        raise
+                    logger.warning("listing archive tabs failed, using the cached list", exc_info=True)
+                    self._listed_at = time.monotonic() - max(0.0, self.ttl - STALE_RETRY)
+                    return list(self._titles)
+                self._titles = sorted((t for t in names if _TITLE_RE.match(t)), reverse=True)
+                self._listed_at = time.monotonic()
+            return list(self._titles)
+
+    def index(self, title):
+        index = get_index(f"{self.sheet_url}#{title}", "projected")
+        index.ttl = self.ttl
+        return index
+
+    def _find(self, method, key):
+        for title in self.titles():
+            row_num, record = getattr(self.index(title), method)(key, lambda: self.conn.worksheet(title))
+            if row_num is not None:
+                return title, row_num, record
+        return None, None, None
+
+    def find_email(self, email):
+        return self._find("find_email", email)
+
+    def find_case(self, case_id):
+        return self._find("find_case", case_id)
+
+    def _ensure_tab(self, title, headers):
+        if title in self.titles():
+            return
+        # 新分頁：建好後先寫表頭，之後跟熱分頁一樣用 append_rows
+        self.conn.call(lambda ws: ws.spreadsheet.add_worksheet(title=title, rows=1, cols=len(headers)), "write",
+                       idempotent=False)
+        self.conn.forget_tab(title)
+        self.conn.worksheet(title).append_row(list(headers))
+        with self._lock:
+            self._titles = sorted(set(self._titles or []) | {title}, reverse=True)
+
+    def append(self, title, rows, headers):
+        self._ensure_tab(title, headers)
+        ws = self.conn.worksheet(title)
+        index = self.index(title)
+        index.ensure(lambda: ws)
+        index.add_rows(rows, ws.append_rows(rows))
+
+    def delete(self, title, row_nums):
+        delete_rows(self.conn, row_nums, title)
+        self.index(title).invalidate()
+
+
+def ended_cases(records, today=None, grace_days=DEFAULT_GRACE_DAYS):
+    """[(列號, 資料)] 中合約期結束滿 grace_days 天的案件：{列號: 結束年份}。"""
+    from services.billing import schedule
+    from services.dashboard import to_frame
+
+    if not records:
+        return {}
+    today = today or date.today()
+    sched = schedule(to_frame(records), today)
+    cutoff = datetime.combine(today - timedelta(days=grace_days), datetime.min.time())
+    done = sched[sched["ended"] & (sched["term_end"] <= cutoff)]
+    return {int(row_num): int(end.year) for row_num, end in done["term_end"].items()}
+
+
+def archive_ended(coordinator, today=None, grace_days=DEFAULT_GRACE_DAYS, dry_run=False):
+    """把已結束的案件搬進封存分頁；回傳 {封存分頁: [case_id, ...]}。
+
+    讀熱分頁一次、每個年份 append 一次、熱分頁刪列一次。還有寫入在日誌裡等著套用的案件這次先不搬。
+    先寫封存再刪熱分頁：中途失敗重跑時，封存裡已有的 case_id 不會再寫一次。
+    """
+    storage = coordinator.storage
+    shelf = getattr(storage, "archive", None)
+    if shelf is None:
+        raise ValueError("封存只支援 Google Sheet 後端 (storage backend = sheets)")
+    with coordinator.exclusive(), storage.moving_rows():
+        records = storage.all_records()
+        by_row = dict(records)
+        pending = coordinator.pending_cases()
+        groups = {}
+        for row_num, year in ended_cases(records, today, grace_days).items():
+            if str(by_row[row_num].get("case_id", "")).strip().lower() in pending:
+                continue
+            groups.setdefault(archive_title(year), []).append(row_num)
+        moved = {title: [by_row[r]["case_id"] for r in rows] for title, rows in groups.items()}
+        if dry_run or not groups:
+            return moved
+        headers = storage.headers
+        for title, row_nums in sorted(groups.items()):
+            rows = [[by_row[r].get(h, "") for h in headers] for r in row_nums
+                    if shelf.find_case(by_row[r]["case_id"])[0] is None]
+            if rows:
+                shelf.append(title, rows, headers)
+        storage.remove_rows([r for rows in groups.values() for r in rows])
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把合約期已結束的案件搬到每年的封存分頁")
+    parser.add_argument("--today", help="以這天計算 (YYYY-MM-DD)，預設今天")
+    parser.add_argument("--grace-days", type=int, default=DEFAULT_GRACE_DAYS, help="結束滿幾天才封存")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會封存的案件")
+    args = parser.parse_args(argv)
+
+    from services.storage import get_storage
+    from services.write_coordinator import WriteCoordinator
+
+    today = datetime.strptime(args.today, "%Y-%m-%d").date() if args.today else None
+    # 命令列不開寫入日誌：日誌檔屬於執行中的 app，這裡直接寫表
+    moved = archive_ended(WriteCoordinator(get_storage()), today, args.grace_days, args.dry_run)
+    for title, case_ids in sorted(moved.items()):
+        print(f"{title}: {len(case_ids)} 筆" + (" (dry run)" if args.dry_run else ""))
+        for case_id in case_ids:
+            print(f"  {case_id}")
+    if not moved:
+        print("沒有需要封存的案件")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
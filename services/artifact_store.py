@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+from services.settings import secret_section
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 3600
+# 過期檔案不必每次寫入都掃，隔一段時間順手清一次
+EVICT_INTERVAL = 600
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ArtifactStore:
+    """以內容 sha256 當 key 的磁碟檔案庫；session 只記 key，下載時才從檔案讀出。
+
+    超過 max_age 秒沒被寫入 / 讀取的檔案，以及總量超過 max_bytes 時最久沒用到的檔案會被刪除。
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._scan())
+        self._evicted_at = time.monotonic()
+
+    def _path(self, key):
+        if not _KEY_RE.match(key or ""):
+            raise ValueError(f"invalid artifact key: {key!r}")
+        return os.path.join(self.root, key[:2], key)
+
+    def _scan(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not _KEY_RE.match(name):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def put(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        with self._lock:
+            if os.path.exists(path):
+                # 內容相同就不重寫，只更新時間讓它晚一點被淘汰
+                os.utime(path)
+                return key
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先寫暫存檔再 rename，其他程序不會讀到寫一半的檔案
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._size += len(data)
+            if self._size > self.max_bytes or time.monotonic() - self._evicted_at > EVICT_INTERVAL:
+                self._evict()
+        return key
+
+    def path(self, key):
+        """檔案還在就回傳路徑 (並視為最近用過)，已被淘汰回傳 None。"""
+        try:
+            path = self._path(key)
+            os.utime(path)
+        except (ValueError, FileNotFoundError):
+            return None
+        return path
+
+    def read(self, key):
+        path = self.path(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def evict(self):
+        with self._lock:
+            return self._evict()
+
+    def _evict(self):
+        now = time.time()
+        files = sorted(self._scan(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for path, size, mtime in files:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self._size = total
+        self._evicted_at = time.monotonic()
+        return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """程序內共用的檔案庫，設定取自 st.secrets["artifacts"] (path / max_mb / max_age_hours)。"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            conf = secret_section("artifacts")
+            _store = ArtifactStore(
+                conf.get("path", os.path.join(tempfile.gettempdir(), "service-artifacts")),
+                max_bytes=int(float(conf.get("max_mb", DEFAULT_MAX_BYTES / 1024 / 1024)) * 1024 * 1024),
+                max_age=float(conf.get("max_age_hours", DEFAULT_MAX_AGE / 3600)) * 3600,
+            )
+        return _store
@@ -0,0 +1,147 @@
+"""付款與續約排程：一次算完整張表的下次付款日、本期結束日與續約期間，並批次排入提醒信。
+
+    python -m services.billing                     # 今天該寄的提醒
+    python -m services.billing --today 2026-03-01 --dry-run
+    python -m services.billing --notify-clients    # 另外寄給各客戶
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from services.document_utils import MONTHLY_PLAN, MONTHLY_TERM_DAYS, QUARTERLY_TERM_DAYS
+
+# 季繳「續約應於屆滿前 7 日另行協議」；月繳同樣在本期結束前 7 天提醒
+RENEWAL_NOTICE_DAYS = 7
+# 付款日前幾天寄提醒
+PAY_REMINDER_DAYS = 3
+DEFAULT_PAY_DAY = 5
+
+
+def _days(values):
+    return pd.to_timedelta(values, unit="D")
+
+
+def _dates(col):
+    # dashboard.to_frame 已轉好的欄位直接用；原始字串才解析
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    return pd.to_datetime(col.astype(str), format="%Y-%m-%d", errors="coerce")
+
+
+def schedule(df, today=None):
+    """df 需有 case_id / plan / start_date / pay_day / pay_date；回傳以相同 index 排好的排程表。
+
+    全部用欄位運算：不論幾列都只是幾次向量化的日期加減。
+    """
+    today = pd.Timestamp(today or date.today()).normalize()
+    start = _dates(df["start_date"])
+    monthly = (df["plan"] == MONTHLY_PLAN).to_numpy()
+
+    # 本期：月繳每 30 天一期 (尚未開始的算第 0 期)，季繳只有一期
+    elapsed = (today - start).dt.days.fillna(0).clip(lower=0).to_numpy()
+    term_no = np.where(monthly, elapsed // MONTHLY_TERM_DAYS, 0)
+    term_start = start + _days(term_no * MONTHLY_TERM_DAYS)
+    term_end = term_start + _days(np.where(monthly, MONTHLY_TERM_DAYS, QUARTERLY_TERM_DAYS))
+
+    # 月繳下次付款日：本月的 pay_day 已過就取下個月 (pay_day 限 1~28，每個月都有這天)
+    pay_day = pd.to_numeric(df["pay_day"], errors="coerce").fillna(DEFAULT_PAY_DAY).clip(1, 28).astype(int).to_numpy()
+    this_month = today - pd.Timedelta(days=today.day - 1)
+    next_month = this_month + pd.DateOffset(months=1)
+    month_base = np.where(pay_day >= today.day, this_month.to_datetime64(), next_month.to_datetime64())
+    monthly_due = month_base + _days(pay_day - 1).to_numpy()
+    # 季繳一次付清：pay_date 還沒到才有下次付款日
+    pay_date = _dates(df["pay_date"])
+    quarterly_due = pay_date.where(pay_date >= today)
+    next_due = pd.Series(np.where(monthly, monthly_due, quarterly_due.to_numpy()), index=df.index)
+    next_due = next_due.where(start.notna() & (df["case_id"] != ""))
+
+    renewal_open = term_end - _days(RENEWAL_NOTICE_DAYS)
+    out = pd.DataFrame({
+        "case_id": df["case_id"],
+        "party_a": df["party_a"],
+        "Email": df["Email"],
+        "plan": df["plan"],
+        "term_start": term_start,
+        "term_end": term_end,
+        "next_due": next_due,
+        "renewal_open": renewal_open,
+    }, index=df.index)
+    out["days_to_due"] = (out["next_due"] - today).dt.days
+    out["in_renewal_window"] = (renewal_open <= today) & (today < term_end)
+    # 季繳不自動續約：過了結束日就是已到期
+    out["ended"] = ~monthly & (term_end <= today)
+    return out[start.notna() & (df["case_id"] != "")]
+
+
+def due_reminders(sched, today=None):
+    """今天該寄的提醒：付款日前 PAY_REMINDER_DAYS 天，以及續約期間開始當天。"""
+    today = pd.Timestamp(today or date.today()).normalize()
+    pay = sched[sched["days_to_due"] == PAY_REMINDER_DAYS].assign(kind="payment")
+    renew = sched[sched["renewal_open"] == today].assign(kind="renewal")
+    return pd.concat([pay, renew]).sort_values(["kind", "next_due", "case_id"])
+
+
+def _client_body(row):
+    if row.kind == "payment":
+        return (f"{row.party_a} 您好：\n\n提醒您，案件 {row.case_id}（{row.plan}）的服務費用"
+                f"應於 {row.next_due:%Y-%m-%d} 前支付。\n若已付款請忽略此信，謝謝！")
+    return (f"{row.party_a} 您好：\n\n案件 {row.case_id} 本期將於 {row.term_end:%Y-%m-%d} 屆滿，"
+            f"如需續約或調整方案，請於屆滿前與我聯繫，謝謝！")
+
+
+def queue_reminders(reminders, dispatcher, notify_clients=False, today=None):
+    """一份彙整信給自己；notify_clients=True 時另外每位客戶一封。回傳排入的訊息數。"""
+    if reminders.empty:
+        return 0
+    today = pd.Timestamp(today or date.today()).normalize()
+    lines = [f"[{'付款' if r.kind == 'payment' else '續約'}] {r.case_id} {r.party_a} "
+             f"{'付款日 ' + format(r.next_due, '%Y-%m-%d') if r.kind == 'payment' else '期滿 ' + format(r.term_end, '%Y-%m-%d')}"
+             for r in reminders.itertuples()]
+    queued = int(dispatcher.submit(f"【提醒彙整】{today:%Y-%m-%d} 共 {len(lines)} 筆", "\n".join(lines)) is not None)
+    if notify_clients:
+        for r in reminders[reminders["Email"] != ""].itertuples():
+            subject = "【付款提醒】" if r.kind == "payment" else "【續約提醒】"
+            queued += int(dispatcher.submit(f"{subject}{r.case_id}", _client_body(r), receiver=r.Email) is not None)
+    return queued
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="計算付款 / 續約排程並寄出今天的提醒")
+    parser.add_argument("--today", type=_parse_date, default=None, help="以這天為基準 (YYYY-MM-DD)，預設今天")
+    parser.add_argument("--dry-run", action="store_true", help="只列出提醒，不寄信")
+    parser.add_argument("--notify-clients", action="store_true", help="除了彙整信，另外寄給各客戶")
+    args = parser.parse_args(argv)
+
+    from services.dashboard import load_frame
+    from services.storage import get_storage
+
+    df = load_frame(get_storage())
+    started = time.perf_counter()
+    sched = schedule(df, args.today)
+    reminders = due_reminders(sched, args.today)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{len(sched)} 筆案件，{len(reminders)} 筆提醒，排程計算 {elapsed:.1f} ms", file=sys.stderr)
+    if args.dry_run:
+        print(reminders[["kind", "case_id", "party_a", "next_due", "term_end"]].to_string(index=False))
+        return 0
+
+    from services.mailer import get_dispatcher
+
+    dispatcher = get_dispatcher()
+    queued = queue_reminders(reminders, dispatcher, args.notify_clients, args.today)
+    # 寄信是背景執行緒，等佇列清空再結束程序
+    dispatcher.flush(timeout=300)
+    print(f"已排入 {queued} 封提醒信", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""月底批次重產合約。
+
+    python -m services.bulk_contracts --out contracts.zip --workers 4
+    python -m services.bulk_contracts --csv export.csv --plan 每月 --start-from 2026-01-01
+
+個別案件產生失敗 (例如缺欄位) 不會中斷整批：其他合約照樣寫進 zip，失敗的列在 zip 裡的 errors.csv。
+"""
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+
+from services.document_utils import PROVIDER_NAME, render_contract
+
+# 套版一定要有的欄位 (Email / case_id / start_date 在 select_rows 已篩過)
+REQUIRED_FIELDS = ("party_a", "plan")
+ERRORS_ENTRY = "errors.csv"
+
+
+def _parse_date(value):
+    value = str(value or "").strip()
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+def load_rows(csv_path=None):
+    if csv_path:
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            return list(csv.DictReader(f))
+    from services.sheet_client import get_connection
+    return get_connection().worksheet().get_all_records()
+
+
+def select_rows(rows, plan=None, start_from=None, start_to=None):
+    for row in rows:
+        if not row.get("Email") or not row.get("case_id"):
+            continue
+        try:
+            start = _parse_date(row.get("start_date"))
+        except ValueError:
+            continue
+        if start is None:
+            continue
+        if plan and plan not in str(row.get("plan", "")):
+            continue
+        if (start_from and start < start_from) or (start_to and start > start_to):
+            continue
+        yield row, start
+
+
+def _render(row, start):
+    # 在子程序執行；每個子程序第一次呼叫時各自建一次模板
+    missing = [k for k in REQUIRED_FIELDS if not str(row.get(k) or "").strip()]
+    if missing:
+        raise ValueError(f"缺少欄位：{', '.join(missing)}")
+    try:
+        pay_dt = _parse_date(row.get("pay_date"))
+    except ValueError:
+        pay_dt = None
+    data = render_contract(row["party_a"], row["plan"], start, row.get("pay_day"), pay_dt, row["case_id"],
+                           provider_name=row.get("provider") or PROVIDER_NAME)
+    return row["case_id"], data
+
+
+def _entry_name(case_id, used):
+    name = re.sub(r'[\\/:*?"<>|]', "_", str(case_id))
+    candidate, n = f"合約_{name}.docx", 1
+    while candidate in used:
+        n += 1
+        candidate = f"合約_{name}_{n}.docx"
+    used.add(candidate)
+    return candidate
+
+
+def _errors_csv(errors):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["case_id", "Email", "error"])
+    writer.writerows(errors)
+    # 帶 BOM：Excel 直接開才不會亂碼
+    return buf.getvalue().encode("utf-8-sig")
+
+
+def render_all(rows, out_path, workers=None):
+    """把合約邊產生邊寫進 zip；同時在跑的工作數有上限，記憶體只留當下這幾份。
+
+    回傳 (成功份數, 失敗的 [(case_id, Email, 原因)], 秒數)；有失敗時 zip 裡另外寫一份 errors.csv。
+    """
+    workers = workers or os.cpu_count() or 1
+    window = workers * 2
+    used, done, errors = set(), 0, []
+    started = time.perf_counter()
+    rows = iter(rows)
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            zipfile.ZipFile(out_path, "w", zipfile.ZIP_STORED) as zf:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < window:
+                try:
+                    row, start = next(rows)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(_render, row, start)] = row
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                row = pending.pop(future)
+                try:
+                    case_id, data = future.result()
+                except Exception as e:
+                    errors.append((row.get("case_id", ""), row.get("Email", ""), str(e) or type(e).__name__))
+                    continue
+                # docx 本身已是壓縮檔，存進 zip 時不再壓一次
+                zf.writestr(_entry_name(case_id, used), data)
+                done += 1
+        if errors:
+            zf.writestr(ERRORS_ENTRY, _errors_csv(errors))
+    elapsed = time.perf_counter() - started
+    return done, errors, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次產生所有案件的 Word 合約並輸出成 zip")
+    parser.add_argument("--out", default=f"contracts_{date.today():%Y%m%d}.zip", help="輸出 zip 路徑")
+    parser.add_argument("--csv", help="改讀 Google Sheet 匯出的 CSV，不連線")
+    parser.add_argument("--workers", type=int, default=None, help="平行程序數 (預設 CPU 數)")
+    parser.add_argument("--plan", help="只處理方案名稱包含此字串的案件，例如 每月 / 三個月")
+    parser.add_argument("--start-from", type=_parse_date, help="start_date 下限 (YYYY-MM-DD)")
+    parser.add_argument("--start-to", type=_parse_date, help="start_date 上限 (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    rows = select_rows(load_rows(args.csv), args.plan, args.start_from, args.start_to)
+    done, errors, elapsed = render_all(rows, args.out, args.workers)
+    rate = done / elapsed if elapsed else 0.0
+    print(f"{done} 份合約 -> {args.out}，耗時 {elapsed:.2f}s，{rate:.1f} 份/秒", file=sys.stderr)
+    for case_id, email, reason in errors:
+        print(f"{case_id} ({email})：{reason}", file=sys.stderr)
+    if errors:
+        print(f"{len(errors)} 份失敗，明細在 zip 裡的 {ERRORS_ENTRY}", file=sys.stderr)
+    return 1 if errors and not done else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
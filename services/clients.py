@@ -0,0 +1,101 @@
+from datetime import datetime
+import hashlib
+import secrets
+
+from services.document_utils import PROVIDER_NAME
+from services.metrics import timed
+from services.sheet_client import configured_sheet_url
+from services.write_coordinator import get_coordinator
+
+def make_hash(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def check_password(input_pw, db_pw):
+    if len(db_pw) == 64:
+        return make_hash(input_pw) == db_pw
+    return input_pw == db_pw
+
+def make_case_id(name, day=None):
+    # 名稱_日期 加上隨機尾碼：同名客戶同一天建檔也不會撞號
+    return f"{name}_{(day or datetime.now()):%Y%m%d}_{secrets.token_hex(3)}"
+
+# =========================================================
+# 資料處理邏輯 (嚴格對應 CSV 順序)
+# =========================================================
+@timed()
+def find_user_row(email):
+    # Sheet 後端走程序內共用索引，SQLite 後端走 Email 索引；還在寫入日誌裡的新資料優先
+    return get_coordinator(configured_sheet_url()).find_by_email(email)
+
+def build_phase1_row(data_dict):
+    def s(key): return data_dict.get(key, "")
+    hashed_default = make_hash("dennis")
+    # Email(1), case_id(2), party_a(3), provider(4), plan(5), start_date(6), pay_day(7), pay_date(8)
+    row = [
+        s("Email"), s("case_id"), s("party_a"), PROVIDER_NAME, s("plan"), 
+        str(s("start_date")), s("pay_day"), str(s("pay_date")) if s("pay_date") else "",
+        "FALSE", "FALSE", "FALSE", "FALSE", # chk boxes (9-12)
+        "", "", # URLs (13-14)
+        "", "", "", # Comps (15-17)
+        "", "", "", "", # Problems & Budget (18-21)
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), # last_update (22)
+        "contract", s("plan"), f"{s('case_id')} ({s('party_a')})", # 23-25
+        "FALSE", "FALSE", hashed_default # 26-28
+    ]
+    return row
+
+@timed()
+def save_phase1_new(data_dict):
+    # 鎖住這個 Email 再檢查一次：兩個 session 同時建檔同一信箱時只會寫入一列 (另一個丟 DuplicateClientError)
+    return get_coordinator(configured_sheet_url()).register(build_phase1_row(data_dict), data_dict["Email"])
+
+@timed()
+def save_phase1_bulk(data_dicts):
+    # 批次建檔：欄位順序與 save_phase1_new 相同，整批一次 append_rows；回傳 (列號, 略過的 Email)
+    return get_coordinator(configured_sheet_url()).register_many([build_phase1_row(d) for d in data_dicts],
+                                                    [d["Email"] for d in data_dicts])
+
+# 以下更新都用 case_id 在寫入當下重新找列 (session 裡的列號可能因為別人刪列而過時)，
+# version 是上次讀到的 last_update_at，別的 session 先改過就丟 StaleWriteError；回傳新的 last_update_at
+
+# --- [關鍵修改] 更新合約方案的函式 ---
+@timed()
+def update_phase1(case_id, plan, start_date, pay_day, pay_date, version=None, email=None):
+    # Sheet 欄位順序: plan(5), start_date(6), pay_day(7), pay_date(8)
+    # 同步更新後面用來做合約紀錄的欄位 (第 24 欄也是 plan)
+    # raw 寫入：日期與 last_update_at 保持 YYYY-MM-DD 字串，與建檔時 append_row 寫入的格式一致
+    return get_coordinator(configured_sheet_url()).update(
+        {5: plan, 6: str(start_date), 7: pay_day, 8: str(pay_date) if pay_date else "", 24: plan},
+        case_id=case_id, email=email, expected_version=version, raw=True)
+
+@timed()
+def update_phase2(case_id, p2_data, version=None, email=None):
+    cells = []
+    def Cell(col, val): return (col, str(val))
+    # 勾選框
+    cells.append(Cell(9, p2_data["chk_ad_account"]))
+    cells.append(Cell(10, p2_data["chk_pixel"]))
+    cells.append(Cell(11, p2_data["chk_fanpage"]))
+    cells.append(Cell(12, p2_data["chk_bm"]))
+    # 網址
+    cells.append(Cell(13, p2_data["fanpage_url"]))
+    cells.append(Cell(14, p2_data["landing_url"]))
+    # 競品
+    cells.append(Cell(15, p2_data["comp1"]))
+    cells.append(Cell(16, p2_data["comp2"]))
+    cells.append(Cell(17, p2_data["comp3"]))
+    # 策略問題
+    cells.append(Cell(18, p2_data["who_problem"]))
+    cells.append(Cell(19, p2_data["what_problem"]))
+    cells.append(Cell(20, p2_data["how_solve"]))
+    cells.append(Cell(21, p2_data["budget"]))
+    # 系統資訊 (last_update_at 由 coordinator 蓋上)
+    cells.append(Cell(26, p2_data["chk_remote"]))
+    cells.append(Cell(27, p2_data["chk_creatives"]))
+    return get_coordinator(configured_sheet_url()).update(dict(cells), case_id=case_id, email=email,
+                                             expected_version=version, raw=True)
+
+@timed()
+def update_password(case_id, new_pw, email=None):
+    # 改密碼不比對版本：不會跟表單內容互相覆蓋
+    return get_coordinator(configured_sheet_url()).update({28: make_hash(new_pw)}, case_id=case_id, email=email)
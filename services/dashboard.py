@@ -0,0 +1,99 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from services.storage import SHEET_COLUMNS
+
+CHECK_COLUMNS = ["chk_ad_account", "chk_pixel", "chk_fanpage", "chk_bm", "chk_remote", "chk_creatives"]
+LINK_COLUMNS = ["fanpage_url", "landing_url"]
+
+STAGES = ["未建檔", "第一階段", "第二階段進行中", "第二階段完成"]
+
+# 整張表讀一次後快取 (秒)；總覽不需要即時，免得每個篩選都去讀 Sheet
+FRAME_TTL = 60
+
+
+def to_frame(records):
+    """[(列號, 資料), ...] -> DataFrame (index 為 Sheet 列號)，並補上衍生欄位。"""
+    df = pd.DataFrame.from_records([r for _, r in records], index=pd.Index([n for n, _ in records], name="row_num"),
+                                   columns=SHEET_COLUMNS)
+    # 密碼雜湊不進總覽
+    df = df.drop(columns=["password"]).fillna("")
+    for col in CHECK_COLUMNS:
+        df[col] = df[col].astype(str).str.strip().str.upper() == "TRUE"
+    for col in ["Email", "case_id", "party_a", "plan"] + LINK_COLUMNS:
+        df[col] = df[col].astype(str).str.strip()
+    df["start_date"] = pd.to_datetime(df["start_date"].astype(str), format="%Y-%m-%d", errors="coerce")
+    done = df[CHECK_COLUMNS].sum(axis=1)
+    df["checks_done"] = done
+    df["stage"] = np.select(
+        [df["case_id"] == "", done == 0, done < len(CHECK_COLUMNS)],
+        STAGES[:3], default=STAGES[3])
+    df["missing_links"] = (df[LINK_COLUMNS] == "").any(axis=1)
+    return df
+
+
+_frame = None
+_frame_at = None
+_frame_lock = threading.Lock()
+
+
+def load_frame(storage, ttl=FRAME_TTL, force=False):
+    global _frame, _frame_at
+    with _frame_lock:
+        if force or _frame is None or time.monotonic() - _frame_at >= ttl:
+            _frame = to_frame(storage.all_records())
+            _frame_at = time.monotonic()
+        return _frame
+
+
+def pipeline_stats(df):
+    total = len(df)
+    stage_counts = df["stage"].value_counts().reindex(STAGES, fill_value=0)
+    return {
+        "total": total,
+        "stages": stage_counts.to_dict(),
+        # 各確認事項完成率 (只算已建檔的案件)
+        "check_rates": df.loc[df["case_id"] != "", CHECK_COLUMNS].mean().fillna(0).round(3).to_dict(),
+        "missing_links": int(df["missing_links"].sum()),
+    }
+
+
+def plan_mix(df):
+    plans = df.loc[df["plan"] != "", "plan"]
+    return plans.value_counts().rename_axis("plan").reset_index(name="count")
+
+
+def upcoming_starts(df, days=14, today=None):
+    today = pd.Timestamp(today or pd.Timestamp.today().normalize())
+    mask = df["start_date"].between(today, today + pd.Timedelta(days=days))
+    return df.loc[mask, ["case_id", "party_a", "plan", "start_date", "stage"]].sort_values("start_date")
+
+
+def missing_links(df):
+    return df.loc[df["missing_links"] & (df["case_id"] != ""), ["case_id", "party_a", "Email"] + LINK_COLUMNS]
+
+
+def filter_frame(df, query="", stages=None, plans=None, missing_only=False):
+    mask = pd.Series(True, index=df.index)
+    if query:
+        q = query.strip().lower()
+        mask &= (df["Email"].str.lower().str.contains(q, regex=False)
+                 | df["case_id"].str.lower().str.contains(q, regex=False)
+                 | df["party_a"].str.lower().str.contains(q, regex=False))
+    if stages:
+        mask &= df["stage"].isin(stages)
+    if plans:
+        mask &= df["plan"].isin(plans)
+    if missing_only:
+        mask &= df["missing_links"]
+    return df[mask]
+
+
+def paginate(df, page, page_size=50):
+    """回傳 (該頁資料, 總頁數)；page 從 1 開始，超出範圍時夾回有效頁。"""
+    pages = max(1, -(-len(df) // page_size))
+    page = min(max(1, page), pages)
+    return df.iloc[(page - 1) * page_size: page * page_size], pages
@@ -0,0 +1,282 @@
+import hashlib
+import io
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from services.metrics import record_bytes, timed
+
+# 乙方與匯款資訊 (合約預設值)
+PROVIDER_NAME = "高如慧"
+BANK_NAME = "中國信託商業銀行"
+BANK_CODE = "822"
+ACCOUNT_NUMBER = "783540208870"
+
+MONTHLY_PLAN = "17,000元/月（每月付款）"
+QUARTERLY_PLAN = "45,000元/三個月（一次付款）"
+# 合約期間：月繳 30 天自動續約，季繳 90 天 (續約另議)；付款與續約排程 (services/billing.py) 也用這兩個值
+MONTHLY_TERM_DAYS = 30
+QUARTERLY_TERM_DAYS = 90
+DOCUMENT_XML = "word/document.xml"
+
+# python-docx 只有排版骨架時才需要，延後到第一次 get_template 才 import。
+# 合約骨架只在每種方案第一次用到時排版一次，之後每次只替換 {{欄位}}。
+# 欄位都放在同一個 run 裡，所以在 document.xml 層級直接做字串替換即可。
+_FIELD_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+def set_run_font(run, size=10.5, bold=False):
+    from docx.oxml.ns import qn
+    from docx.shared import Pt
+
+    run.font.name = "Microsoft JhengHei"
+    run.font.size = Pt(size)
+    run.bold = bold
+    run._element.rPr.rFonts.set(qn("w:eastAsia"), "Microsoft JhengHei")
+
+
+def _build_skeleton(monthly, with_case_num):
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Cm, Pt
+
+    doc = Document()
+
+    # 設定頁邊距
+    section = doc.sections[0]
+    section.top_margin = Cm(2.0)
+    section.bottom_margin = Cm(2.0)
+    section.left_margin = Cm(2.5)
+    section.right_margin = Cm(2.5)
+
+    # 設定預設字體與行距
+    style = doc.styles['Normal']
+    style.paragraph_format.line_spacing = 1.5
+    style.paragraph_format.space_after = Pt(0)
+
+    # 1. 標題
+    heading = doc.add_paragraph()
+    heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    run = heading.add_run("廣告投放服務合約書")
+    set_run_font(run, size=18, bold=True)
+
+    if with_case_num:
+        sub = doc.add_paragraph()
+        sub.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        run_sub = sub.add_run("案件編號：{{CASE_NUM}}")
+        set_run_font(run_sub, size=10)
+
+    # 2. 前言
+    doc.add_paragraph("")
+    p_intro = doc.add_paragraph()
+    run_intro = p_intro.add_run("立合約書人：委託人 {{PARTY_A}}（以下簡稱甲方）與服務執行人 {{PROVIDER_NAME}}（以下簡稱乙方），茲就廣告投放服務事宜，經雙方同意訂立本合約，條款如下：")
+    set_run_font(run_intro, size=11)
+
+    # 定義方案參數
+    if monthly:
+        period_text = "自 {{START_DATE}} 起至 {{END_DATE}} 止，為期 1 個月。本合約屆滿前若雙方未提出終止要求，則自動續約 1 個月，以此類推。"
+        fee_text = "新台幣壹萬柒仟元整（NT$17,000）／月。"
+        pay_logic = "應於每月 {{PAY}} 日前支付當期費用。"
+    else:
+        period_text = "自 {{START_DATE}} 起至 {{END_DATE}} 止，為期 3 個月。續約應於屆滿前 7 日另行協議。"
+        fee_text = "新台幣肆萬伍仟元整（NT$45,000）／三個月。"
+        pay_logic = "應於 {{PAY}} 前一次性支付全額費用。"
+
+    # 3. 完整 14 條款
+    clauses = [
+        ("第一條：合約期間", [period_text]),
+        ("第二條：服務內容", [
+            "1. 廣告策略規劃與上架執行。",
+            "2. 每日監控廣告投放狀況與數據維護。",
+            "3. 提供簡易週報（包含數據摘要與下週優化方向）。",
+            "4. 視需求提供文案與 Landing Page 優化建議。"
+        ]),
+        ("第三條：投放平台與費用", [
+            "1. 本服務以 Meta（Facebook/Instagram）平台為主。",
+            "2. 廣告投放實際消耗之「廣告費」不包含在服務費內，由甲方直接支付予平台方。"
+        ]),
+        ("第四條：甲方配合義務", [
+            "1. 甲方應提供必要之資產存取權限（如粉專管理員、廣告帳號權限）。",
+            "2. 因乙方目前帳號限制，甲方同意配合以遠端連線（如 Google Remote Desktop）方式進行必要之後台操作。",
+            "3. 甲方應確保廣告素材（圖片、影片）無侵權事宜。"
+        ]),
+        ("第五條：服務費用與給付方式", [
+            f"1. 服務費用：{fee_text}",
+            f"2. 支付時間：{pay_logic}",
+            "3. 匯款資訊：{{BANK_NAME}} ({{BANK_CODE}}) 帳號：{{ACCOUNT_NUMBER}}"
+        ]),
+        ("第六條：稅務說明", [
+            "1. 乙方為個人工作室（自然人），本服務費用不開立統一發票。",
+            "2. 若甲方需報支費用，請自行依稅法規定開立勞務報酬單，或處理相關代扣繳稅額。"
+        ]),
+        ("第七條：成果歸屬與智慧財產權", [
+            "1. 廣告投放產生之數據與權限歸甲方所有。",
+            "2. 乙方所撰寫之文案與投放策略，於合約存續期間授權甲方使用。"
+        ]),
+        ("第八條：保密義務", [
+            "1. 雙方應對合約內容及因履行本合約所獲知之對方商業機密負保密義務。",
+            "2. 保密期間自合約簽署日起至終止後兩年止。"
+        ]),
+        ("第九條：免責聲明與風險承擔", [
+            "1. 乙方不保證特定成效指標（如特定 ROAS 或點擊數）。",
+            "2. 因平台政策異動、系統故障或不可抗力因素導致廣告中斷，乙方不負賠償責任。"
+        ]),
+        ("第十條：合約變更", ["本合約之任何修改、變更或補充，均應由雙方以書面（含 LINE/Email）為之。"]),
+        ("第十一條：損害賠償", ["如因一方違反本合約導致他方受損，賠償限額以本合約最近一期已支付之服務費用為上限。"]),
+        ("第十二條：合約終止", [
+            "1. 甲方若欲提前終止，應於 14 日前通知乙方。",
+            "2. 已支付之月費或季付優惠費用，於合約啟動後恕不退還。"
+        ]),
+        ("第十三條：爭議處理與管轄法院", ["如因本合約產生爭議，雙方同意以台灣台北地方法院為第一審管轄法院。"]),
+        ("第十四條：其他", ["本合約自簽署日起生效。本合約乙式兩份，由雙方各執一份為憑。"])
+    ]
+
+    for title, contents in clauses:
+        p_t = doc.add_paragraph()
+        r_t = p_t.add_run(title)
+        set_run_font(r_t, size=11, bold=True)
+        for c in contents:
+            p_i = doc.add_paragraph()
+            p_i.paragraph_format.left_indent = Cm(0.75)
+            r_i = p_i.add_run(c)
+            set_run_font(r_i, size=10.5)
+
+    doc.add_paragraph("\n")
+
+    # 4. 簽署欄位
+    table = doc.add_table(rows=1, cols=2)
+    table.autofit = False
+
+    # 甲方
+    c1 = table.cell(0, 0).paragraphs[0]
+    run1 = c1.add_run("甲方（委託方）：\n{{PARTY_A}}\n\n簽署人：________________\n\n日期：   年   月   日")
+    set_run_font(run1, size=11)
+
+    # 乙方
+    c2 = table.cell(0, 1).paragraphs[0]
+    run2 = c2.add_run("乙方（執行方）：\n{{PROVIDER_NAME}}\n\n簽署人：________________\n\n日期：   年   月   日")
+    set_run_font(run2, size=11)
+
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+class ContractTemplate:
+    """預先排好的合約：其他 zip 成員原封不動，只重寫 document.xml。"""
+
+    def __init__(self, docx_bytes):
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as src:
+            xml = src.read(DOCUMENT_XML).decode("utf-8")
+            self.doc_info = src.getinfo(DOCUMENT_XML)
+            # 不含 document.xml 的 zip，渲染時直接複製位元組再補上 document.xml，不必重新壓縮其他成員
+            base = io.BytesIO()
+            with zipfile.ZipFile(base, "w", zipfile.ZIP_DEFLATED) as dst:
+                for info in src.infolist():
+                    if info.filename != DOCUMENT_XML:
+                        dst.writestr(info, src.read(info.filename))
+            self.base_zip = base.getvalue()
+        # 欄位值可能有前後空白，含欄位的 <w:t> 一律保留空白
+        xml = re.sub(r"<w:t>(?=[^<]*\{\{)", '<w:t xml:space="preserve">', xml)
+        # 切成 [文字, 欄位名, 文字, 欄位名, ...]，奇數位置是欄位
+        self.parts = _FIELD_RE.split(xml)
+
+    def render(self, fields):
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = escape(str(fields[parts[i]]))
+        buf = io.BytesIO(self.base_zip)
+        buf.seek(0, io.SEEK_END)
+        with zipfile.ZipFile(buf, "a", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(self.doc_info, "".join(parts).encode("utf-8"))
+        return buf.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_template(monthly, with_case_num):
+    return ContractTemplate(_build_skeleton(monthly, with_case_num))
+
+
+class DocxCache:
+    """以輸入內容雜湊為 key 的 LRU，總大小超過 max_bytes 就淘汰最久沒用的。"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# 所有 session 共用；同樣的輸入再按一次「生成合約」直接回傳快取
+docx_cache = DocxCache()
+
+
+def contract_key(*inputs):
+    return hashlib.sha256("\x1f".join(str(v) for v in inputs).encode("utf-8")).hexdigest()
+
+
+def render_contract(party_a, payment_opt, start_dt, pay_day, pay_dt, case_num,
+                    provider_name=PROVIDER_NAME, bank_name=BANK_NAME, bank_code=BANK_CODE, account_number=ACCOUNT_NUMBER):
+    """不經快取直接套版 (批次產生時用，避免把每份合約都塞進 LRU)。"""
+    monthly = payment_opt == MONTHLY_PLAN
+    end_dt = start_dt + timedelta(days=MONTHLY_TERM_DAYS if monthly else QUARTERLY_TERM_DAYS)
+    fields = {
+        "CASE_NUM": case_num or "",
+        "PARTY_A": party_a,
+        "PROVIDER_NAME": provider_name,
+        "START_DATE": start_dt,
+        "END_DATE": end_dt,
+        "PAY": pay_day if monthly else pay_dt,
+        "BANK_NAME": bank_name,
+        "BANK_CODE": bank_code,
+        "ACCOUNT_NUMBER": account_number,
+    }
+    return get_template(monthly, bool(case_num)).render(fields)
+
+
+@timed()
+def generate_docx_bytes(party_a, email, payment_opt, start_dt, pay_day, pay_dt, case_num,
+                        provider_name=PROVIDER_NAME, bank_name=BANK_NAME, bank_code=BANK_CODE, account_number=ACCOUNT_NUMBER):
+    key = contract_key(party_a, email, payment_opt, start_dt, pay_day, pay_dt, case_num,
+                       provider_name, bank_name, bank_code, account_number)
+    data = docx_cache.get(key)
+    if data is None:
+        data = render_contract(party_a, payment_opt, start_dt, pay_day, pay_dt, case_num,
+                               provider_name, bank_name, bank_code, account_number)
+        docx_cache.put(key, data)
+    record_bytes(len(data))
+    return data
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from services.quota import background
+from services.shared_cache import file_lock
+
+logger = logging.getLogger(__name__)
+
+# 全部套用完、檔案又超過這個大小時就清空重來
+COMPACT_BYTES = 4 * 1024 * 1024
+
+
+class JournalInUseError(RuntimeError):
+    """日誌檔已經被另一個程序開著。"""
+
+
+class WriteJournal:
+    """本機 append-only JSONL 寫入日誌：先 fsync 再回覆使用者，由背景執行緒依序套用到 Sheet。
+
+    每筆 entry 帶遞增的 seq；已套用到第幾筆記在 <path>.checkpoint。程序中途掛掉時，
+    重啟後把 checkpoint 之後的 entry 再套用一次 (套用端要能重複執行)。
+    apply_batch(entries) 成功回傳即視為這批已套用；丟例外則整批保留，稍後重試。
+    一個日誌檔只能有一個程序使用 (<path>.lock)：兩個程序重播同一份日誌會把別人的寫入再套用一次。
+    """
+
+    def __init__(self, path, apply_batch, interval=0.5, batch_size=200, max_backoff=60):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint"
+        self.apply_batch = apply_batch
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        # 整個程序存活期間都持有檔案鎖，程序結束時由作業系統釋放
+        self._owner = file_lock(path + ".lock", blocking=False)
+        if not self._owner.__enter__():
+            self._owner.__exit__(None, None, None)
+            raise JournalInUseError(f"{path} 已被其他程序使用，每個 replica 要設定自己的日誌路徑")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending = []
+        self.applied_seq = self._read_checkpoint()
+        self.seq = self.applied_seq
+        self._recover()
+        self._file = open(path, "a", encoding="utf-8")
+        self._thread = None
+
+    # --- 啟動時復原 ---
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _recover(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            lines = f.read().split(b"\n")
+        good = 0
+        for line in lines:
+            if not line.strip():
+                good += len(line) + 1
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 寫到一半當掉的最後一行：丟掉，後面的內容也不可信
+                logger.warning("journal %s: dropping torn record at byte %d", self.path, good)
+                break
+            good += len(line) + 1
+            self.seq = max(self.seq, entry["seq"])
+            if entry["seq"] > self.applied_seq:
+                self._pending.append(entry)
+        with open(self.path, "r+b") as f:
+            f.truncate(min(good, os.path.getsize(self.path)))
+
+    # --- 寫入 ---
+    def append(self, entry):
+        """寫入並 fsync，回傳這筆的 seq。"""
+        with self._lock:
+            self.seq += 1
+            entry = dict(entry, seq=self.seq, at=time.time())
+            self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending.append(entry)
+        self._start()
+        self._wake.set()
+        return entry["seq"]
+
+    def pending(self):
+        with self._lock:
+            return list(self._pending)
+
+    def backlog(self):
+        with self._lock:
+            return len(self._pending)
+
+    # --- 背景套用 ---
+    def start(self):
+        self._start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._file.close()
+        self._owner.__exit__(None, None, None)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="journal-replayer", daemon=True)
+                self._thread.start()
+
+    def replay(self):
+        """套用一批；回傳套用筆數 (沒有待套用的回傳 0)。"""
+        with self._lock:
+            batch = self._pending[:self.batch_size]
+        if not batch:
+            return 0
+        self.apply_batch(batch)
+        with self._lock:
+            del self._pending[:len(batch)]
+            self.applied_seq = batch[-1]["seq"]
+            self._write_checkpoint()
+            if not self._pending and self._file.tell() > COMPACT_BYTES:
+                self._file.truncate(0)
+                self._file.seek(0)
+        return len(batch)
+
+    def flush(self, timeout=None):
+        """等所有 entry 套用完 (批次工作與測試用)，逾時回傳 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._wake.set()
+        while self.backlog():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def _write_checkpoint(self):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(self.applied_seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with background():
+                    while self.replay():
+                        pass
+                backoff = 1.0
+            except Exception:
+                # Sheet 忙碌或連不上：資料都還在日誌裡，等一下再試 (新的寫入照常記進日誌)
+                logger.exception("journal replay failed, retrying in %.0fs (%d pending)", backoff, self.backlog())
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,199 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from email.mime.text import MIMEText
+
+from services.metrics import measure, record_api_call
+from services.settings import secret_section
+
+logger = logging.getLogger(__name__)
+
+STATUS_LABELS = {
+    "held": "合併中，稍後寄出",
+    "queued": "排隊中",
+    "sending": "寄送中",
+    "retrying": "重試中",
+    "sent": "已寄出",
+    "failed": "寄送失敗",
+    "dropped": "佇列已滿，未寄出",
+}
+
+# 只保留最近這麼多筆寄送狀態，避免長時間執行時無限成長
+STATUS_HISTORY = 500
+
+
+class MailDispatcher:
+    """背景寄信：有界佇列 + 單一 worker thread + 重複使用同一條已登入的 SMTP 連線。
+
+    host/port/use_ssl 可調，測試時可以指向本機的 aiosmtpd (use_ssl=False、password 留空)。
+    """
+
+    def __init__(self, sender, password, receiver, host="smtp.gmail.com", port=465, use_ssl=True,
+                 maxsize=100, max_attempts=4, backoff=1.0, idle_timeout=60):
+        self.sender = sender
+        self.password = password
+        self.receiver = receiver
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue(maxsize)
+        self._ids = itertools.count(1)
+        self._status = OrderedDict()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # --- 對外介面 ---
+    def submit(self, subject, body, receiver=None, msg_id=None):
+        """排入佇列後立即回傳訊息編號；佇列滿時回傳 None。msg_id 為 hold() 預留的編號。"""
+        msg_id = msg_id or next(self._ids)
+        self._set_status(msg_id, "queued", subject=subject)
+        try:
+            self._queue.put_nowait((msg_id, subject, body, receiver or self.receiver))
+        except queue.Full:
+            self._set_status(msg_id, "dropped")
+            return None
+        self._start()
+        return msg_id
+
+    def hold(self, subject):
+        """先預留訊息編號 (狀態 held)，內容稍後再用 submit(msg_id=...) 寄出；通知合併用。"""
+        msg_id = next(self._ids)
+        self._set_status(msg_id, "held", subject=subject)
+        return msg_id
+
+    def status(self, msg_id):
+        with self._lock:
+            info = self._status.get(msg_id)
+            return dict(info) if info else None
+
+    def recent(self, limit=20):
+        with self._lock:
+            items = list(self._status.items())[-limit:]
+        return [dict(info, id=msg_id) for msg_id, info in reversed(items)]
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """等佇列清空 (給批次工作與測試用)，逾時回傳 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # --- 內部 ---
+    def _set_status(self, msg_id, status, **extra):
+        with self._lock:
+            info = self._status.setdefault(msg_id, {"attempts": 0, "error": None})
+            info.update(extra, status=status, updated_at=time.time())
+            self._status.move_to_end(msg_id)
+            while len(self._status) > STATUS_HISTORY:
+                self._status.popitem(last=False)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # 閒置太久就主動斷線，Gmail 本來也會把閒置連線踢掉
+                self._close()
+                continue
+            try:
+                self._deliver(*item)
+            except Exception as e:
+                # 任何沒預料到的錯誤都只算這一封失敗，worker 繼續處理後面的信
+                logger.exception("mail %s: delivery crashed", item[0])
+                self._close()
+                self._set_status(item[0], "failed", error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, msg_id, subject, body, receiver):
+        import smtplib
+
+        if not self.sender or not receiver:
+            self._set_status(msg_id, "failed", error='未設定 st.secrets["email"] 的寄件 / 收件信箱')
+            return
+        msg = MIMEText(body, 'plain', 'utf-8')
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = receiver
+        for attempt in range(1, self.max_attempts + 1):
+            self._set_status(msg_id, "sending", attempts=attempt)
+            try:
+                with measure("smtp.send"):
+                    self._connection().send_message(msg)
+                    record_api_call(len(msg.as_bytes()))
+                self._set_status(msg_id, "sent")
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                # 連線可能已壞，下次重試重新連線登入
+                self._close()
+                if attempt == self.max_attempts:
+                    self._set_status(msg_id, "failed", error=str(e))
+                    return
+                self._set_status(msg_id, "retrying", error=str(e))
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            except Exception as e:
+                # 編碼錯誤之類重試也不會好的錯誤：記下來，這封直接算失敗
+                logger.exception("mail %s: cannot send", msg_id)
+                self._close()
+                self._set_status(msg_id, "failed", error=str(e))
+                return
+
+    def _connection(self):
+        import smtplib
+
+        if self._server is None:
+            if self.use_ssl:
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.password:
+                server.login(self.sender, self.password)
+            self._server = server
+        return self._server
+
+    def _close(self):
+        import smtplib
+
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """程序內共用的寄信器，設定取自 st.secrets["email"]；沒有這個區塊時照常排隊，寄送時標記為失敗。"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            conf = secret_section("email")
+            _dispatcher = MailDispatcher(
+                conf.get("sender_email", ""), conf.get("sender_password", ""), conf.get("receiver_email", ""),
+                host=conf.get("smtp_host", "smtp.gmail.com"),
+                port=int(conf.get("smtp_port", 465)),
+                use_ssl=bool(conf.get("smtp_ssl", True)),
+            )
+        return _dispatcher
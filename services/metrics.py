@@ -0,0 +1,162 @@
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# 每筆量測輸出一行 JSON，方便收 log 的系統直接解析
+logger = logging.getLogger("service.metrics")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# 每個指標只保留最近這麼多筆延遲樣本來算百分位數
+SAMPLE_SIZE = 2000
+
+_scope = ContextVar("metrics_scope", default=None)
+_trace = ContextVar("metrics_trace", default=None)
+
+
+class Metric:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.api_calls = 0
+        self.bytes = 0
+        self.total_ms = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+    def as_dict(self):
+        return {
+            "name": self.name, "count": self.count, "errors": self.errors,
+            "api_calls": self.api_calls, "bytes": self.bytes,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 2), "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+        }
+
+
+class Registry:
+    """程序內彙總，所有 session 共用。"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, ms, api_calls=0, nbytes=0, error=False):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(name)
+            metric.count += 1
+            metric.errors += int(error)
+            metric.api_calls += api_calls
+            metric.bytes += nbytes
+            metric.total_ms += ms
+            metric.samples.append(ms)
+
+    def snapshot(self):
+        with self._lock:
+            return [m.as_dict() for m in sorted(self._metrics.values(), key=lambda m: m.name)]
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+registry = Registry()
+
+
+class _Scope:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.api_calls = 0
+        self.bytes = 0
+
+
+def _walk():
+    scope = _scope.get()
+    while scope is not None:
+        yield scope
+        scope = scope.parent
+
+
+def record_api_call(nbytes=0):
+    """外部呼叫 (Sheets / SMTP) 計入目前所有外層量測。"""
+    for scope in _walk():
+        scope.api_calls += 1
+        scope.bytes += nbytes
+
+
+def record_bytes(nbytes):
+    for scope in _walk():
+        scope.bytes += nbytes
+
+
+def payload_size(obj):
+    """粗估 gspread 回傳/送出資料的大小 (字元數)。"""
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_size(v) for v in obj)
+    if isinstance(obj, dict):
+        return sum(len(str(k)) + payload_size(v) for k, v in obj.items())
+    if obj is None:
+        return 0
+    return len(str(obj))
+
+
+@contextmanager
+def measure(name):
+    parent = _scope.get()
+    scope = _Scope(name, parent)
+    token = _scope.set(scope)
+    started = time.perf_counter()
+    error = False
+    try:
+        yield scope
+    except BaseException as e:
+        # st.stop / st.rerun 也是用例外實作，不算錯誤
+        error = isinstance(e, Exception) and type(e).__module__.split(".")[0] != "streamlit"
+        raise
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        _scope.reset(token)
+        registry.record(name, ms, scope.api_calls, scope.bytes, error)
+        trace = _trace.get()
+        if trace is not None and parent is None:
+            trace["spans"].append({"name": name, "ms": round(ms, 2), "api_calls": scope.api_calls, "bytes": scope.bytes})
+        logger.info(json.dumps({"metric": name, "ms": round(ms, 3), "api_calls": scope.api_calls,
+                                "bytes": scope.bytes, "error": error, "ts": round(time.time(), 3)}))
+
+
+def timed(name=None):
+    def decorator(fn):
+        metric_name = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with measure(metric_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace():
+    """在每次 rerun 開頭呼叫；回傳的 dict 會收集本次 rerun 內各個最外層量測的耗時。"""
+    trace = {"started": time.time(), "spans": []}
+    _trace.set(trace)
+    return trace
@@ -0,0 +1,142 @@
+import logging
+import math
+import threading
+import time
+
+from services.mailer import get_dispatcher
+from services.settings import secret_section
+
+logger = logging.getLogger(__name__)
+
+# 同一案件在這段時間 (秒) 內的多次更新合併成一封
+DEFAULT_WINDOW = 600
+
+
+def _span(seconds):
+    # 不滿一分鐘寫秒數；其餘無條件進位到分鐘，不會出現「0 分鐘」
+    seconds = math.ceil(seconds)
+    return f"{seconds} 秒" if seconds < 60 else f"{math.ceil(seconds / 60)} 分鐘"
+
+
+class Notifier:
+    """通知信合併器，放在 MailDispatcher 前面。
+
+    - 一般模式：同一 case_id 的「更新」第一次立刻寄出，window 秒內後續的更新合併成一封，在 window 結束時寄出。
+      建檔等其他通知照常立刻寄出。
+    - 彙整模式 (digest_interval > 0)：所有通知先收著，每 digest_interval 秒寄一封彙整信。
+    回傳訊息編號；被合併的通知回傳那封合併信預留的編號，可用 dispatcher.status() 查狀態。
+    """
+
+    def __init__(self, dispatcher, window=DEFAULT_WINDOW, digest_interval=0, clock=time.monotonic):
+        self.dispatcher = dispatcher
+        self.window = window
+        self.digest_interval = digest_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last_sent = {}
+        self._pending = {}
+        self._digest = []
+        self._digest_id = None
+        self._digest_due = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def notify(self, subject, body, case_id=None, kind="update"):
+        now = self.clock()
+        with self._lock:
+            if self.digest_interval:
+                if self._digest_id is None:
+                    self._digest_id = self.dispatcher.hold("【彙整】通知")
+                    self._digest_due = now + self.digest_interval
+                self._digest.append((kind, case_id, subject, body))
+                self._start()
+                return self._digest_id
+            if kind != "update" or not case_id:
+                return self.dispatcher.submit(subject, body)
+            entry = self._pending.get(case_id)
+            if entry is not None:
+                entry.update(count=entry["count"] + 1, subject=subject, body=body)
+                return entry["msg_id"]
+            last = self._last_sent.get(case_id)
+            if last is not None and now - last < self.window:
+                entry = {"due": last + self.window, "count": 1, "subject": subject, "body": body,
+                         "msg_id": self.dispatcher.hold(subject)}
+                self._pending[case_id] = entry
+                self._start()
+                return entry["msg_id"]
+            self._last_sent[case_id] = now
+            return self.dispatcher.submit(subject, body)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending) + len(self._digest)
+
+    def flush(self, force=False):
+        """寄出到期的合併信與彙整信；force=True 不管是否到期全部寄出。回傳寄出封數。"""
+        now = self.clock()
+        outgoing = []
+        with self._lock:
+            for case_id, entry in list(self._pending.items()):
+                if force or entry["due"] <= now:
+                    del self._pending[case_id]
+                    # 合併信寄出也算一次寄送，之後的更新再從這裡開始算 window
+                    self._last_sent[case_id] = now
+                    body = entry["body"]
+                    if entry["count"] > 1:
+                        body += f"\n\n（{_span(self.window)}內共 {entry['count']} 次更新，已合併為一封）"
+                    outgoing.append((entry["subject"], body, entry["msg_id"]))
+            for case_id, sent_at in list(self._last_sent.items()):
+                if now - sent_at >= self.window and case_id not in self._pending:
+                    del self._last_sent[case_id]
+            if self._digest and (force or self._digest_due <= now):
+                outgoing.append(self._digest_mail() + (self._digest_id,))
+                self._digest, self._digest_id, self._digest_due = [], None, None
+        for subject, body, msg_id in outgoing:
+            if self.dispatcher.submit(subject, body, msg_id=msg_id) is None:
+                logger.warning("notification dropped, mail queue full: %s", subject)
+        return len(outgoing)
+
+    def _digest_mail(self):
+        # 同一案件的多次更新只列最後一次
+        latest, counts, new = {}, {}, []
+        for kind, case_id, subject, body in self._digest:
+            if kind == "update" and case_id:
+                latest[case_id] = (subject, body)
+                counts[case_id] = counts.get(case_id, 0) + 1
+            else:
+                new.append((subject, body))
+        sections = []
+        if new:
+            sections.append("■ 新建檔 / 其他通知\n" + "\n\n".join(f"{s}\n{b}" for s, b in new))
+        if latest:
+            sections.append("■ 資料更新\n" + "\n\n".join(
+                f"{s}" + (f"（共 {counts[c]} 次）" if counts[c] > 1 else "") + f"\n{b}" for c, (s, b) in latest.items()))
+        subject = f"【彙整】新建檔 {len(new)} 筆、更新 {len(latest)} 件"
+        return subject, "\n\n".join(sections)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="mail-notifier", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(1.0):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("notifier flush failed")
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """程序內共用的合併器；st.secrets["email"] 的 notify_window (秒) 與 digest_interval (秒，0 為關閉)。"""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            conf = secret_section("email")
+            _notifier = Notifier(get_dispatcher(), window=int(conf.get("notify_window", DEFAULT_WINDOW)),
+                                 digest_interval=int(conf.get("digest_interval", 0)))
+        return _notifier
@@ -0,0 +1,151 @@
+"""CSV 批次建檔：一次讀表比對重複 Email，整批一次 append_rows，通知信合併成一封。
+
+    python -m services.onboarding clients.csv --dry-run
+    python -m services.onboarding clients.csv
+
+CSV 欄位：Email, party_a, plan, start_date, pay_day, pay_date (也接受 信箱 / 客戶名稱 / 方案 等中文表頭)。
+plan 可填完整方案名稱或「每月」/「三個月」；start_date 空白時預設 7 天後，與建檔頁面相同。
+"""
+import argparse
+import csv
+import io
+import sys
+from datetime import date, datetime, timedelta
+
+from services.clients import make_case_id, save_phase1_bulk
+from services.document_utils import MONTHLY_PLAN, QUARTERLY_PLAN
+from services.sheet_client import configured_sheet_url
+from services.sheet_index import normalize_key
+from services.storage import get_storage
+
+HEADER_ALIASES = {
+    "email": "Email", "信箱": "Email", "聯絡信箱": "Email",
+    "party_a": "party_a", "客戶名稱": "party_a", "名稱": "party_a", "甲方": "party_a",
+    "plan": "plan", "方案": "plan",
+    "start_date": "start_date", "合作啟動日": "start_date",
+    "pay_day": "pay_day", "每月付款日": "pay_day",
+    "pay_date": "pay_date", "付款日期": "pay_date",
+}
+# 依序嘗試的編碼：UTF-8 解得開的 Big5 檔極少，反過來則常見，所以 UTF-8 在前
+CSV_ENCODINGS = ("utf-8-sig", "cp950")
+
+
+def read_csv(data):
+    """data 可以是 bytes (上傳檔) 或文字；回傳欄名已統一的 dict 列表。
+
+    bytes 先當 UTF-8 解，不行再當 Big5 (cp950，Windows 中文版 Excel 另存 CSV 的預設)；都不是就丟 ValueError。
+    """
+    if isinstance(data, bytes):
+        for encoding in CSV_ENCODINGS:
+            try:
+                data = data.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            raise ValueError("無法辨識 CSV 的文字編碼，請另存為 UTF-8 或 Big5 (cp950) 後再上傳")
+    def column(name):
+        name = str(name).strip()
+        return HEADER_ALIASES.get(name.lower(), name)
+    return [{column(k): (v or "").strip() for k, v in row.items() if k is not None}
+            for row in csv.DictReader(io.StringIO(data))]
+
+
+def _plan(value):
+    if value in (MONTHLY_PLAN, QUARTERLY_PLAN):
+        return value
+    if "三個月" in value or "45,000" in value or "45000" in value:
+        return QUARTERLY_PLAN
+    if not value or "每月" in value or "17,000" in value or "17000" in value:
+        return MONTHLY_PLAN
+    raise ValueError(f"無法辨識的方案：{value}")
+
+
+def _date(value, default=None):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else default
+
+
+def validate(rows, existing_emails, today=None):
+    """回傳 (可建檔的 data_dict 列表, [(CSV 行號, 原因), ...])。
+
+    existing_emails 是表上已有的 Email (已 normalize)；同一批內重複的 Email 只收第一筆。
+    """
+    today = today or date.today()
+    seen = set(existing_emails)
+    valid, errors = [], []
+    for line, row in enumerate(rows, start=2):
+        email, name = row.get("Email", ""), row.get("party_a", "")
+        try:
+            if not name or not email.endswith("@gmail.com"):
+                raise ValueError("名稱空白或信箱不是 Gmail")
+            if normalize_key(email) in seen:
+                raise ValueError("Email 已註冊")
+            plan = _plan(row.get("plan", ""))
+            start = _date(row.get("start_date"), today + timedelta(days=7))
+            if plan == MONTHLY_PLAN:
+                pay_day = int(row.get("pay_day") or 5)
+                if not 1 <= pay_day <= 28:
+                    raise ValueError("每月付款日需介於 1~28")
+                pay_date = None
+            else:
+                pay_day, pay_date = 5, _date(row.get("pay_date"), start)
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        seen.add(normalize_key(email))
+        valid.append({"Email": email, "case_id": make_case_id(name, today), "party_a": name, "plan": plan,
+                      "start_date": start, "pay_day": pay_day, "pay_date": pay_date})
+    return valid, errors
+
+
+def import_clients(rows, dispatcher=None, today=None, dry_run=False):
+    """讀一次表、寫一次表；dispatcher 有給時排入一封彙整通知信。回傳 (可建檔的 data_dict 列表, 錯誤列表)。
+
+    比對重複用的是 storage 的共用索引，寫入前 register_many 逐筆再確認時查的也是同一份。
+    """
+    existing = get_storage(configured_sheet_url()).emails()
+    valid, errors = validate(rows, existing, today)
+    if valid and not dry_run:
+        _, skipped = save_phase1_bulk(valid)
+        if skipped:
+            # 讀快照之後才被別的 session 建檔的 Email
+            lines = {normalize_key(r.get("Email")): i for i, r in enumerate(rows, start=2)}
+            skipped = {normalize_key(e) for e in skipped}
+            errors += [(lines.get(e), "Email 已註冊") for e in sorted(skipped)]
+            valid = [d for d in valid if normalize_key(d["Email"]) not in skipped]
+        if dispatcher is not None:
+            body = "\n".join(f"名稱：{d['party_a']}｜案件號：{d['case_id']}｜方案：{d['plan']}" for d in valid)
+            dispatcher.submit(f"【批次建檔】新增 {len(valid)} 位客戶", body)
+    return valid, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="從 CSV 批次建立新客戶")
+    parser.add_argument("csv", help="CSV 檔路徑 (UTF-8 或 Big5)")
+    parser.add_argument("--dry-run", action="store_true", help="只檢查，不寫入")
+    args = parser.parse_args(argv)
+
+    with open(args.csv, "rb") as f:
+        try:
+            rows = read_csv(f.read())
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    if args.dry_run:
+        valid, errors = import_clients(rows, dry_run=True)
+        print(f"可建檔 {len(valid)} 筆 (dry run，未寫入)", file=sys.stderr)
+    else:
+        from services.mailer import get_dispatcher
+
+        dispatcher = get_dispatcher()
+        valid, errors = import_clients(rows, dispatcher)
+        # 寄信是背景執行緒，等佇列清空再結束程序
+        dispatcher.flush(timeout=60)
+        print(f"已建檔 {len(valid)} 筆", file=sys.stderr)
+    for line, reason in errors:
+        print(f"第 {line} 行：{reason}", file=sys.stderr)
+    return 1 if errors and not valid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
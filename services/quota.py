@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+INTERACTIVE, BACKGROUND = 0, 1
+
+# 可重試的 HTTP 狀態：配額用完與 Google 端暫時性錯誤
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 新增列這類不能重做的呼叫只重試 429 (一定沒執行)；5xx 可能已經寫進去，重試會多出一列
+NON_IDEMPOTENT_RETRY_STATUS = {429}
+
+_local = threading.local()
+
+
+class SheetQuotaError(Exception):
+    """重試用盡仍被 Google Sheets 擋下 (多半是 429)。"""
+
+
+def current_priority():
+    return getattr(_local, "priority", INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """背景工作 (同步、預熱、報表) 包在這裡面，讀寫都讓使用者的請求先走。"""
+    previous = current_priority()
+    _local.priority = BACKGROUND
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class TokenBucket:
+    """每分鐘 per_minute 次的權杖桶。
+
+    burst 為瞬間可用量，補充速率設為 (per_minute - burst) / 60，任何 60 秒內最多 per_minute 次。
+    背景請求只能用到 reserve 以上的權杖，而且有互動請求在排隊時一律讓路。
+    clock 可換掉 (測試用)，預設 time.monotonic。
+    """
+
+    def __init__(self, per_minute, burst=10, reserve=2, clock=time.monotonic):
+        self.capacity = float(min(burst, per_minute))
+        self.rate = max(per_minute - self.capacity, 1) / 60.0
+        self.reserve = reserve
+        self.clock = clock
+        self.tokens = self.capacity
+        self._updated = clock()
+        self._cond = threading.Condition()
+        self._waiting = [0, 0]
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=INTERACTIVE):
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    if priority == INTERACTIVE:
+                        needed = 1
+                    else:
+                        needed = 1 + self.reserve if not self._waiting[INTERACTIVE] else float("inf")
+                    if self.tokens >= needed:
+                        self.tokens -= 1
+                        return
+                    wait = (needed - self.tokens) / self.rate if needed != float("inf") else 0.1
+                    self._cond.wait(min(max(wait, 0.01), 1.0))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+
+class QuotaGate:
+    """所有 gspread 呼叫的關卡：先拿讀或寫的權杖，遇到 429 / 5xx 以抖動指數退避重試。
+
+    idempotent=False 的呼叫 (append、刪列…) 只在 429 時重試。clock / sleep 可換掉 (測試用)。
+    """
+
+    def __init__(self, read_per_minute=60, write_per_minute=60, max_retries=5, base_delay=1.0, max_delay=32.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.buckets = {"read": TokenBucket(read_per_minute, clock=clock),
+                        "write": TokenBucket(write_per_minute, clock=clock)}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.throttled = 0
+
+    def call(self, kind, fn, idempotent=True):
+        retry_status = RETRY_STATUS if idempotent else NON_IDEMPOTENT_RETRY_STATUS
+        for attempt in range(self.max_retries + 1):
+            self.buckets[kind].acquire(current_priority())
+            try:
+                return fn()
+            except Exception as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status not in retry_status:
+                    raise
+                self.throttled += 1
+                if attempt == self.max_retries:
+                    raise SheetQuotaError(f"Google Sheets 忙碌中 (HTTP {status})，已重試 {attempt} 次") from e
+                # full jitter：0 ~ base*2^n 之間隨機，避免大家同時醒來再撞一次
+                self.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
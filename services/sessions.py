@@ -0,0 +1,177 @@
+import base64
+import copy
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from services.settings import secret_section
+
+logger = logging.getLogger(__name__)
+
+# token 放在網址上，會留在瀏覽器歷史紀錄裡：存活時間不要太長
+DEFAULT_TTL = 2 * 3600
+DEFAULT_MAX_SESSIONS = 5000
+# 網址列上的參數名稱
+QUERY_PARAM = "s"
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def password_tag(password_hash):
+    # token 只帶密碼雜湊的前幾碼：改密碼後舊 token 在快取失效時也對不上
+    return hashlib.sha256(str(password_hash or "").encode()).hexdigest()[:12]
+
+
+class SessionStore:
+    """簽章 + 到期的登入 token，以及 token 對應的登入資料快取 (程序內、所有 session 共用)。
+
+    token 放在網址參數裡，重新整理頁面時用它取回 st.session_state.user，不必重新登入、也不必讀 Sheet。
+    快取與每次取回的都是各自的複本：同一個連結開在兩個分頁，一邊就地改 user 不會影響另一邊。
+    """
+
+    def __init__(self, secret, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS, clock=time.time):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        # 登出過的 sid -> 到期時間：快取沒有時也不能再用 loader 重建
+        self._revoked = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _sign(self, body):
+        return _b64(hmac.new(self.secret, body.encode(), hashlib.sha256).digest())
+
+    def issue(self, user):
+        """幫已登入的 user 開一個 session，回傳 token。"""
+        sid = secrets.token_urlsafe(12)
+        raw = user.get("raw_data", {})
+        payload = {"sid": sid, "e": user["email"], "exp": int(self.clock() + self.ttl),
+                   "pw": password_tag(str(raw.get("password", "")).strip())}
+        body = _b64(json.dumps(payload, separators=(",", ":")).encode())
+        with self._lock:
+            self._cache[sid] = (payload["exp"], copy.deepcopy(user))
+            if len(self._cache) > self.max_sessions:
+                # 先丟掉已過期的，仍超量再丟最久沒用到的
+                now = self.clock()
+                for old in [k for k, (exp, _) in self._cache.items() if exp < now]:
+                    del self._cache[old]
+                while len(self._cache) > self.max_sessions:
+                    self._cache.popitem(last=False)
+        return f"{body}.{self._sign(body)}"
+
+    def verify(self, token):
+        """簽章正確且未到期就回傳 payload，否則 None。"""
+        try:
+            body, sig = str(token).split(".", 1)
+            if not hmac.compare_digest(sig, self._sign(body)):
+                return None
+            payload = json.loads(_unb64(body))
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(payload, dict) or payload.get("exp", 0) < self.clock():
+            return None
+        return payload
+
+    def restore(self, token, loader=None):
+        """用 token 取回 user 的複本；快取沒有 (例如程序重啟) 時呼叫 loader(email) -> (列號, 資料) 重建一次。
+
+        快取命中時也用 loader 核對密碼：別的 replica 改了密碼，這個程序的快取不會知道；
+        核對時讀到的列號與資料也一併換上，不會拿到登入當時的舊內容。
+        """
+        payload = self.verify(token)
+        if payload is None:
+            return None
+        with self._lock:
+            hit = self._cache.get(payload["sid"])
+            if hit is not None:
+                self._cache.move_to_end(payload["sid"])
+                self.hits += 1
+            else:
+                self.misses += 1
+                if payload["sid"] in self._revoked:
+                    return None
+        if loader is None:
+            return copy.deepcopy(hit[1]) if hit is not None else None
+        try:
+            row, data = loader(payload["e"])
+        except Exception:
+            # 讀不到資料 (Sheet 忙碌) 時快取裡有就先用，沒有就照常往上丟
+            if hit is None:
+                raise
+            logger.warning("cannot re-check password for a cached session", exc_info=True)
+            return copy.deepcopy(hit[1])
+        if not row or password_tag(str(data.get("password", "")).strip()) != payload["pw"]:
+            with self._lock:
+                self._cache.pop(payload["sid"], None)
+            return None
+        user = dict(hit[1]) if hit is not None else {"email": data["Email"], "name": data["party_a"], "role": "login"}
+        user.update(row_num=row, raw_data=data)
+        with self._lock:
+            self._cache[payload["sid"]] = (payload["exp"], user)
+        return copy.deepcopy(user)
+
+    def revoke(self, token):
+        payload = self.verify(token)
+        if payload is not None:
+            with self._lock:
+                self._cache.pop(payload["sid"], None)
+                now = self.clock()
+                self._revoked = {sid: exp for sid, exp in self._revoked.items() if exp >= now}
+                self._revoked[payload["sid"]] = payload["exp"]
+
+    def revoke_email(self, email):
+        """改密碼後讓這個信箱的其他 session 全部失效 (快取外的舊 token 靠密碼雜湊比對擋下)。"""
+        email = str(email).strip().lower()
+        with self._lock:
+            for sid in [sid for sid, (_, u) in self._cache.items() if u["email"].strip().lower() == email]:
+                del self._cache[sid]
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _signing_key(conf):
+    # 所有 replica 與重啟後都要是同一把，否則網址上的 token 換個程序就失效
+    if conf.get("secret"):
+        return conf["secret"]
+    private_key = secret_section("gcp_service_account").get("private_key")
+    if private_key:
+        logger.warning("session.secret is not set; deriving the login token key from gcp_service_account")
+        return hmac.new(str(private_key).encode(), b"service.sessions", hashlib.sha256).digest()
+    logger.error("session.secret is not set and there is no service account key: using a random key, "
+                 "login links stop working when this process restarts and are not valid on other replicas")
+    return secrets.token_bytes(32)
+
+
+def get_session_store():
+    """程序內共用的 session 快取；st.secrets["session"] 的 secret (簽章金鑰)、ttl_hours 與 max_sessions。
+
+    secret 請一定要設定 (每個 replica 相同)；沒設時由服務帳號私鑰導出，連私鑰都沒有才用隨機金鑰並記錯誤日誌。
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            conf = secret_section("session")
+            _store = SessionStore(_signing_key(conf),
+                                  ttl=int(float(conf.get("ttl_hours", DEFAULT_TTL / 3600)) * 3600),
+                                  max_sessions=int(conf.get("max_sessions", DEFAULT_MAX_SESSIONS)))
+        return _store
@@ -0,0 +1,14 @@
+import streamlit as st
+
+
+def secret_section(name):
+    """讀 st.secrets 的一個區塊；沒有該區塊或根本沒有 secrets.toml (CLI、benchmark) 時回傳空 dict。"""
+    try:
+        return dict(st.secrets[name]) if name in st.secrets else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        # 新版 streamlit 找不到 secrets.toml 時丟 StreamlitSecretNotFoundError
+        if type(e).__name__ == "StreamlitSecretNotFoundError":
+            return {}
+        raise
@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path, blocking=True, shared=False):
+    """跨程序的檔案鎖；blocking=False 時拿不到就 yield False，不等待。
+
+    shared=True 是共用鎖：持有共用鎖的彼此不等待，只和獨佔鎖互斥 (Windows 沒有共用鎖，一律獨佔)。
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    locked = False
+    try:
+        try:
+            if fcntl is not None:
+                mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(fd, mode | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            locked = True
+        except OSError:
+            if blocking:
+                raise
+        yield locked
+    finally:
+        if locked:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+class RowEpoch:
+    """一份試算表熱分頁的列號世代，同一台主機上的程序 (app、命令列封存) 共用一個小檔案與檔案鎖。
+
+    會搬動列的作業在 moving() 裡做：拿獨佔鎖、刪列、bump() 把世代 +1 並記下時間。
+    依列號寫入的一方在 writing() 裡做：拿共用鎖 (寫入之間互不等待)，比對索引載入時記下的世代，
+    不同就先重載索引再找列。兩邊都只碰本機檔案，不多呼叫 Sheet API。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+
+    def read(self):
+        """(世代, 最近一次搬列的 time.time())；沒搬過列時是 (0, 0.0)。"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            return int(state["epoch"]), float(state["moved_at"])
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return 0, 0.0
+
+    @contextmanager
+    def writing(self):
+        with file_lock(self.lock_path, shared=True):
+            yield self.read()[0]
+
+    def moving(self):
+        return file_lock(self.lock_path)
+
+    def bump(self):
+        """刪過列之後 (仍在 moving() 裡) 呼叫。"""
+        epoch, _ = self.read()
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"epoch": epoch + 1, "moved_at": time.time()}, f)
+        os.replace(tmp, self.path)
+
+
+class SharedSnapshot:
+    """同一台主機上多個 Streamlit 程序共用的整表快照 (SQLite WAL 檔)。
+
+    過期時只有拿到檔案鎖的那個程序去讀 Sheet 並整批寫入；其他程序照樣讀舊快照，不必等。
+    每個程序的寫入也會寫回快照 (每列帶遞增的 version)，別的程序用 changes() 補上，不必重讀 Sheet。
+    epoch 在整批重讀時 +1，代表列號可能整個變了，持有舊 epoch 的程序要整份重載。
+    loaded_at 記的是開始讀 Sheet 的時間；被 expire() 或早於最近一次搬列 (not_before) 的快照
+    不能拿來先用，要等重讀完。
+    """
+
+    def __init__(self, path, sheet_key, ttl):
+        self.path = path
+        self.sheet_key = sheet_key
+        self.ttl = ttl
+        self.lock_path = path + ".lock"
+        self._local = threading.local()
+        self._db().executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                sheet TEXT PRIMARY KEY,
+                headers TEXT NOT NULL,
+                loaded_at REAL NOT NULL,
+                epoch INTEGER NOT NULL,
+                version INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshot_rows (
+                sheet TEXT NOT NULL,
+                row_num INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (sheet, row_num)
+            );
+            CREATE INDEX IF NOT EXISTS ix_snapshot_rows_version ON snapshot_rows(sheet, version);
+        """)
+
+    def _db(self):
+        # sqlite 連線不跨執行緒共用，每個執行緒各開一條
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _meta(self, db=None):
+        hit = (db or self._db()).execute("SELECT headers, loaded_at, epoch, version FROM snapshots WHERE sheet = ?",
+                                         (self.sheet_key,)).fetchone()
+        return None if hit is None else {"headers": json.loads(hit[0]), "loaded_at": hit[1],
+                                         "epoch": hit[2], "version": hit[3]}
+
+    def _is_fresh(self, meta, not_before=0.0):
+        return meta is not None and meta["loaded_at"] >= not_before and time.time() - meta["loaded_at"] < self.ttl
+
+    def _read(self):
+        # 一次讀交易內拿 meta 與所有列，不會讀到一半被別的程序換掉
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            meta = self._meta(db)
+            rows = db.execute("SELECT row_num, data FROM snapshot_rows WHERE sheet = ? ORDER BY row_num",
+                              (self.sheet_key,)).fetchall()
+        finally:
+            db.execute("COMMIT")
+        return meta, [(row_num, json.loads(data)) for row_num, data in rows]
+
+    def load(self, fetch, not_before=0.0):
+        """回傳 (meta, [(列號, 資料)])。fetch() -> (表頭, get_all_records 結果)，只有負責更新的程序會呼叫。
+
+        not_before：最近一次搬列的時間，比它早開始讀的快照一律重讀。
+        """
+        meta = self._meta()
+        if self._is_fresh(meta, not_before):
+            return self._read()
+        # 只是過期的快照可以先用；被 expire() (loaded_at = 0) 或搬列之前讀的，列號可能不對，要等
+        usable = meta is not None and meta["loaded_at"] > 0 and meta["loaded_at"] >= not_before
+        with file_lock(self.lock_path, blocking=not usable) as locked:
+            if not locked:
+                # 別的程序正在更新：先用舊快照
+                return self._read()
+            meta = self._meta()
+            if not self._is_fresh(meta, not_before):
+                started = time.time()
+                headers, records = fetch()
+                self._replace(headers, records, started, meta["epoch"] if meta else None)
+        return self._read()
+
+    def _replace(self, headers, records, loaded_at, seen_epoch=None):
+        with self._transaction() as db:
+            meta = self._meta(db)
+            epoch, version = (meta["epoch"] + 1, meta["version"] + 1) if meta else (1, 1)
+            if meta is not None and meta["epoch"] != seen_epoch:
+                # 讀 Sheet 的期間有人 expire()：這份內容可能是改動前的，寫進去但標成過期，下次照樣重讀
+                loaded_at = 0
+            db.execute("DELETE FROM snapshot_rows WHERE sheet = ?", (self.sheet_key,))
+            db.executemany("INSERT INTO snapshot_rows (sheet, row_num, version, data) VALUES (?, ?, ?, ?)",
+                           ((self.sheet_key, i + 2, version, json.dumps(r, ensure_ascii=False, default=str))
+                            for i, r in enumerate(records)))
+            db.execute("INSERT OR REPLACE INTO snapshots (sheet, headers, loaded_at, epoch, version) "
+                       "VALUES (?, ?, ?, ?, ?)",
+                       (self.sheet_key, json.dumps(list(headers), ensure_ascii=False), loaded_at, epoch, version))
+
+    def changes(self, epoch, since):
+        """version > since 的列：(目前 version, [(列號, 資料)])；epoch 不同 (整份換過) 時回傳 (None, None)。"""
+        db = self._db()
+        hit = db.execute("SELECT epoch, version FROM snapshots WHERE sheet = ?", (self.sheet_key,)).fetchone()
+        if hit is None or hit[0] != epoch:
+            return None, None
+        if hit[1] == since:
+            return hit[1], []
+        rows = db.execute("SELECT row_num, data FROM snapshot_rows WHERE sheet = ? AND version > ? AND version <= ?",
+                          (self.sheet_key, since, hit[1])).fetchall()
+        return hit[1], [(row_num, json.loads(data)) for row_num, data in rows]
+
+    def put(self, records):
+        """{列號: 資料}：本程序寫入 Sheet 後同步到快照。"""
+        with self._transaction() as db:
+            meta = self._meta(db)
+            if meta is None:
+                return
+            version = meta["version"] + 1
+            db.executemany("INSERT OR REPLACE INTO snapshot_rows (sheet, row_num, version, data) VALUES (?, ?, ?, ?)",
+                           ((self.sheet_key, row_num, version, json.dumps(r, ensure_ascii=False, default=str))
+                            for row_num, r in records.items()))
+            db.execute("UPDATE snapshots SET version = ? WHERE sheet = ?", (version, self.sheet_key))
+
+    def expire(self):
+        """有程序無法就地更新 (例如刪了列)：快照設為過期並換 epoch，所有程序下次查詢都重載，其中一個重讀 Sheet。"""
+        with self._transaction() as db:
+            db.execute("UPDATE snapshots SET loaded_at = 0, epoch = epoch + 1 WHERE sheet = ?", (self.sheet_key,))
@@ -0,0 +1,215 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+# gspread / oauth2client / google-auth 合計要載入 0.5 秒左右，用到時才 import，登入畫面不必等它們
+from services.metrics import payload_size, record_api_call
+from services.quota import QuotaGate
+from services.settings import secret_section
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+DEFAULT_SHEET_URL = "https://docs.google.com/spreadsheets/d/1zXHavJqhOBq1-m_VR7sxMkeOHdXoD9EmQCEM1Nl816I/edit?usp=sharing"
+
+# access token 約 1 小時過期，剩 5 分鐘內就先換新，不讓使用者的請求去吃換 token 的時間
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def _utcnow():
+    # google-auth 的 expiry 是不帶時區的 UTC；datetime.utcnow() 在 3.12 起已棄用
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# 會寫入的 Worksheet 方法，其餘都算讀取配額
+WRITE_METHODS = {
+    "update", "update_cell", "update_cells", "update_acell", "batch_update", "append_row", "append_rows",
+    "insert_row", "insert_rows", "insert_cols", "delete_rows", "delete_columns", "clear", "batch_clear",
+    "resize", "add_rows", "add_cols", "format", "batch_format", "update_title",
+}
+# 重做一次結果就不同的方法 (多一列、多刪一列)：5xx 或連線中斷時不知道有沒有執行，不自動重試
+NON_IDEMPOTENT_METHODS = {
+    "append_row", "append_rows", "insert_row", "insert_rows", "insert_cols", "delete_rows", "delete_columns",
+    "add_rows", "add_cols",
+}
+
+
+def load_credentials():
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    creds_dict = secret_section("gcp_service_account")
+    if creds_dict:
+        return ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+    return ServiceAccountCredentials.from_json_keyfile_name("service_account.json", SCOPE)
+
+
+def configured_sheet_url():
+    return secret_section("sheets").get("url", DEFAULT_SHEET_URL)
+
+
+def _reconnect_errors(idempotent=True):
+    # 這些錯誤代表連線或授權壞掉，重建連線後重試一次即可；
+    # 換 token 失敗時請求還沒送出，一定能重試，連線中斷則可能已寫入，只有可重做的呼叫才重試
+    import requests
+    from google.auth.exceptions import RefreshError, TransportError
+
+    if not idempotent:
+        return RefreshError, TransportError
+    return RefreshError, TransportError, requests.exceptions.ConnectionError
+
+
+def _is_auth_error(e):
+    import gspread
+
+    response = getattr(e, "response", None)
+    return isinstance(e, gspread.exceptions.APIError) and getattr(response, "status_code", None) == 401
+
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def get_gate():
+    """程序內共用的配額關卡；每分鐘上限取自 st.secrets["sheets"] (read_per_minute / write_per_minute)。"""
+    global _gate
+    with _gate_lock:
+        if _gate is None:
+            conf = secret_section("sheets")
+            _gate = QuotaGate(int(conf.get("read_per_minute", 60)), int(conf.get("write_per_minute", 60)))
+        return _gate
+
+
+def set_gate(gate):
+    """換掉共用的配額關卡 (benchmark / 壓測時放寬上限)。"""
+    global _gate
+    with _gate_lock:
+        _gate = gate
+
+
+class SheetConnection:
+    """快取已授權的 client、Spreadsheet 與第 0 個工作表 (以及用到過的其他分頁)，整個程序共用一份。"""
+
+    def __init__(self, sheet_url, creds_loader=load_credentials):
+        self.sheet_url = sheet_url
+        self.creds_loader = creds_loader
+        self.creds = None
+        self._lock = threading.RLock()
+        self._client = None
+        self._spreadsheet = None
+        self._worksheet = None
+        self._tabs = {}
+
+    def _ensure(self):
+        with self._lock:
+            if self._worksheet is None:
+                import gspread
+
+                if self.creds is None:
+                    self.creds = self.creds_loader()
+                self._client = gspread.authorize(self.creds)
+                self._spreadsheet = get_gate().call("read", lambda: self._client.open_by_url(self.sheet_url))
+                self._worksheet = get_gate().call("read", lambda: self._spreadsheet.get_worksheet(0))
+            return self._worksheet
+
+    def attach(self, worksheet, spreadsheet=None):
+        """直接掛上現成的工作表物件 (測試或 benchmark 用的假表)，不做授權。"""
+        with self._lock:
+            self._client = None
+            self._spreadsheet = spreadsheet if spreadsheet is not None else getattr(worksheet, "spreadsheet", None)
+            self._worksheet = worksheet
+            self._tabs = {}
+
+    def reset(self):
+        with self._lock:
+            self._client = self._spreadsheet = self._worksheet = None
+            self._tabs = {}
+
+    def _tab(self, title):
+        with self._lock:
+            if title not in self._tabs:
+                self._ensure()
+                spreadsheet = self._spreadsheet
+                self._tabs[title] = get_gate().call("read", lambda: spreadsheet.worksheet(title))
+            return self._tabs[title]
+
+    def client(self):
+        self._ensure()
+        return self._client
+
+    def spreadsheet(self):
+        self._ensure()
+        return self._spreadsheet
+
+    def raw_worksheet(self, title=None):
+        return self._ensure() if title is None else self._tab(title)
+
+    def worksheet(self, title=None):
+        # 回傳代理物件：所有 gspread 呼叫都經過 call()，斷線或授權失效時自動重連；title 為 None 時是第 0 個工作表
+        return ManagedWorksheet(self, title)
+
+    def forget_tab(self, title):
+        with self._lock:
+            self._tabs.pop(title, None)
+
+    def _refresh_token(self):
+        # gspread 5 把憑證放在 client.auth，gspread 6 放在 client.http_client.auth
+        client = self._client
+        auth = getattr(client, "auth", None) or getattr(getattr(client, "http_client", None), "auth", None)
+        expiry = getattr(auth, "expiry", None)
+        if expiry is not None and expiry - _utcnow() < REFRESH_MARGIN:
+            with self._lock:
+                if auth.expiry - _utcnow() < REFRESH_MARGIN:
+                    from google.auth.transport.requests import Request
+
+                    auth.refresh(Request())
+
+    def call(self, fn, kind="read", sent=0, title=None, idempotent=True):
+        """fn(worksheet)；經過配額關卡，遇到授權/傳輸錯誤時重建連線再試一次。
+
+        idempotent=False (新增列、刪列) 時只重試確定沒執行的錯誤 (429、授權失效)。
+        """
+        gate = get_gate()
+
+        def attempt(ws):
+            result = fn(ws)
+            record_api_call(sent + payload_size(result))
+            return result
+        try:
+            ws = self.raw_worksheet(title)
+            self._refresh_token()
+            return gate.call(kind, lambda: attempt(ws), idempotent)
+        except Exception as e:
+            if not (isinstance(e, _reconnect_errors(idempotent)) or _is_auth_error(e)):
+                raise
+            self.reset()
+            self.creds = None
+            ws = self.raw_worksheet(title)
+            return gate.call(kind, lambda: attempt(ws), idempotent)
+
+
+class ManagedWorksheet:
+    def __init__(self, conn, title=None):
+        self._conn = conn
+        self._title = title
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn.raw_worksheet(self._title), name)
+        if not callable(attr):
+            return attr
+
+        kind = "write" if name in WRITE_METHODS else "read"
+
+        def managed(*args, **kwargs):
+            sent = payload_size(args) + payload_size(kwargs) if kind == "write" else 0
+            return self._conn.call(lambda ws: getattr(ws, name)(*args, **kwargs), kind, sent, self._title,
+                                   idempotent=name not in NON_IDEMPOTENT_METHODS)
+        return managed
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(sheet_url=None):
+    sheet_url = sheet_url or configured_sheet_url()
+    with _connections_lock:
+        if sheet_url not in _connections:
+            _connections[sheet_url] = SheetConnection(sheet_url)
+        return _connections[sheet_url]
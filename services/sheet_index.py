@@ -0,0 +1,393 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from services.quota import background
+from services.settings import secret_section
+
+logger = logging.getLogger(__name__)
+
+# 索引存活時間 (秒)；本程序內的寫入會就地更新索引，過期只是為了吃到別人直接改表的內容
+DEFAULT_TTL = 300
+
+# full: 一次 get_all_records 把整張表放進記憶體
+# projected: 只抓 Email / case_id 兩欄建索引，命中後再讀那一列 (表很大、欄位很長時用)
+LOOKUP_MODES = ("full", "projected")
+# 共用快照過期但別的程序正在重讀 Sheet 時，隔幾秒再去看一次
+SHARED_RETRY = 2.0
+# 多久去共用快照看一次其他程序的寫入 (每次查詢都看會多一次 SQLite 查詢)
+SHARED_POLL = 0.5
+# 過期重讀失敗 (Sheet 忙碌或連不上) 時先用舊索引，隔幾秒再試
+STALE_RETRY = 10.0
+
+
+def normalize_key(value):
+    return str(value if value is not None else "").strip().lower()
+
+
+def _column_range(col, first_row=2):
+    from gspread.utils import rowcol_to_a1
+
+    letter = rowcol_to_a1(1, col)[:-1]
+    return f"{letter}{first_row}:{letter}"
+
+
+class SheetIndex:
+    """Email / case_id -> (列號, 資料) 的程序內索引，所有 Streamlit session 共用。
+
+    有 shared (SharedSnapshot) 時 full 模式改從同主機共用的快照載入，多個程序只有一個去讀 Sheet；
+    本程序的寫入也同步到快照，其他程序查詢前先補上快照裡的新版本。
+    有 rows (RowEpoch) 時載入前記下列號世代；別的程序搬過列後，check_rows() 讓索引重載。
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, mode="full", shared=None, rows=None):
+        self.ttl = ttl
+        self.mode = mode
+        self.shared = shared
+        self.rows = rows
+        self.rows_epoch = None
+        self._shared_epoch = None
+        self._shared_version = None
+        self._polled_at = 0.0
+        self.headers = []
+        self.columns = {}
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        # 背景重讀期間本程序寫入的列 {列號: (資料, (Email, case_id))}；None 表示沒有在背景重讀
+        self._dirty = None
+        # 每次重載 / 失效 / 寫入都 +1，讓鎖外讀回來的單列資料知道自己是否已過時
+        self._generation = 0
+        self._rows = {}
+        self._keys = {}
+        self._by_email = {}
+        self._by_case = {}
+
+    # --- 載入 / 失效 ---
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def ensure(self, ws_loader):
+        # 第一次載入或被 invalidate (列號可能變了)：同步重讀，同時過期的 session 等同一份結果。
+        # 只是過了存活時間：照樣用現有內容，由一條背景執行緒重讀後再換上，查詢不必等整張表
+        with self._lock:
+            if self._is_fresh() and self._uses_shared() and time.monotonic() - self._polled_at >= SHARED_POLL:
+                self._catch_up()
+            if self._loaded_at is None:
+                self._install(self._fetch(ws_loader()))
+            elif not self._is_fresh() and self._dirty is None:
+                self._dirty = {}
+                threading.Thread(target=self._refresh, args=(ws_loader, self._dirty), name="index-refresh",
+                                 daemon=True).start()
+
+    def _refresh(self, ws_loader, dirty):
+        try:
+            with background():
+                loaded = self._fetch(ws_loader())
+        except Exception:
+            with self._lock:
+                if self._dirty is dirty:
+                    # 只是過期 (列號仍然對) 就繼續用舊內容：查詢與寫入日誌不必跟著 Sheet 一起停擺
+                    logger.warning("index reload failed, serving stale index for %.0fs", STALE_RETRY, exc_info=True)
+                    self._loaded_at = time.monotonic() - max(0.0, self.ttl - STALE_RETRY)
+                    self._dirty = None
+            return
+        with self._lock:
+            if self._dirty is not dirty:
+                # 重讀期間被 invalidate：這份可能是搬列前的內容，交給下一次同步重讀
+                return
+            self._install(loaded)
+            # 重讀期間本程序寫入的列：讀回來的可能是寫入前的內容，以本程序寫的為準
+            for row_num, (record, keys) in dirty.items():
+                self._drop_keys(row_num)
+                if record is not None:
+                    self._put(row_num, record)
+                else:
+                    self._put_keys(row_num, *keys)
+            self._dirty = None
+
+    def _uses_shared(self):
+        return self.shared is not None and self.mode == "full"
+
+    def _set_headers(self, headers):
+        self.headers = list(headers)
+        # 欄名 -> 1-based 欄號，寫入時直接查表不必 headers.index()
+        self.columns = {h: i + 1 for i, h in enumerate(self.headers) if h}
+
+    def _reset(self):
+        self._generation += 1
+        self._rows = {}
+        self._keys = {}
+        self._by_email = {}
+        self._by_case = {}
+
+    def _fetch(self, ws):
+        """讀 Sheet (或共用快照)，不動索引本身，可以不拿鎖執行；回傳交給 _install()。"""
+        # 世代在讀表之前記：讀的途中有人搬列，下次寫入前比對不合就會再重載一次
+        rows_epoch, moved_at = self.rows.read() if self.rows is not None else (None, 0.0)
+        loaded = {"rows_epoch": rows_epoch, "keys_only": self.mode == "projected", "meta": None}
+        if self.mode == "projected":
+            loaded["headers"], loaded["rows"] = self._fetch_projected(ws)
+        elif self.shared is not None:
+            def fetch():
+                records = ws.get_all_records()
+                return (list(records[0].keys()) if records else ws.row_values(1)), records
+            meta, rows = self.shared.load(fetch, not_before=moved_at)
+            loaded.update(headers=meta["headers"], rows=rows, meta=meta)
+        else:
+            records = ws.get_all_records()
+            loaded.update(headers=list(records[0].keys()) if records else ws.row_values(1),
+                          rows=list(enumerate(records, start=2)))
+        return loaded
+
+    def _install(self, loaded):
+        self._set_headers(loaded["headers"])
+        self._reset()
+        for row_num, value in loaded["rows"]:
+            if loaded["keys_only"]:
+                self._put_keys(row_num, *value)
+            else:
+                self._put(row_num, value)
+        self.rows_epoch = loaded["rows_epoch"]
+        meta = loaded["meta"]
+        if meta is None:
+            self._loaded_at = time.monotonic()
+            return
+        self._shared_epoch, self._shared_version = meta["epoch"], meta["version"]
+        self._polled_at = time.monotonic()
+        # 存活時間從快照讀 Sheet 的時間起算；快照已過期 (別人正在重讀) 就過幾秒再看
+        age = max(0.0, time.time() - meta["loaded_at"])
+        self._loaded_at = time.monotonic() - min(age, self.ttl - SHARED_RETRY)
+
+    def _catch_up(self):
+        # 其他程序寫入後更新過的列
+        self._polled_at = time.monotonic()
+        version, rows = self.shared.changes(self._shared_epoch, self._shared_version)
+        if rows is None:
+            self.invalidate_local()
+            return
+        if rows:
+            self._generation += 1
+            for row_num, record in rows:
+                self._drop_keys(row_num)
+                self._put(row_num, record)
+        self._shared_version = version
+
+    def _share(self, fn, *args):
+        # 共用快照只是加速用：寫不進去就讓它過期，不影響這次寫入
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("shared snapshot update failed")
+
+    def _fetch_projected(self, ws):
+        def key_columns(headers):
+            columns = {h: i + 1 for i, h in enumerate(headers) if h}
+            return [(k, columns[k]) for k in ("Email", "case_id") if k in columns]
+
+        headers = self.headers or ws.row_values(1)
+        keys = key_columns(headers)
+        # 表頭與兩個 key 欄位一次 batch_get 抓回來
+        header_range, *key_ranges = ws.batch_get(["1:1"] + [_column_range(c) for _, c in keys])
+        current = header_range[0] if header_range else []
+        if current != headers:
+            # 有人動過欄位順序：用新表頭再抓一次
+            headers, keys = current, key_columns(current)
+            key_ranges = ws.batch_get([_column_range(c) for _, c in keys]) if keys else []
+        columns = dict(zip([k for k, _ in keys], key_ranges))
+        emails, cases = columns.get("Email", []), columns.get("case_id", [])
+        rows = []
+        for i in range(max(len(emails), len(cases))):
+            email = emails[i][0] if i < len(emails) and emails[i] else ""
+            case_id = cases[i][0] if i < len(cases) and cases[i] else ""
+            rows.append((i + 2, (email, case_id)))
+        return headers, rows
+
+    def invalidate(self):
+        with self._lock:
+            self.invalidate_local()
+            if self._uses_shared():
+                self._share(self.shared.expire)
+
+    def invalidate_local(self):
+        """只丟掉本程序的索引 (下次查詢同步重讀)，不動共用快照；背景重讀中的結果也不會換上。"""
+        with self._lock:
+            self._loaded_at = None
+            self._generation += 1
+            self._dirty = None
+
+    def check_rows(self, epoch):
+        """依列號寫入前 (持有 RowEpoch 共用鎖時) 呼叫：載入之後別的程序搬過列，就丟掉索引，下次查詢重載。
+
+        不必 expire 共用快照：早於搬列時間的快照本來就不會被拿來用。
+        """
+        with self._lock:
+            if self._loaded_at is not None and self.rows_epoch != epoch:
+                logger.info("rows moved by another process (epoch %s -> %s), reloading index", self.rows_epoch, epoch)
+                self.invalidate_local()
+
+    def _put_keys(self, row_num, email, case_id):
+        email, case_id = normalize_key(email), normalize_key(case_id)
+        self._keys[row_num] = (email, case_id)
+        # 重複資料以最上面那列為準 (與原本逐列掃描的行為一致)
+        if email and self._by_email.get(email, row_num + 1) > row_num:
+            self._by_email[email] = row_num
+        if case_id and self._by_case.get(case_id, row_num + 1) > row_num:
+            self._by_case[case_id] = row_num
+
+    def _put(self, row_num, record):
+        self._rows[row_num] = record
+        self._put_keys(row_num, record.get("Email"), record.get("case_id"))
+
+    def _drop_keys(self, row_num):
+        email, case_id = self._keys.pop(row_num, ("", ""))
+        for mapping, key in ((self._by_email, email), (self._by_case, case_id)):
+            if mapping.get(key) == row_num:
+                del mapping[key]
+
+    # --- 查詢 ---
+    def _fetch_row(self, ws, row_num):
+        from gspread.utils import numericise_all
+
+        values = ws.row_values(row_num)
+        values = values + [""] * (len(self.headers) - len(values))
+        # 與 get_all_records 相同的數字轉換，兩種模式回傳的資料長得一樣
+        return dict(zip(self.headers, numericise_all(values[:len(self.headers)], default_blank="")))
+
+    def _lookup(self, mapping_name, key, ws_loader):
+        with self._lock:
+            self.ensure(ws_loader)
+            row_num = getattr(self, mapping_name).get(normalize_key(key))
+            if row_num is None:
+                return None, None
+            record = self._rows.get(row_num)
+            if record is not None:
+                return row_num, dict(record)
+            generation = self._generation
+        # projected 模式：只讀這一列，不佔著鎖等網路
+        record = self._fetch_row(ws_loader(), row_num)
+        with self._lock:
+            if generation == self._generation:
+                self._rows[row_num] = record
+        return row_num, dict(record)
+
+    def find_email(self, email, ws_loader):
+        return self._lookup("_by_email", email, ws_loader)
+
+    def find_case(self, case_id, ws_loader):
+        return self._lookup("_by_case", case_id, ws_loader)
+
+    def emails(self, ws_loader):
+        """索引裡所有 Email (已 normalize)；projected 模式也只用到 key 欄位。"""
+        with self._lock:
+            self.ensure(ws_loader)
+            return set(self._by_email)
+
+    # --- 寫入後就地更新 ---
+    def patch(self, row_num, values):
+        """values 可用欄名或 1-based 欄號當 key。"""
+        with self._lock:
+            # 過期但沒被 invalidate 的索引列號仍然對：照樣就地更新 (背景重讀換上時會再補回來)
+            if row_num not in self._keys or self._loaded_at is None:
+                self.invalidate()
+                return
+            self._generation += 1
+            named = {}
+            for key, value in values.items():
+                if isinstance(key, int):
+                    if key > len(self.headers):
+                        continue
+                    key = self.headers[key - 1]
+                named[key] = value
+            email, case_id = self._keys[row_num]
+            self._drop_keys(row_num)
+            record = self._rows.get(row_num)
+            if record is not None:
+                record.update(named)
+                self._put(row_num, record)
+                if self._uses_shared():
+                    self._share(self.shared.put, {row_num: dict(record)})
+            else:
+                # projected 模式下這列還沒讀過：只更新 key，資料下次查詢再讀
+                self._put_keys(row_num, named.get("Email", email), named.get("case_id", case_id))
+            if self._dirty is not None:
+                self._dirty[row_num] = (self._rows.get(row_num), self._keys[row_num])
+
+    def add(self, row_values, append_response=None):
+        self.add_rows([row_values], append_response)
+
+    def add_rows(self, rows, append_response=None):
+        # append_rows 寫入的是連續列，從回傳的起始列往下編號
+        with self._lock:
+            first = appended_row(append_response)
+            if first is None or self._loaded_at is None or not self.headers:
+                self.invalidate()
+                return
+            self._generation += 1
+            added = {}
+            for offset, row_values in enumerate(rows):
+                record = {h: (row_values[i] if i < len(row_values) else "") for i, h in enumerate(self.headers)}
+                self._put(first + offset, record)
+                added[first + offset] = dict(record)
+                if self._dirty is not None:
+                    self._dirty[first + offset] = (dict(record), self._keys[first + offset])
+            if self._uses_shared():
+                self._share(self.shared.put, added)
+
+
+def appended_row(append_response):
+    # append_row 回傳 {"updates": {"updatedRange": "工作表1!A12:AB12", ...}}
+    from gspread.utils import a1_to_rowcol
+
+    try:
+        updated = append_response["updates"]["updatedRange"]
+        start = updated.split("!")[-1].split(":")[0]
+        return a1_to_rowcol(start)[0]
+    except (TypeError, KeyError, IndexError, ValueError):
+        return None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _shared_snapshot(sheet_key):
+    # st.secrets["shared_cache"]：path 有設才啟用 (同主機的 replica 指向同一個檔案)，ttl 預設與索引相同
+    conf = secret_section("shared_cache")
+    if not conf.get("path"):
+        return None
+    from services.shared_cache import SharedSnapshot
+
+    return SharedSnapshot(conf["path"], sheet_key, float(conf.get("ttl", DEFAULT_TTL)))
+
+
+def row_epoch(sheet_key):
+    """這份表的 RowEpoch：同主機的 app 與命令列依網址算出同一個檔案。
+
+    st.secrets["shared_cache"]["rows_dir"] 可指定目錄，預設是系統暫存目錄。
+    """
+    from services.shared_cache import RowEpoch
+
+    directory = secret_section("shared_cache").get("rows_dir") or tempfile.gettempdir()
+    digest = hashlib.sha1(sheet_key.encode("utf-8")).hexdigest()[:16]
+    return RowEpoch(os.path.join(directory, f"sheet_rows_{digest}.json"))
+
+
+def get_index(sheet_key, mode=None):
+    """依試算表網址取得共用索引；同一份表在 app.py 與 GoogleSheetService 之間共用。"""
+    with _indexes_lock:
+        if sheet_key not in _indexes:
+            index = SheetIndex(shared=_shared_snapshot(sheet_key), rows=row_epoch(sheet_key))
+            if index.shared is not None:
+                index.ttl = index.shared.ttl
+            _indexes[sheet_key] = index
+        index = _indexes[sheet_key]
+    if mode is not None and mode != index.mode:
+        if mode not in LOOKUP_MODES:
+            raise ValueError(f"unknown lookup mode: {mode}")
+        with index._lock:
+            index.mode = mode
+            index.invalidate()
+    return index
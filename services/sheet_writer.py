@@ -0,0 +1,40 @@
+def _runs(cols):
+    # 把排序後的欄號切成連續區段，例如 [5,6,7,8,24] -> [[5,6,7,8],[24]]
+    runs = []
+    for col in sorted(cols):
+        if runs and col == runs[-1][-1] + 1:
+            runs[-1].append(col)
+        else:
+            runs.append([col])
+    return runs
+
+
+def resolve_columns(values, columns):
+    """把 {欄名或欄號: 值} 轉成 {欄號: 值}；未知欄名略過。"""
+    resolved = {}
+    for key, value in values.items():
+        col = key if isinstance(key, int) else columns.get(key)
+        if col:
+            resolved[col] = value
+    return resolved
+
+
+def batch_write(ws, updates, columns=None, value_input_option="USER_ENTERED"):
+    """一次 values.batchUpdate 寫完多列多欄。
+
+    updates: {列號: {欄名或欄號: 值}}，欄名透過 columns ({欄名: 欄號}) 換算。
+    回傳換算後的 {列號: {欄號: 值}}，方便呼叫端同步更新索引。
+    """
+    from gspread.utils import rowcol_to_a1
+
+    resolved = {row: resolve_columns(values, columns or {}) for row, values in updates.items()}
+    data = []
+    for row, cells in resolved.items():
+        for run in _runs(cells):
+            rng = rowcol_to_a1(row, run[0])
+            if len(run) > 1:
+                rng += ":" + rowcol_to_a1(row, run[-1])
+            data.append({"range": rng, "values": [[cells[c] for c in run]]})
+    if data:
+        ws.batch_update(data, value_input_option=value_input_option)
+    return resolved
@@ -0,0 +1,383 @@
+import json
+from abc import ABC, abstractmethod
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+
+from services.archive import ArchiveShelf, delete_rows
+from services.quota import background
+from services.settings import secret_section
+from services.sheet_client import configured_sheet_url, get_connection
+from services.sheet_index import appended_row, get_index, normalize_key
+from services.sheet_writer import batch_write, resolve_columns
+
+logger = logging.getLogger(__name__)
+
+# 與 save_phase1_new 寫入的 28 欄順序一致
+SHEET_COLUMNS = [
+    "Email", "case_id", "party_a", "provider", "plan", "start_date", "pay_day", "pay_date",
+    "chk_ad_account", "chk_pixel", "chk_fanpage", "chk_bm", "fanpage_url", "landing_url",
+    "comp1", "comp2", "comp3", "who_problem", "what_problem", "how_solve", "budget",
+    "last_update_at", "msg_type", "plan_raw", "display_label", "chk_remote", "chk_creatives", "password",
+]
+
+
+class Storage(ABC):
+    """app.py 與 GoogleSheetService 用到的資料操作。列號沿用 Sheet 的 1-based 列號 (資料從第 2 列開始)。
+
+    必要的操作都是抽象方法：漏實作的後端在建立時就失敗，不會等到某個請求用到才出錯。
+    """
+
+    @property
+    def headers(self):
+        return SHEET_COLUMNS
+
+    @property
+    def columns(self):
+        return {h: i + 1 for i, h in enumerate(self.headers)}
+
+    def ensure_headers(self, columns):
+        """表還沒有表頭時寫入 columns；回傳目前的表頭。表頭固定的後端不必做事。"""
+        return self.headers
+
+    @abstractmethod
+    def find_by_email(self, email):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_by_case(self, case_id):
+        raise NotImplementedError
+
+    def find_archived(self, email=None, case_id=None):
+        """熱資料找不到時查封存：(封存分頁, 列號, 資料)；沒有封存的後端一律找不到。"""
+        return None, None, None
+
+    def unarchive(self, title, row_num, record):
+        """把封存的一列搬回熱資料，回傳 (新列號, 資料)。"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def all_records(self):
+        """整張表：[(列號, 資料), ...]，依列號排序。"""
+        raise NotImplementedError
+
+    def emails(self):
+        """表上所有 Email (已 normalize)，批次建檔先用它比對重複。"""
+        return {normalize_key(r.get("Email")) for _, r in self.all_records()}
+
+    @abstractmethod
+    def append_row(self, row):
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_rows(self, rows):
+        """一次寫入多列，回傳各列列號。"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_fields(self, row_num, values, raw=False):
+        """values: {欄名或欄號: 值}；raw=True 時 Sheet 端不做格式判讀。回傳 {欄號: 值}。"""
+        raise NotImplementedError
+
+    def update_many(self, updates, raw=False):
+        """{列號: {欄名或欄號: 值}}，多列一起寫。"""
+        return {row_num: self.update_fields(row_num, values, raw) for row_num, values in updates.items()}
+
+    def row_writes(self):
+        """找列到依列號寫完的這段包在這裡面：期間列號不會被別的程序搬動。列號固定的後端不必做事。"""
+        return nullcontext()
+
+
+class SheetStorage(Storage):
+    def __init__(self, sheet_url, lookup_mode=None):
+        self.sheet_url = sheet_url
+        self.conn = get_connection(sheet_url)
+        self.index = get_index(sheet_url, lookup_mode)
+        self.archive = ArchiveShelf(sheet_url)
+        self._headers_lock = threading.Lock()
+
+    @property
+    def headers(self):
+        self.index.ensure(self.conn.worksheet)
+        return self.index.headers
+
+    @property
+    def columns(self):
+        self.index.ensure(self.conn.worksheet)
+        return self.index.columns
+
+    def ensure_headers(self, columns):
+        # 全新的空白試算表：寫入表頭後索引與共用快照都要重讀，之後的查詢與寫入才對得上欄位
+        with self._headers_lock:
+            if not self.headers:
+                self.conn.worksheet().append_row(list(columns))
+                self.index.invalidate()
+            return self.headers
+
+    def find_by_email(self, email):
+        return self.index.find_email(email, self.conn.worksheet)
+
+    def find_by_case(self, case_id):
+        return self.index.find_case(case_id, self.conn.worksheet)
+
+    def find_archived(self, email=None, case_id=None):
+        return self.archive.find_email(email) if email else self.archive.find_case(case_id)
+
+    def unarchive(self, title, row_num, record):
+        # 先寫回熱分頁再刪封存：中途失敗頂多兩邊各一份，查詢以熱分頁為準
+        hot_row = self.append_row([record.get(h, "") for h in self.headers])
+        self.archive.delete(title, [row_num])
+        return hot_row, record
+
+    def all_records(self):
+        return list(enumerate(self.conn.worksheet().get_all_records(), start=2))
+
+    def emails(self):
+        # 與 find_by_email 共用索引：接著 register_many 逐筆查重複時不必再讀一次整張表
+        return self.index.emails(self.conn.worksheet)
+
+    def append_row(self, row):
+        resp = self.conn.worksheet().append_row(row)
+        self.index.add(row, resp)
+        return appended_row(resp)
+
+    def append_rows(self, rows):
+        if not rows:
+            return []
+        resp = self.conn.worksheet().append_rows(rows)
+        self.index.add_rows(rows, resp)
+        first = appended_row(resp)
+        return [first + i for i in range(len(rows))] if first is not None else [None] * len(rows)
+
+    @contextmanager
+    def row_writes(self):
+        # 封存刪列可能是另一個程序 (命令列) 做的，本程序的鎖擋不住：用同主機共用的 RowEpoch 檔案鎖，
+        # 寫入之間互不等待，只和刪列互斥；載入索引後有人搬過列就先重載，再由呼叫端找列
+        with self.index.rows.writing() as epoch:
+            self.index.check_rows(epoch)
+            yield
+
+    def moving_rows(self):
+        """刪列 (會改變列號) 的整段作業持有：等進行中的依列號寫入結束、擋住新的。"""
+        return self.index.rows.moving()
+
+    def remove_rows(self, row_nums):
+        """刪掉熱分頁的這些列；要在 moving_rows() 裡呼叫。刪完換列號世代，各程序下次寫入前重載索引。"""
+        try:
+            delete_rows(self.conn, row_nums)
+        finally:
+            # 刪到一半失敗也換世代：列號可能已經變了
+            self.index.rows.bump()
+            self.index.invalidate()
+
+    def update_fields(self, row_num, values, raw=False):
+        # 欄號可直接寫；有欄名才需要表頭對照
+        columns = self.columns if any(isinstance(k, str) for k in values) else {}
+        written = batch_write(self.conn.worksheet(), {row_num: values}, columns=columns,
+                              value_input_option="RAW" if raw else "USER_ENTERED")
+        self.index.patch(row_num, written[row_num])
+        return written[row_num]
+
+    def update_many(self, updates, raw=False):
+        # 多列合成同一個 values.batchUpdate
+        columns = self.columns if any(isinstance(k, str) for v in updates.values() for k in v) else {}
+        written = batch_write(self.conn.worksheet(), updates, columns=columns,
+                              value_input_option="RAW" if raw else "USER_ENTERED")
+        for row_num, values in written.items():
+            self.index.patch(row_num, values)
+        return written
+
+
+class SQLiteStorage(Storage):
+    """本機 SQLite：Email / case_id 有索引；設定 mirror 時每筆寫入另記在 outbox，由背景同步回 Sheet。"""
+
+    def __init__(self, path, mirror=None):
+        self.path = path
+        self.mirror = mirror
+        self._lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS clients (
+                row_num INTEGER PRIMARY KEY,
+                email TEXT NOT NULL DEFAULT '',
+                case_id TEXT NOT NULL DEFAULT '',
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_clients_email ON clients(email);
+            CREATE INDEX IF NOT EXISTS ix_clients_case ON clients(case_id);
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                case_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                raw INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.db.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    # --- 查詢 ---
+    def _find(self, column, key):
+        with self._lock:
+            hit = self.db.execute(f"SELECT row_num, data FROM clients WHERE {column} = ? ORDER BY row_num LIMIT 1",
+                                  (normalize_key(key),)).fetchone()
+        if not hit:
+            return None, None
+        return hit[0], json.loads(hit[1])
+
+    def find_by_email(self, email):
+        return self._find("email", email)
+
+    def find_by_case(self, case_id):
+        return self._find("case_id", case_id)
+
+    def all_records(self):
+        with self._lock:
+            rows = self.db.execute("SELECT row_num, data FROM clients ORDER BY row_num").fetchall()
+        return [(row_num, json.loads(data)) for row_num, data in rows]
+
+    def emails(self):
+        with self._lock:
+            return {email for (email,) in self.db.execute("SELECT email FROM clients WHERE email != ''")}
+
+    def count(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+
+    # --- 寫入 ---
+    def _upsert(self, row_num, record):
+        self.db.execute(
+            "INSERT OR REPLACE INTO clients (row_num, email, case_id, data) VALUES (?, ?, ?, ?)",
+            (row_num, normalize_key(record.get("Email")), normalize_key(record.get("case_id")),
+             json.dumps(record, ensure_ascii=False, default=str)))
+
+    def _queue(self, op, case_id, payload, raw=False):
+        if self.mirror is not None:
+            self.db.execute("INSERT INTO outbox (op, case_id, payload, raw) VALUES (?, ?, ?, ?)",
+                            (op, str(case_id), json.dumps(payload, ensure_ascii=False, default=str), int(raw)))
+
+    def load_records(self, records, start_row=2):
+        """整批匯入 (例如從 Sheet 的 get_all_records 快照初始化)。"""
+        with self._transaction():
+            for i, record in enumerate(records):
+                self._upsert(start_row + i, {h: record.get(h, "") for h in SHEET_COLUMNS})
+
+    def append_row(self, row):
+        return self.append_rows([row])[0]
+
+    def append_rows(self, rows):
+        with self._transaction():
+            first = self.db.execute("SELECT COALESCE(MAX(row_num), 1) + 1 FROM clients").fetchone()[0]
+            for i, row in enumerate(rows):
+                record = {h: (row[j] if j < len(row) else "") for j, h in enumerate(SHEET_COLUMNS)}
+                self._upsert(first + i, record)
+                self._queue("append", record["case_id"], list(row))
+        return [first + i for i in range(len(rows))]
+
+    def update_fields(self, row_num, values, raw=False):
+        written = resolve_columns(values, self.columns)
+        with self._transaction():
+            hit = self.db.execute("SELECT data FROM clients WHERE row_num = ?", (row_num,)).fetchone()
+            if not hit:
+                raise KeyError(f"row {row_num} not found")
+            record = json.loads(hit[0])
+            for col, value in written.items():
+                record[SHEET_COLUMNS[col - 1]] = value
+            self._upsert(row_num, record)
+            # 同步回 Sheet 時用 case_id 找列，不依賴兩邊列號一致
+            self._queue("update", record.get("case_id", ""), {SHEET_COLUMNS[c - 1]: v for c, v in written.items()}, raw)
+        return written
+
+    # --- 同步回 Sheet ---
+    def drain_outbox(self, limit=200):
+        """依序把 outbox 套用到 mirror，成功一筆刪一筆；失敗就停下等下一輪。回傳處理筆數。"""
+        if self.mirror is None:
+            return 0
+        with self._lock:
+            pending = self.db.execute("SELECT id, op, case_id, payload, raw FROM outbox ORDER BY id LIMIT ?",
+                                      (limit,)).fetchall()
+        done = 0
+        for entry_id, op, case_id, payload, raw in pending:
+            payload = json.loads(payload)
+            with self.mirror.row_writes():
+                row_num, _ = self.mirror.find_by_case(case_id)
+                if op == "append":
+                    if row_num is None:
+                        self.mirror.append_row(payload)
+                elif row_num is None:
+                    logger.warning("mirror: case_id %s not found in sheet, update skipped", case_id)
+                else:
+                    self.mirror.update_fields(row_num, payload, raw=bool(raw))
+            with self._lock:
+                self.db.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+            done += 1
+        return done
+
+
+class SheetMirror:
+    """背景執行緒：每隔 interval 秒把 SQLite 的 outbox 推回 Google Sheet。"""
+
+    def __init__(self, storage, interval=5.0):
+        self.storage = storage
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheet-mirror", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with background():
+                    while self.storage.drain_outbox():
+                        pass
+            except Exception:
+                logger.exception("sheet mirror failed, will retry")
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def _build_storage(sheet_url):
+    conf = secret_section("storage")
+    lookup_mode = conf.get("lookup_mode", "full")
+    if conf.get("backend", "sheets") != "sqlite":
+        return SheetStorage(sheet_url, lookup_mode)
+    mirror = SheetStorage(sheet_url, lookup_mode) if conf.get("mirror_to_sheet", True) else None
+    storage = SQLiteStorage(conf.get("path", "clients.db"), mirror=mirror)
+    if mirror is not None:
+        if storage.count() == 0:
+            # 第一次啟動：用 Sheet 現有資料初始化
+            storage.load_records(mirror.conn.worksheet().get_all_records())
+        SheetMirror(storage, float(conf.get("mirror_interval", 5))).start()
+    return storage
+
+
+def get_storage(sheet_url=None):
+    """依 st.secrets["storage"] 取得程序內共用的儲存後端。
+
+    backend: "sheets" (預設) 或 "sqlite"；lookup_mode: "full" (預設) 或 "projected"。
+    """
+    sheet_url = sheet_url or configured_sheet_url()
+    with _storages_lock:
+        if sheet_url not in _storages:
+            _storages[sheet_url] = _build_storage(sheet_url)
+        return _storages[sheet_url]
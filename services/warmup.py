@@ -0,0 +1,49 @@
+import logging
+import threading
+
+from services.document_utils import get_template
+from services.metrics import measure
+from services.quota import background
+from services.storage import SheetStorage, get_storage
+
+logger = logging.getLogger(__name__)
+
+_thread = None
+_lock = threading.Lock()
+
+
+def warm_up(sheet_url=None):
+    """把第一位使用者會碰到的冷啟動成本先付掉：授權、開表、載入索引、排版合約骨架。"""
+    # 各步驟互不相依，某一步失敗 (例如 Sheet 暫時連不上) 不影響其他步驟，之後真正用到時會再試
+    steps = [("sheet", lambda: _warm_sheet(sheet_url)), ("templates", _warm_templates)]
+    for name, step in steps:
+        try:
+            # 背景優先權：暖機的 Sheet 呼叫不動用互動請求的保留配額，使用者登入先走
+            with measure(f"warmup.{name}"), background():
+                step()
+        except Exception:
+            logger.exception("warm-up step %s failed", name)
+
+
+def _warm_sheet(sheet_url):
+    storage = get_storage(sheet_url)
+    sheet = storage if isinstance(storage, SheetStorage) else getattr(storage, "mirror", None)
+    if sheet is not None:
+        # headers 會觸發 authorize + open_by_url + 索引載入
+        sheet.headers
+
+
+def _warm_templates():
+    for monthly in (True, False):
+        for with_case_num in (True, False):
+            get_template(monthly, with_case_num)
+
+
+def start_warmup(sheet_url=None):
+    """每個程序只啟動一次背景暖機；Streamlit 每次 rerun 呼叫都只會拿到同一條執行緒。"""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=warm_up, args=(sheet_url,), name="warmup", daemon=True)
+            _thread.start()
+        return _thread
@@ -0,0 +1,381 @@
+import json
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from services.journal import JournalInUseError, WriteJournal
+from services.settings import secret_section
+from services.sheet_client import configured_sheet_url
+from services.sheet_index import normalize_key
+from services.storage import SHEET_COLUMNS, get_storage
+
+logger = logging.getLogger(__name__)
+
+# 每次寫入都會蓋上新的 last_update_at，當作這一列的版本號
+VERSION_COLUMN = "last_update_at"
+VERSION_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class DuplicateClientError(Exception):
+    """同一個 Email 已經建檔。"""
+
+
+class ClientNotFoundError(Exception):
+    """依 case_id / Email 找不到要更新的列。"""
+
+
+class StaleWriteError(Exception):
+    """讀取之後這一列已被別的 session 更新過 (last_update_at 不同)。"""
+
+
+def version_key(value):
+    # 只比數字：Sheet 顯示格式 (2026-01-01 / 2026/1/1) 不同也視為同一版
+    return tuple(int(x) for x in re.findall(r"\d+", str(value or "")))
+
+
+def next_version(current=None):
+    """現在時間；同一秒內連續寫入時往後推一秒，保證版本號嚴格遞增。"""
+    now = datetime.now().replace(microsecond=0)
+    parts = version_key(current)
+    if len(parts) >= 6:
+        try:
+            prev = datetime(*parts[:6])
+        except ValueError:
+            prev = None
+        if prev is not None and now <= prev:
+            now = prev + timedelta(seconds=1)
+    return now.strftime(VERSION_FORMAT)
+
+
+class KeyLocks:
+    """依 key 分開的鎖：不同客戶的寫入互不等待，同一客戶的寫入依序進行。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @contextmanager
+    def hold(self, *keys):
+        # 固定排序後再依序上鎖，同時鎖多個 key 也不會互相卡死
+        keys = sorted(set(k for k in keys if k))
+        with self._lock:
+            entries = []
+            for key in keys:
+                entry = self._locks.setdefault(key, [threading.Lock(), 0])
+                entry[1] += 1
+                entries.append(entry)
+        acquired = []
+        try:
+            for entry in entries:
+                entry[0].acquire()
+                acquired.append(entry)
+            yield
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            with self._lock:
+                # 沒人在用的鎖就丟掉，鎖表不會隨客戶數無限長大
+                for key, entry in zip(keys, entries):
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class SharedLock:
+    """一般寫入各自持有 shared()，可同時進行；exclusive() 等它們都結束後獨佔 (封存搬列時列號會變)。"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._writer = True
+            while self._readers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class WriteCoordinator:
+    """所有寫入的單一入口：建檔前鎖 Email 再檢查重複，更新時鎖 case_id、當下重新找列並比對版本。
+
+    找列走程序內索引 (不重讀整張表)；列號永遠在寫入當下決定，不信任 session 裡存的舊列號。
+    有 journal 時寫入只記進本機日誌 (fsync 完就回覆)，由背景依序套用到 storage；
+    還沒套用的內容放在 overlay，查詢時蓋在 storage 的資料上面，使用者馬上看得到自己剛存的東西。
+    overlay 以 Email 為 key (建檔時就鎖 Email 保證不重複)；舊資料的 case_id 可能重複，只當次要索引。
+    尚未寫進 Sheet 的新建檔以負數列號當佔位。
+    查詢在熱資料找不到時會再查封存 (回傳的是封存分頁的列號，只用來判斷「有這個客戶」)；
+    更新封存的客戶時先把那一列搬回熱資料再寫。
+    """
+
+    def __init__(self, storage, locks=None, journal_path=None):
+        self.storage = storage
+        self.locks = locks or KeyLocks()
+        self._rows_lock = SharedLock()
+        self._overlay = {}
+        self._overlay_cases = {}
+        self._overlay_lock = threading.Lock()
+        self.journal = None
+        if journal_path:
+            self.journal = WriteJournal(journal_path, self._apply)
+            # 上次沒套用完的 entry：重建 overlay 後交給背景繼續套用
+            for entry in self.journal.pending():
+                try:
+                    self._remember(entry)
+                except Exception:
+                    logger.exception("journal: cannot rebuild overlay for seq %s", entry["seq"])
+            self.journal.start()
+
+    @staticmethod
+    def email_key(email):
+        return "email:" + normalize_key(email)
+
+    @staticmethod
+    def case_key(case_id):
+        return "case:" + normalize_key(case_id)
+
+    def lock_email(self, email):
+        return self.locks.hold(self.email_key(email))
+
+    def exclusive(self):
+        """擋住所有依列號的寫入 (含日誌背景套用)，讓封存作業搬動列。"""
+        return self._rows_lock.exclusive()
+
+    def pending_cases(self):
+        """還在日誌裡等著套用的 case_id (已正規化)。"""
+        with self._overlay_lock:
+            return {normalize_key(entry["record"].get("case_id")) for entry in self._overlay.values()}
+
+    # --- 查詢 (overlay 優先) ---
+    def _overlay_get(self, case_id=None, email=None):
+        # 有 Email 就用 Email 找；同時給 case_id 時兩個都要對上
+        with self._overlay_lock:
+            key = self.email_key(email) if email else self._overlay_cases.get(self.case_key(case_id))
+            entry = self._overlay.get(key)
+            if entry is None or (case_id and normalize_key(entry["record"].get("case_id")) != normalize_key(case_id)):
+                return None
+            return entry["row"], dict(entry["record"])
+
+    def find_by_email(self, email):
+        hit = self._overlay_get(email=email) or self.storage.find_by_email(email)
+        return hit if hit[0] is not None else self.storage.find_archived(email=email)[1:]
+
+    def find_by_case(self, case_id):
+        hit = self._overlay_get(case_id=case_id) or self.storage.find_by_case(case_id)
+        return hit if hit[0] is not None else self.storage.find_archived(case_id=case_id)[1:]
+
+    # --- 寫入 ---
+    def register(self, row, email):
+        with self.lock_email(email):
+            if self.find_by_email(email)[0] is not None:
+                raise DuplicateClientError(email)
+            if self.journal is None:
+                return self.storage.append_row(row)
+            return -self._journal({"op": "append", "rows": [row]})
+
+    def register_many(self, rows, emails):
+        """整批建檔；已存在或批內重複的 Email 略過。回傳 (寫入的列號, 略過的 Email)。"""
+        with self.locks.hold(*[self.email_key(e) for e in emails]):
+            keep, skipped, seen = [], [], set()
+            for row, email in zip(rows, emails):
+                key = normalize_key(email)
+                if key in seen or self.find_by_email(email)[0] is not None:
+                    skipped.append(email)
+                    continue
+                seen.add(key)
+                keep.append(row)
+            if not keep:
+                return [], skipped
+            if self.journal is None:
+                return self.storage.append_rows(keep), skipped
+            seq = self._journal({"op": "append", "rows": keep})
+            return [-seq] * len(keep), skipped
+
+    def _resolve(self, case_id, email):
+        row_num, record = self._overlay_get(case_id=case_id, email=email) or self._locate(case_id, email)
+        if row_num is None:
+            title, archived_row, record = self.storage.find_archived(email=email, case_id=None if email else case_id)
+            if title is None or (case_id and normalize_key(record.get("case_id")) != normalize_key(case_id)):
+                raise ClientNotFoundError(case_id or email)
+            # 封存的客戶又有更新 (例如回來續約)：搬回熱分頁再寫
+            row_num, record = self.storage.unarchive(title, archived_row, record)
+        return row_num, record
+
+    def _locate(self, case_id, email):
+        # 在 storage 找列：有 Email 就以 Email 為準，case_id 只用來確認是同一個案件
+        # (舊資料裡同名同日建檔的客戶 case_id 會重複，只靠 case_id 可能找到別人的列)
+        if email:
+            row_num, record = self.storage.find_by_email(email)
+            if row_num is not None and case_id and normalize_key(record.get("case_id")) != normalize_key(case_id):
+                return None, None
+            return row_num, record
+        return self.storage.find_by_case(case_id)
+
+    def update(self, values, case_id=None, email=None, expected_version=None, raw=False):
+        """values: {欄名或欄號: 值}。expected_version 是呼叫端讀到的 last_update_at；None 表示不檢查。
+
+        回傳新的版本號 (呼叫端存起來，下次更新帶回來)。
+        """
+        # 同時鎖 case_id 與 Email：和以 Email 為準的建檔 / GoogleSheetService 寫入互斥；
+        # row_writes 讓找到的列號在寫完之前不會被別的程序 (命令列封存) 搬走
+        keys = [self.case_key(case_id) if case_id else None, self.email_key(email) if email else None]
+        with self.locks.hold(*keys), self._rows_lock.shared(), self.storage.row_writes():
+            row_num, record = self._resolve(case_id, email)
+            current = record.get(VERSION_COLUMN, "")
+            if expected_version is not None and version_key(current) != version_key(expected_version):
+                raise StaleWriteError(f"{case_id or email}: 已被更新 ({expected_version} -> {current})")
+            version = next_version(current)
+            values = {**values, VERSION_COLUMN: version}
+            if self.journal is None:
+                self.storage.update_fields(row_num, values, raw=raw)
+            else:
+                # 日誌裡一律用欄名 (JSON 的 key 只能是字串)，套用時再依當下的表頭換算
+                named = {SHEET_COLUMNS[k - 1] if isinstance(k, int) else k: v for k, v in values.items()}
+                self._journal({"op": "update", "case_id": record.get("case_id") or case_id,
+                               "email": record.get("Email") or email, "values": named, "raw": raw},
+                              base=(row_num, record))
+            return version
+
+    # --- 日誌 / overlay ---
+    def _journal(self, entry, base=None):
+        # 先轉成 JSON 能表示的值 (日期 -> 字串)，overlay 與重播時寫進 Sheet 的內容完全一樣
+        entry = json.loads(json.dumps(entry, ensure_ascii=False, default=str))
+        entry["seq"] = self.journal.append(entry)
+        self._remember(entry, base)
+        return entry["seq"]
+
+    def _remember(self, entry, base=None):
+        if entry["op"] == "append":
+            with self._overlay_lock:
+                for row in entry["rows"]:
+                    record = {h: (row[i] if i < len(row) else "") for i, h in enumerate(SHEET_COLUMNS)}
+                    self._put_overlay(-entry["seq"], record, entry["seq"])
+            return
+        current = self._overlay_get(entry.get("case_id"), entry.get("email"))
+        if current is not None:
+            row_num, record = current
+        elif base is not None:
+            row_num, record = base[0], dict(base[1])
+        else:
+            row_num, record = self._resolve(entry.get("case_id"), entry.get("email"))
+        record.update(entry["values"])
+        with self._overlay_lock:
+            self._put_overlay(row_num, record, entry["seq"])
+
+    def _put_overlay(self, row_num, record, seq):
+        key = self.email_key(record.get("Email")) if record.get("Email") else self.case_key(record.get("case_id"))
+        self._overlay[key] = {"row": row_num, "record": record, "seq": seq}
+        if record.get("case_id"):
+            self._overlay_cases[self.case_key(record["case_id"])] = key
+
+    def _forget(self, seq):
+        # 套用到 seq 為止：比它舊的 overlay 都已反映在 storage；之後又有新寫入的保留
+        with self._overlay_lock:
+            for key, entry in list(self._overlay.items()):
+                if entry["seq"] <= seq:
+                    del self._overlay[key]
+            self._overlay_cases = {c: k for c, k in self._overlay_cases.items() if k in self._overlay}
+
+    def _apply(self, entries):
+        """WriteJournal 的套用端：連續的建檔合成一次 append_rows，連續的更新合成一次 batch update。
+
+        可以重複執行：表上已有同一個 Email + case_id 的建檔不再新增，更新則是把欄位設成同樣的值。
+        """
+        # 封存作業搬列時先等它做完，列號才會是對的
+        with self._rows_lock.shared():
+            email_col, case_col = SHEET_COLUMNS.index("Email"), SHEET_COLUMNS.index("case_id")
+            i = 0
+            while i < len(entries):
+                op, raw = entries[i]["op"], entries[i].get("raw", False)
+                j = i
+                while j < len(entries) and entries[j]["op"] == op and entries[j].get("raw", False) == raw:
+                    j += 1
+                group, i = entries[i:j], j
+                if op == "append":
+                    rows, seen = [], set()
+                    for row in (r for e in group for r in e["rows"]):
+                        key = (normalize_key(row[email_col]), normalize_key(row[case_col]))
+                        if key in seen:
+                            continue
+                        row_num, record = self.storage.find_by_email(row[email_col])
+                        if row_num is not None:
+                            if normalize_key(record.get("case_id")) == key[1]:
+                                # 上次套用到一半就當掉：這一列已經寫進去了
+                                continue
+                            logger.warning("journal: %s already has case %s, appending %s anyway",
+                                           row[email_col], record.get("case_id"), row[case_col])
+                        seen.add(key)
+                        rows.append(row)
+                    if rows:
+                        self.storage.append_rows(rows)
+                else:
+                    with self.storage.row_writes():
+                        updates = {}
+                        for e in group:
+                            row_num, _ = self._locate(e.get("case_id"), e.get("email"))
+                            if row_num is None:
+                                logger.warning("journal: %s not found in storage, update seq %s skipped",
+                                               e.get("case_id") or e.get("email"), e["seq"])
+                                continue
+                            updates.setdefault(row_num, {}).update(e["values"])
+                        if updates:
+                            self.storage.update_many(updates, raw=raw)
+            self._forget(entries[-1]["seq"])
+
+
+_coordinators = {}
+_coordinators_lock = threading.Lock()
+
+
+def get_coordinator(sheet_url=None):
+    """與 get_storage 一樣依試算表網址共用；app.py 與 GoogleSheetService 拿到同一組鎖。
+
+    st.secrets["journal"]：enabled (預設 false)、path (預設 write_journal.jsonl)。
+    日誌要明確開啟，而且每個 replica 各自一個 path；同一個檔案已被別的程序開著時不用日誌，直接寫表。
+    """
+    sheet_url = sheet_url or configured_sheet_url()
+    with _coordinators_lock:
+        if sheet_url not in _coordinators:
+            conf = secret_section("journal")
+            path = conf.get("path", "write_journal.jsonl") if conf.get("enabled", False) else None
+            try:
+                coordinator = WriteCoordinator(get_storage(sheet_url), journal_path=path)
+            except JournalInUseError:
+                logger.error("journal %s is used by another process; writing to the sheet directly", path)
+                coordinator = WriteCoordinator(get_storage(sheet_url))
+            _coordinators[sheet_url] = coordinator
+        return _coordinators[sheet_url]
+
+
+def set_coordinator(coordinator, sheet_url=None):
+    """換掉某份試算表的 coordinator (benchmark 用不帶日誌的同步版本)。"""
+    sheet_url = sheet_url or configured_sheet_url()
+    with _coordinators_lock:
+        _coordinators[sheet_url] = coordinator
@@ -1,5 +1,6 @@
 import streamlit as st
 from datetime import datetime, timedelta
+from services.artifact_store import get_artifact_store
 from services.document_utils import generate_docx_bytes
 
 def render_stage1(client_name, client_email):
@@ -71,8 +72,8 @@ def render_stage1(client_name, client_email):
             account_number=ACCOUNT_NUMBER
         )
         
-        # Save to session state for download
-        st.session_state['stage1_docx'] = docx_bytes
+        # Session only keeps the content key; the file lives in the on-disk artifact store
+        st.session_state['stage1_docx_key'] = get_artifact_store().put(docx_bytes)
         
         # Data preparation matching Google Sheet Columns
         st.session_state['stage1_data'] = {
@@ -89,10 +90,47 @@ def render_stage1(client_name, client_email):
         }
         st.success("合約已生成，請確認下方資訊並提交。")
 
-    if 'stage1_docx' in st.session_state:
+    def render_from(data):
+        # Same contract as the preview button, rebuilt from the saved form data
+        def to_date(value):
+            return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+        return generate_docx_bytes(
+            party_a=data["party_a"],
+            email=data["Email"],
+            payment_opt=data["plan"],
+            start_dt=to_date(data["start_date"]),
+            pay_day=int(data["pay_day"]) if data["pay_day"] else None,
+            pay_dt=to_date(data["pay_date"]),
+            case_num=data["case_id"],
+            provider_name=PROVIDER_NAME,
+            bank_name=BANK_NAME,
+            bank_code=BANK_CODE,
+            account_number=ACCOUNT_NUMBER
+        )
+
+    docx_key = st.session_state.get('stage1_docx_key')
+    stage1_data = st.session_state.get('stage1_data')
+    if docx_key and get_artifact_store().path(docx_key) is None:
+        # Evicted from the store: render it again from the form data (cheap, usually a cache hit)
+        if stage1_data:
+            docx_key = st.session_state['stage1_docx_key'] = get_artifact_store().put(render_from(stage1_data))
+        else:
+            del st.session_state['stage1_docx_key']
+            docx_key = None
+            st.warning("合約檔案已過期，請重新點擊「生成 Word 合約預覽」。")
+
+    if docx_key:
+        store = get_artifact_store()
+
+        def docx_data():
+            # The file can still be evicted between this run and the click: fall back to a re-render
+            data = store.read(docx_key)
+            return data if data is not None else render_from(stage1_data)
+
         st.download_button(
             label="⬇️ 下載 Word 合約 (.docx)",
-            data=st.session_state['stage1_docx'],
+            # Read from disk only when the user actually clicks download
+            data=docx_data,
             file_name=f"廣告投放合約_{case_id}.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
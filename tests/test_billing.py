@@ -0,0 +1,91 @@
+"""付款 / 續約排程：月底的付款日、跨年與季繳，逐列對照預期的日期。
+
+    python -m pytest -q
+"""
+import pandas as pd
+import pytest
+
+from services.billing import due_reminders, schedule
+from services.document_utils import MONTHLY_PLAN, QUARTERLY_PLAN
+
+
+def frame(*rows):
+    """rows: (case_id, plan, start_date, pay_day, pay_date)，其餘欄位補上假資料。"""
+    df = pd.DataFrame(rows, columns=["case_id", "plan", "start_date", "pay_day", "pay_date"])
+    df["party_a"] = df["case_id"]
+    df["Email"] = df["case_id"] + "@gmail.com"
+    return df
+
+
+def ts(value):
+    return pd.Timestamp(value) if value else pd.NaT
+
+
+@pytest.mark.parametrize("today, row, next_due, term_start, term_end", [
+    # 月繳：本月付款日還沒過
+    ("2026-01-02", ("m1", MONTHLY_PLAN, "2026-01-01", "5", ""), "2026-01-05", "2026-01-01", "2026-01-31"),
+    # 月底：28 號付款，1/31 時下次是 2 月 28 日
+    ("2026-01-31", ("m2", MONTHLY_PLAN, "2026-01-01", "28", ""), "2026-02-28", "2026-01-31", "2026-03-02"),
+    # 付款日填 31 會壓回 28，當天就是付款日
+    ("2026-02-28", ("m3", MONTHLY_PLAN, "2026-01-01", "31", ""), "2026-02-28", "2026-01-31", "2026-03-02"),
+    # 閏年 2/29：28 號已過，跳到 3 月
+    ("2028-02-29", ("m4", MONTHLY_PLAN, "2028-02-01", "28", ""), "2028-03-28", "2028-02-01", "2028-03-02"),
+    # 跨年
+    ("2026-12-30", ("m5", MONTHLY_PLAN, "2026-01-01", "5", ""), "2027-01-05", "2026-12-27", "2027-01-26"),
+    # 付款日空白用預設 5 號；尚未開始的算第 0 期
+    ("2026-03-31", ("m6", MONTHLY_PLAN, "2026-04-10", "", ""), "2026-04-05", "2026-04-10", "2026-05-10"),
+    # 季繳：pay_date 還沒到
+    ("2026-01-20", ("q1", QUARTERLY_PLAN, "2026-01-31", "5", "2026-01-25"), "2026-01-25", "2026-01-31", "2026-05-01"),
+    # 季繳：已付過就沒有下次付款日
+    ("2026-02-01", ("q2", QUARTERLY_PLAN, "2026-01-31", "5", "2026-01-25"), None, "2026-01-31", "2026-05-01"),
+])
+def test_schedule(today, row, next_due, term_start, term_end):
+    sched = schedule(frame(row), today)
+    assert len(sched) == 1
+    got = sched.iloc[0]
+    assert got["next_due"] == ts(next_due) or (next_due is None and pd.isna(got["next_due"]))
+    assert (got["term_start"], got["term_end"]) == (ts(term_start), ts(term_end))
+    assert got["renewal_open"] == ts(term_end) - pd.Timedelta(days=7)
+
+
+@pytest.mark.parametrize("today, in_window, ended", [
+    ("2026-04-23", False, False),
+    ("2026-04-24", True, False),
+    ("2026-04-30", True, False),
+    # 季繳不自動續約：結束日當天起就是已到期
+    ("2026-05-01", False, True),
+])
+def test_quarterly_renewal_window_and_end(today, in_window, ended):
+    got = schedule(frame(("q1", QUARTERLY_PLAN, "2026-01-31", "5", "2026-01-25")), today).iloc[0]
+    assert (bool(got["in_renewal_window"]), bool(got["ended"])) == (in_window, ended)
+
+
+def test_monthly_plans_never_end():
+    got = schedule(frame(("m1", MONTHLY_PLAN, "2025-01-01", "5", "")), "2026-06-01").iloc[0]
+    assert not got["ended"] and got["term_end"] > pd.Timestamp("2026-06-01")
+
+
+def test_rows_without_case_id_or_start_date_are_skipped():
+    sched = schedule(frame(("", MONTHLY_PLAN, "2026-01-01", "5", ""),
+                           ("bad", MONTHLY_PLAN, "not a date", "5", ""),
+                           ("ok", MONTHLY_PLAN, "2026-01-01", "5", "")), "2026-01-02")
+    assert list(sched["case_id"]) == ["ok"]
+
+
+@pytest.mark.parametrize("today, expected", [
+    # 5 號付款的月繳 3 天前提醒；2/28 付款的在 2/25
+    ("2026-01-02", [("payment", "m5")]),
+    ("2026-02-25", [("payment", "m28")]),
+    # 季繳 pay_date 前 3 天，以及月繳本期結束前 7 天的續約提醒
+    ("2026-01-22", [("payment", "q1")]),
+    ("2026-01-24", [("renewal", "m28"), ("renewal", "m5")]),
+    # 兩個月繳的第 4 期也在 5/1 結束：同一天一起提醒
+    ("2026-04-24", [("renewal", "m28"), ("renewal", "m5"), ("renewal", "q1")]),
+    ("2026-01-10", []),
+])
+def test_due_reminders(today, expected):
+    df = frame(("m5", MONTHLY_PLAN, "2026-01-01", "5", ""),
+               ("m28", MONTHLY_PLAN, "2026-01-01", "28", ""),
+               ("q1", QUARTERLY_PLAN, "2026-01-31", "5", "2026-01-25"))
+    reminders = due_reminders(schedule(df, today), today)
+    assert sorted(zip(reminders["kind"], reminders["case_id"])) == sorted(expected)
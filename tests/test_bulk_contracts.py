@@ -0,0 +1,38 @@
+"""批次重產合約：缺欄位的列不中斷整批，改寫進 zip 裡的 errors.csv。
+
+    python -m pytest -q
+"""
+import csv
+import io
+import zipfile
+
+from benchmarks.fake_sheet import make_rows
+from services.bulk_contracts import ERRORS_ENTRY, render_all, select_rows
+from services.storage import SHEET_COLUMNS
+
+
+def test_bad_rows_go_to_the_errors_manifest(tmp_path):
+    rows = [dict(zip(SHEET_COLUMNS, r)) for r in make_rows(4)]
+    del rows[1]["party_a"]
+    rows[2]["plan"] = ""
+    out = tmp_path / "contracts.zip"
+
+    done, errors, _ = render_all(select_rows(rows), str(out), workers=1)
+
+    assert done == 2
+    assert sorted(errors) == [("客戶1_20260101", "client1@gmail.com", "缺少欄位：party_a"),
+                             ("客戶2_20260101", "client2@gmail.com", "缺少欄位：plan")]
+    with zipfile.ZipFile(out) as zf:
+        names = zf.namelist()
+        manifest = list(csv.reader(io.StringIO(zf.read(ERRORS_ENTRY).decode("utf-8-sig"))))
+    assert sorted(names) == sorted(["合約_客戶0_20260101.docx", "合約_客戶3_20260101.docx", ERRORS_ENTRY])
+    assert manifest[0] == ["case_id", "Email", "error"] and len(manifest) == 3
+
+
+def test_no_manifest_without_errors(tmp_path):
+    rows = [dict(zip(SHEET_COLUMNS, r)) for r in make_rows(2)]
+    out = tmp_path / "contracts.zip"
+    done, errors, _ = render_all(select_rows(rows), str(out), workers=1)
+    assert (done, errors) == (2, [])
+    with zipfile.ZipFile(out) as zf:
+        assert ERRORS_ENTRY not in zf.namelist()
@@ -0,0 +1,86 @@
+"""合約套版：ContractTemplate 直接改 document.xml 的結果，要和用 python-docx 填同樣欄位的文件內容一致。
+
+    python -m pytest -q
+"""
+import io
+from datetime import date, timedelta
+
+import pytest
+from docx import Document
+
+from services.document_utils import (
+    ACCOUNT_NUMBER, BANK_CODE, BANK_NAME, MONTHLY_PLAN, PROVIDER_NAME, QUARTERLY_PLAN, DocxCache, _FIELD_RE,
+    _build_skeleton, generate_docx_bytes, render_contract,
+)
+
+MB = 1024 * 1024
+
+
+def document_text(docx_bytes):
+    doc = Document(io.BytesIO(docx_bytes))
+    paragraphs = [p.text for p in doc.paragraphs]
+    cells = [cell.text for table in doc.tables for row in table.rows for cell in row.cells]
+    return paragraphs, cells
+
+
+def python_docx_render(monthly, fields):
+    """對照組：用 python-docx 開骨架、逐個 run 換掉欄位再存檔 (跳脫與空白交給 python-docx)。"""
+    doc = Document(io.BytesIO(_build_skeleton(monthly, bool(fields["CASE_NUM"]))))
+    paragraphs = list(doc.paragraphs) + [p for t in doc.tables for row in t.rows for c in row.cells for p in c.paragraphs]
+    for paragraph in paragraphs:
+        for run in paragraph.runs:
+            if "{{" in run.text:
+                run.text = _FIELD_RE.sub(lambda m: str(fields[m.group(1)]), run.text)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("plan", [MONTHLY_PLAN, QUARTERLY_PLAN])
+@pytest.mark.parametrize("case_num", ["王小明_20260101_a1b2c3", None])
+@pytest.mark.parametrize("party_a", ["王小明", "A&B <廣告> 有限公司 \"R&D\"", "  前後空白  "])
+def test_template_matches_python_docx(plan, case_num, party_a):
+    monthly = plan == MONTHLY_PLAN
+    start, pay_day, pay_date = date(2026, 1, 31), 5, date(2026, 1, 25)
+    fields = {
+        "CASE_NUM": case_num or "", "PARTY_A": party_a, "PROVIDER_NAME": PROVIDER_NAME,
+        "START_DATE": start, "END_DATE": start + timedelta(days=30 if monthly else 90),
+        "PAY": pay_day if monthly else pay_date,
+        "BANK_NAME": BANK_NAME, "BANK_CODE": BANK_CODE, "ACCOUNT_NUMBER": ACCOUNT_NUMBER,
+    }
+    rendered = render_contract(party_a, plan, start, pay_day, pay_date, case_num)
+    paragraphs, cells = document_text(rendered)
+    assert (paragraphs, cells) == document_text(python_docx_render(monthly, fields))
+    text = "\n".join(paragraphs + cells)
+    assert "{{" not in text and party_a in text
+    assert ("案件編號：" + case_num in text) if case_num else "案件編號" not in text
+    assert ("每月 5 日前" in text) if monthly else ("2026-01-25 前一次性支付" in text)
+
+
+def test_generate_docx_bytes_is_cached():
+    args = ("快取測試", "x@gmail.com", MONTHLY_PLAN, date(2026, 1, 1), 5, None, "case_cache")
+    first = generate_docx_bytes(*args)
+    assert generate_docx_bytes(*args) is first
+    assert generate_docx_bytes("快取測試 2", *args[1:]) != first
+
+
+def test_lru_stays_within_32mb():
+    cache = DocxCache()
+    assert cache.max_bytes == 32 * MB
+    for i in range(40):
+        cache.put(f"k{i}", b"x" * MB)
+        # 一直用到的 k0 不會被淘汰
+        assert cache.get("k0") is not None
+    stats = cache.stats()
+    assert stats["bytes"] <= 32 * MB
+    assert stats["entries"] == 32 and stats["evictions"] == 8
+    assert cache.get("k1") is None and cache.get("k39") is not None
+
+
+def test_lru_replaces_same_key_and_skips_oversized_items():
+    cache = DocxCache(max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("a", b"123")
+    assert cache.size == 3
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None and cache.size == 3
@@ -0,0 +1,159 @@
+"""Notifier：同案件更新的合併視窗與彙整模式，時鐘換成假的。
+
+    python -m pytest -q
+"""
+import itertools
+
+import pytest
+
+from services.notifier import Notifier
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Dispatcher:
+    """MailDispatcher 替身：sent 記錄 (主旨, 內文, 編號)，hold 預留的編號寄出前不算。"""
+
+    def __init__(self):
+        self.sent = []
+        self.held = []
+        self._ids = itertools.count(1)
+
+    def hold(self, subject):
+        msg_id = next(self._ids)
+        self.held.append(msg_id)
+        return msg_id
+
+    def submit(self, subject, body, receiver=None, msg_id=None):
+        msg_id = msg_id or next(self._ids)
+        self.sent.append((subject, body, msg_id))
+        return msg_id
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def dispatcher():
+    return Dispatcher()
+
+
+@pytest.fixture
+def make(clock, dispatcher):
+    made = []
+
+    def make(**kwargs):
+        notifier = Notifier(dispatcher, clock=clock, **kwargs)
+        made.append(notifier)
+        return notifier
+    yield make
+    for notifier in made:
+        notifier._stop.set()
+
+
+def test_first_update_is_sent_immediately(make, dispatcher):
+    notifier = make(window=600)
+    msg_id = notifier.notify("更新 1", "body", case_id="c1")
+    assert dispatcher.sent == [("更新 1", "body", msg_id)]
+    assert notifier.pending() == 0
+
+
+def test_updates_within_the_window_are_merged(make, dispatcher, clock):
+    notifier = make(window=600)
+    notifier.notify("更新 1", "b1", case_id="c1")
+    clock.now += 10
+    second = notifier.notify("更新 2", "b2", case_id="c1")
+    clock.now += 10
+    third = notifier.notify("更新 3", "b3", case_id="c1")
+    # 後續的更新共用一封預留的合併信，視窗結束前不寄
+    assert second == third and second in dispatcher.held
+    assert len(dispatcher.sent) == 1 and notifier.pending() == 1
+    # 別的案件不受影響
+    notifier.notify("其他", "x", case_id="c2")
+    assert len(dispatcher.sent) == 2
+
+    clock.now += 500
+    assert notifier.flush() == 0
+    clock.now += 100
+    assert notifier.flush() == 1
+    subject, body, msg_id = dispatcher.sent[-1]
+    assert (subject, msg_id) == ("更新 3", second)
+    assert body.startswith("b3") and "10 分鐘內共 2 次更新" in body
+    assert notifier.pending() == 0
+
+
+def test_window_restarts_after_the_merged_mail(make, dispatcher, clock):
+    notifier = make(window=600)
+    notifier.notify("更新 1", "b1", case_id="c1")
+    clock.now += 1
+    notifier.notify("更新 2", "b2", case_id="c1")
+    clock.now += 600
+    notifier.flush()
+    # 合併信剛寄出：接著的更新還在新的視窗內
+    clock.now += 1
+    notifier.notify("更新 3", "b3", case_id="c1")
+    assert len(dispatcher.sent) == 2 and notifier.pending() == 1
+    clock.now += 600
+    notifier.flush()
+    # 視窗過了很久才有的更新立刻寄出
+    clock.now += 601
+    notifier.flush()
+    notifier.notify("更新 4", "b4", case_id="c1")
+    assert [s for s, _, _ in dispatcher.sent] == ["更新 1", "更新 2", "更新 3", "更新 4"]
+    assert "共" not in dispatcher.sent[2][1]
+
+
+def test_other_kinds_are_never_merged(make, dispatcher):
+    notifier = make(window=600)
+    notifier.notify("建檔", "a", case_id="c1", kind="event")
+    notifier.notify("建檔", "b", case_id="c1", kind="event")
+    notifier.notify("更新", "c")
+    assert len(dispatcher.sent) == 3
+
+
+def test_short_window_is_shown_in_seconds(make, dispatcher, clock):
+    notifier = make(window=30)
+    notifier.notify("更新 1", "b1", case_id="c1")
+    notifier.notify("更新 2", "b2", case_id="c1")
+    notifier.notify("更新 3", "b3", case_id="c1")
+    clock.now += 30
+    notifier.flush()
+    assert "30 秒內共 2 次更新" in dispatcher.sent[-1][1]
+
+
+def test_digest_groups_everything_into_one_mail(make, dispatcher, clock):
+    notifier = make(digest_interval=3600)
+    ids = {notifier.notify("新客戶 甲", "建檔 甲", case_id="c1", kind="event"),
+           notifier.notify("更新 c2 第一次", "舊內容", case_id="c2"),
+           notifier.notify("更新 c2 第二次", "新內容", case_id="c2"),
+           notifier.notify("更新 c3", "c3 內容", case_id="c3")}
+    assert len(ids) == 1 and dispatcher.sent == []
+
+    clock.now += 3599
+    assert notifier.flush() == 0
+    clock.now += 1
+    assert notifier.flush() == 1
+    subject, body, msg_id = dispatcher.sent[0]
+    assert msg_id in ids
+    assert subject == "【彙整】新建檔 1 筆、更新 2 件"
+    assert "建檔 甲" in body
+    # 同一案件只列最後一次，並註明次數
+    assert "更新 c2 第二次（共 2 次）\n新內容" in body and "舊內容" not in body
+    assert "c3 內容" in body
+    assert notifier.pending() == 0
+
+
+def test_force_flush_sends_everything(make, dispatcher):
+    notifier = make(window=600)
+    notifier.notify("更新 1", "b1", case_id="c1")
+    notifier.notify("更新 2", "b2", case_id="c1")
+    assert notifier.flush(force=True) == 1
+    assert notifier.pending() == 0
@@ -0,0 +1,120 @@
+"""CSV 批次建檔：編碼判斷、逐列檢查，以及整批只讀一次表、寫一次表。
+
+    python -m pytest -q
+"""
+import uuid
+from datetime import date
+
+import pytest
+
+from benchmarks.fake_sheet import FakeWorksheet, make_rows
+from services import clients, onboarding
+from services.document_utils import MONTHLY_PLAN, QUARTERLY_PLAN
+from services.onboarding import import_clients, read_csv, validate
+from services.quota import QuotaGate
+from services.sheet_client import get_connection, set_gate
+
+TODAY = date(2026, 3, 1)
+CSV_TEXT = "信箱,客戶名稱,方案,合作啟動日,每月付款日\nnew@gmail.com,新客戶,每月,2026-03-10,15\n"
+
+
+@pytest.mark.parametrize("data", [
+    CSV_TEXT,
+    CSV_TEXT.encode("utf-8"),
+    # Excel 另存的 UTF-8 會帶 BOM
+    CSV_TEXT.encode("utf-8-sig"),
+    # 中文版 Excel 的預設
+    CSV_TEXT.encode("cp950"),
+])
+def test_read_csv_encodings_and_header_aliases(data):
+    assert read_csv(data) == [{"Email": "new@gmail.com", "party_a": "新客戶", "plan": "每月",
+                               "start_date": "2026-03-10", "pay_day": "15"}]
+
+
+def test_read_csv_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        read_csv("信箱\n".encode("utf-16"))
+
+
+def test_read_csv_strips_cells_and_fills_missing_ones():
+    rows = read_csv(b" Email ,party_a\n a@gmail.com ,\n")
+    assert rows == [{"Email": "a@gmail.com", "party_a": ""}]
+
+
+@pytest.mark.parametrize("row, error", [
+    ({"Email": "a@gmail.com", "party_a": ""}, "名稱空白"),
+    ({"Email": "a@yahoo.com", "party_a": "甲"}, "不是 Gmail"),
+    ({"Email": "OLD@gmail.com", "party_a": "甲"}, "已註冊"),
+    ({"Email": "a@gmail.com", "party_a": "甲", "plan": "半年"}, "無法辨識的方案"),
+    ({"Email": "a@gmail.com", "party_a": "甲", "start_date": "2026/03/10"}, "does not match format"),
+    ({"Email": "a@gmail.com", "party_a": "甲", "pay_day": "29"}, "1~28"),
+    ({"Email": "a@gmail.com", "party_a": "甲", "pay_day": "五"}, "invalid literal"),
+])
+def test_validate_rejects_invalid_rows(row, error):
+    valid, errors = validate([row], {"old@gmail.com"}, TODAY)
+    assert valid == []
+    assert len(errors) == 1 and errors[0][0] == 2 and error in errors[0][1]
+
+
+@pytest.mark.parametrize("row, plan, start, pay_day, pay_date", [
+    ({"plan": ""}, MONTHLY_PLAN, date(2026, 3, 8), 5, None),
+    ({"plan": "17000", "start_date": "2026-04-01", "pay_day": "28"}, MONTHLY_PLAN, date(2026, 4, 1), 28, None),
+    ({"plan": "三個月", "start_date": "2026-04-01"}, QUARTERLY_PLAN, date(2026, 4, 1), 5, date(2026, 4, 1)),
+    ({"plan": QUARTERLY_PLAN, "pay_date": "2026-03-20"}, QUARTERLY_PLAN, date(2026, 3, 8), 5, date(2026, 3, 20)),
+])
+def test_validate_fills_defaults(row, plan, start, pay_day, pay_date):
+    valid, errors = validate([{"Email": "a@gmail.com", "party_a": "甲", **row}], set(), TODAY)
+    assert errors == []
+    got = valid[0]
+    assert (got["plan"], got["start_date"], got["pay_day"], got["pay_date"]) == (plan, start, pay_day, pay_date)
+    assert got["case_id"].startswith("甲_20260301_")
+
+
+def test_validate_keeps_the_first_of_duplicate_emails():
+    rows = [{"Email": "a@gmail.com", "party_a": "甲"},
+            {"Email": "b@gmail.com", "party_a": "乙"},
+            {"Email": " A@gmail.com", "party_a": "丙"}]
+    valid, errors = validate(rows, set(), TODAY)
+    assert [d["party_a"] for d in valid] == ["甲", "乙"]
+    assert errors == [(4, "Email 已註冊")]
+
+
+class Dispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, subject, body, receiver=None):
+        self.sent.append((subject, body))
+        return len(self.sent)
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    set_gate(QuotaGate(read_per_minute=10 ** 9, write_per_minute=10 ** 9))
+    url = f"https://docs.google.com/spreadsheets/d/test-{uuid.uuid4().hex}"
+    ws = FakeWorksheet(make_rows(5))
+    get_connection(url).attach(ws)
+    monkeypatch.setattr(clients, "configured_sheet_url", lambda: url)
+    monkeypatch.setattr(onboarding, "configured_sheet_url", lambda: url)
+    return ws
+
+
+def test_import_reads_once_and_writes_once(sheet):
+    rows = [{"Email": f"new{i}@gmail.com", "party_a": f"新客戶{i}"} for i in range(20)]
+    rows += [{"Email": "client1@gmail.com", "party_a": "已存在"}, {"Email": "bad", "party_a": "x"}]
+    dispatcher = Dispatcher()
+    valid, errors = import_clients(rows, dispatcher, TODAY)
+
+    assert len(valid) == 20 and [line for line, _ in errors] == [22, 23]
+    # 比對重複與寫入前的再確認共用同一次整表讀取；另外只有一次封存分頁清單
+    assert dict(sheet.calls) == {"get_all_records": 1, "append_rows": 1, "worksheets": 1}
+    assert len(sheet.values) - 1 == 25
+    # 通知信合併成一封
+    assert len(dispatcher.sent) == 1 and "新增 20 位" in dispatcher.sent[0][0]
+
+
+def test_dry_run_does_not_write(sheet):
+    valid, errors = import_clients([{"Email": "new@gmail.com", "party_a": "新客戶"}], Dispatcher(), TODAY,
+                                   dry_run=True)
+    assert len(valid) == 1 and errors == []
+    assert dict(sheet.calls) == {"get_all_records": 1}
@@ -0,0 +1,154 @@
+"""QuotaGate / TokenBucket：重試規則、退避與背景讓路，時鐘與 sleep 都換成假的。
+
+    python -m pytest -q
+"""
+import threading
+import time
+
+import pytest
+
+from services import warmup
+from services.quota import BACKGROUND, INTERACTIVE, QuotaGate, SheetQuotaError, TokenBucket, background, current_priority
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = type("Response", (), {"status_code": status})()
+
+
+def failing(*statuses, result="ok"):
+    """依序丟出這些狀態碼的錯誤，之後回傳 result；calls 記錄呼叫次數。"""
+    pending = list(statuses)
+
+    def fn():
+        fn.calls += 1
+        if pending:
+            raise HttpError(pending.pop(0))
+        return result
+    fn.calls = 0
+    return fn
+
+
+@pytest.fixture
+def sleeps():
+    return []
+
+
+@pytest.fixture
+def gate(sleeps):
+    return QuotaGate(10 ** 6, 10 ** 6, max_retries=3, base_delay=1.0, max_delay=4.0, sleep=sleeps.append)
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_idempotent_calls_retry_on_429_and_5xx(gate, sleeps, status):
+    fn = failing(status, status)
+    assert gate.call("read", fn) == "ok"
+    assert fn.calls == 3
+    assert gate.throttled == 2
+    # full jitter：第 n 次重試前睡 0 ~ base * 2^n
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0
+
+
+def test_non_idempotent_calls_retry_only_on_429(gate, sleeps):
+    fn = failing(429)
+    assert gate.call("write", fn, idempotent=False) == "ok"
+    assert fn.calls == 2
+    # 5xx 時不知道有沒有寫進去：不重試，原樣往上丟
+    fn = failing(503)
+    with pytest.raises(HttpError):
+        gate.call("write", fn, idempotent=False)
+    assert fn.calls == 1
+    assert len(sleeps) == 1
+
+
+def test_other_errors_are_not_retried(gate, sleeps):
+    fn = failing(400)
+    with pytest.raises(HttpError):
+        gate.call("read", fn)
+    with pytest.raises(ValueError):
+        gate.call("read", lambda: int("x"))
+    assert fn.calls == 1 and sleeps == []
+
+
+def test_exhausted_retries_raise_sheet_quota_error(gate, sleeps):
+    fn = failing(*[429] * 10)
+    with pytest.raises(SheetQuotaError) as e:
+        gate.call("read", fn)
+    assert isinstance(e.value.__cause__, HttpError)
+    assert fn.calls == 4
+    assert len(sleeps) == 3
+    # 退避上限 max_delay
+    assert all(0 <= s <= 4.0 for s in sleeps)
+
+
+def test_bucket_refills_at_the_per_minute_rate():
+    clock = Clock()
+    bucket = TokenBucket(70, burst=10, clock=clock)
+    for _ in range(10):
+        bucket.acquire()
+    assert bucket.tokens < 1
+    # 補充速率 (70 - 10) / 60 = 每秒 1 個
+    clock.now += 3
+    bucket._refill()
+    assert bucket.tokens == pytest.approx(3)
+
+
+def acquire_in_thread(bucket, priority):
+    done = threading.Event()
+
+    def run():
+        bucket.acquire(priority)
+        done.set()
+    threading.Thread(target=run, daemon=True).start()
+    return done
+
+
+def test_background_does_not_use_the_reserve():
+    clock = Clock()
+    bucket = TokenBucket(60, burst=3, reserve=2, clock=clock)
+    bucket.acquire(BACKGROUND)
+    # 剩 2 個 = reserve：背景請求拿不到，互動請求照樣拿得到
+    waiting = acquire_in_thread(bucket, BACKGROUND)
+    assert not waiting.wait(0.2)
+    bucket.acquire(INTERACTIVE)
+    bucket.acquire(INTERACTIVE)
+    clock.now += 60
+    assert waiting.wait(2)
+
+
+def test_background_yields_to_waiting_interactive_calls():
+    clock = Clock()
+    # 沒有保留量：只看「有互動請求在排隊就讓路」這條規則
+    bucket = TokenBucket(60, burst=3, reserve=0, clock=clock)
+    for _ in range(3):
+        bucket.acquire()
+    queued = acquire_in_thread(bucket, BACKGROUND)
+    time.sleep(0.05)
+    interactive = acquire_in_thread(bucket, INTERACTIVE)
+    time.sleep(0.05)
+    # 只補回 1 個權杖：背景請求先排隊，仍要讓給互動請求
+    clock.now += 1.01 / bucket.rate
+    assert interactive.wait(2)
+    assert not queued.wait(1.2)
+    clock.now += 1.01 / bucket.rate
+    assert queued.wait(2)
+
+
+def test_warm_up_runs_at_background_priority(monkeypatch):
+    seen = []
+    monkeypatch.setattr(warmup, "_warm_sheet", lambda sheet_url: seen.append(current_priority()))
+    monkeypatch.setattr(warmup, "_warm_templates", lambda: seen.append(current_priority()))
+    warmup.warm_up("https://example.invalid/sheet")
+    assert seen == [BACKGROUND, BACKGROUND]
+    assert current_priority() == INTERACTIVE
+    with background():
+        assert current_priority() == BACKGROUND
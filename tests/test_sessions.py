@@ -0,0 +1,135 @@
+"""SessionStore：登入 token 的簽章、到期、竄改、登出與改密碼失效。
+
+    python -m pytest -q
+"""
+import pytest
+
+from services.clients import make_hash
+from services.quota import SheetQuotaError
+from services.sessions import SessionStore, _b64, _unb64
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Sheet:
+    """loader 替身：email -> (列號, 資料)；down = True 時模擬 Sheet 忙碌。"""
+
+    def __init__(self):
+        self.rows = {"a@gmail.com": (2, {"Email": "a@gmail.com", "party_a": "甲", "password": make_hash("pw"),
+                                         "budget": "100"})}
+        self.down = False
+        self.calls = 0
+
+    def __call__(self, email):
+        self.calls += 1
+        if self.down:
+            raise SheetQuotaError("busy")
+        row, data = self.rows.get(email, (None, None))
+        return row, dict(data) if data else None
+
+
+def login(sheet, email="a@gmail.com"):
+    row, data = sheet(email)
+    return {"email": email, "name": data["party_a"], "role": "login", "row_num": row, "raw_data": data}
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def store(clock):
+    return SessionStore("secret", ttl=3600, clock=clock)
+
+
+@pytest.fixture
+def sheet():
+    return Sheet()
+
+
+def test_token_round_trip(store, sheet):
+    token = store.issue(login(sheet))
+    user = store.restore(token, sheet)
+    assert user["email"] == "a@gmail.com" and user["row_num"] == 2
+    assert store.stats()["hits"] == 1
+
+
+def test_token_expires(store, sheet, clock):
+    token = store.issue(login(sheet))
+    clock.now += 3599
+    assert store.verify(token) is not None
+    clock.now += 2
+    assert store.verify(token) is None
+    assert store.restore(token, sheet) is None
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda body, sig: f"{body}.{sig[:-2]}xx",
+    # 改掉 payload 裡的信箱，簽章沿用
+    lambda body, sig: f"{_b64(_unb64(body).replace(b'a@gmail.com', b'b@gmail.com'))}.{sig}",
+    lambda body, sig: body,
+    lambda body, sig: "",
+])
+def test_tampered_token_is_rejected(store, sheet, tamper):
+    body, sig = store.issue(login(sheet)).split(".", 1)
+    assert store.restore(tamper(body, sig), sheet) is None
+
+
+def test_token_signed_with_another_key_is_rejected(clock, sheet):
+    token = SessionStore("other", clock=clock).issue(login(sheet))
+    assert SessionStore("secret", clock=clock).restore(token, sheet) is None
+
+
+def test_rebuilt_from_sheet_after_restart(clock, sheet):
+    token = SessionStore("secret", clock=clock).issue(login(sheet))
+    # 新程序 (快取是空的)，同一把金鑰
+    user = SessionStore("secret", clock=clock).restore(token, sheet)
+    assert user["name"] == "甲" and user["raw_data"]["budget"] == "100"
+
+
+def test_revoked_token_is_not_rebuilt(store, sheet):
+    token = store.issue(login(sheet))
+    store.revoke(token)
+    assert store.restore(token, sheet) is None
+
+
+def test_revoke_email_drops_every_session_of_that_email(store, sheet):
+    tokens = [store.issue(login(sheet)) for _ in range(3)]
+    store.revoke_email(" A@gmail.com ")
+    assert store.stats()["sessions"] == 0
+    # 快取沒了會用 loader 重建；密碼沒變就仍然有效，改過密碼才會失效
+    assert store.restore(tokens[0], sheet) is not None
+    sheet.rows["a@gmail.com"][1]["password"] = make_hash("new")
+    assert all(store.restore(t, sheet) is None for t in tokens)
+
+
+def test_password_changed_on_another_replica(store, sheet):
+    token = store.issue(login(sheet))
+    sheet.rows["a@gmail.com"][1]["password"] = make_hash("new")
+    assert store.restore(token, sheet) is None
+
+
+def test_each_restore_gets_its_own_copy(store, sheet):
+    user = login(sheet)
+    token = store.issue(user)
+    user["raw_data"]["budget"] = "changed before restore"
+    first, second = store.restore(token, sheet), store.restore(token, sheet)
+    first.setdefault("raw_data", {}).update(budget="999")
+    assert second["raw_data"]["budget"] == "100"
+    assert store.restore(token, sheet)["raw_data"]["budget"] == "100"
+
+
+def test_sheet_busy_uses_cache_or_raises(store, sheet, clock):
+    token = store.issue(login(sheet))
+    sheet.down = True
+    assert store.restore(token, sheet)["email"] == "a@gmail.com"
+    # 快取沒有時沒辦法核對：往上丟，由 app.py 退回登入畫面
+    with pytest.raises(SheetQuotaError):
+        SessionStore("secret", clock=clock).restore(token, sheet)
@@ -0,0 +1,164 @@
+"""SharedSnapshot：兩個實例開同一個暫存檔，模擬同主機的兩個程序。
+
+    python -m pytest -q
+"""
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_sheet import FakeWorksheet, make_rows
+from services import sheet_index
+from services.shared_cache import SharedSnapshot, file_lock
+from services.sheet_index import SheetIndex
+
+
+class Fetch:
+    """fetch() 替身：回傳 rows 的內容並計數；during 有給時在讀表途中呼叫 (模擬別的程序同時動作)。"""
+
+    def __init__(self, *emails, during=None):
+        self.records = [{"Email": e, "budget": "0"} for e in emails]
+        self.during = during
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.during is not None:
+            self.during()
+        return ["Email", "budget"], [dict(r) for r in self.records]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "snapshot.db")
+
+
+@pytest.fixture
+def a(path):
+    return SharedSnapshot(path, "sheet", ttl=60)
+
+
+@pytest.fixture
+def b(path):
+    return SharedSnapshot(path, "sheet", ttl=60)
+
+
+def test_only_the_first_process_reads_the_sheet(a, b):
+    fetch = Fetch("x@gmail.com", "y@gmail.com")
+    meta, rows = a.load(fetch)
+    assert rows == [(2, {"Email": "x@gmail.com", "budget": "0"}), (3, {"Email": "y@gmail.com", "budget": "0"})]
+    assert b.load(fetch) == (meta, rows)
+    assert fetch.calls == 1
+    # 不同的 sheet_key 各自一份
+    other = SharedSnapshot(a.path, "other", ttl=60)
+    assert other.load(Fetch("z@gmail.com"))[1] == [(2, {"Email": "z@gmail.com", "budget": "0"})]
+
+
+def test_put_is_seen_through_changes(a, b):
+    meta, _ = a.load(Fetch("x@gmail.com", "y@gmail.com"))
+    assert b.changes(meta["epoch"], meta["version"]) == (meta["version"], [])
+    a.put({3: {"Email": "y@gmail.com", "budget": "100"}})
+    a.put({4: {"Email": "new@gmail.com", "budget": "5"}})
+    version, rows = b.changes(meta["epoch"], meta["version"])
+    assert version == meta["version"] + 2
+    assert sorted(rows) == [(3, {"Email": "y@gmail.com", "budget": "100"}), (4, {"Email": "new@gmail.com", "budget": "5"})]
+    # 只補上一次之後的
+    assert b.changes(meta["epoch"], meta["version"] + 1) == (version, [(4, {"Email": "new@gmail.com", "budget": "5"})])
+    # put 的內容也在下一次整份載入裡
+    assert b.load(Fetch())[1][-1] == (4, {"Email": "new@gmail.com", "budget": "5"})
+
+
+def test_put_before_any_load_is_ignored(a, b):
+    a.put({2: {"Email": "x@gmail.com"}})
+    assert b.load(Fetch("y@gmail.com"))[1] == [(2, {"Email": "y@gmail.com", "budget": "0"})]
+
+
+def test_expire_bumps_the_epoch_and_forces_a_reload(a, b):
+    meta, _ = a.load(Fetch("x@gmail.com"))
+    b.expire()
+    # 持有舊 epoch 的程序補不上，要整份重載
+    assert a.changes(meta["epoch"], meta["version"]) == (None, None)
+    fetch = Fetch("x@gmail.com", "moved@gmail.com")
+    new_meta, rows = a.load(fetch)
+    assert fetch.calls == 1 and len(rows) == 2
+    assert new_meta["epoch"] > meta["epoch"] and new_meta["loaded_at"] > 0
+    assert b.load(fetch)[0] == new_meta and fetch.calls == 1
+
+
+def load_in_thread(snapshot, fetch, **kwargs):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(snapshot.load(fetch, **kwargs)), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_stale_snapshot_is_served_while_another_process_reloads(a, path):
+    a.load(Fetch("x@gmail.com"))
+    stale = SharedSnapshot(path, "sheet", ttl=0)
+    fetch = Fetch("y@gmail.com")
+    # 別的程序拿著鎖正在重讀：只是過期的快照先用，不等
+    with file_lock(a.lock_path):
+        assert stale.load(fetch)[1] == [(2, {"Email": "x@gmail.com", "budget": "0"})]
+    assert fetch.calls == 0
+    assert stale.load(fetch)[1] == [(2, {"Email": "y@gmail.com", "budget": "0"})]
+    assert fetch.calls == 1
+
+
+@pytest.mark.parametrize("make_unusable", [
+    lambda snapshot: snapshot.expire(),
+    # 搬過列：not_before 之前讀的快照列號可能不對
+    lambda snapshot: time.sleep(0.01),
+])
+def test_unusable_snapshot_waits_for_the_reload(a, b, make_unusable):
+    a.load(Fetch("x@gmail.com"))
+    make_unusable(b)
+    not_before = time.time()
+    fetch = Fetch("y@gmail.com")
+    with file_lock(a.lock_path):
+        thread, result = load_in_thread(a, fetch, not_before=not_before)
+        thread.join(0.3)
+        assert thread.is_alive() and fetch.calls == 0
+    thread.join(5)
+    assert fetch.calls == 1 and result[0][1] == [(2, {"Email": "y@gmail.com", "budget": "0"})]
+    assert result[0][0]["loaded_at"] >= not_before
+
+
+def test_expire_during_the_fetch_keeps_the_snapshot_expired(a, b):
+    a.load(Fetch("x@gmail.com"))
+    a.expire()
+    # 讀表途中別的程序又 expire：寫進去的內容標成過期，下一次照樣重讀
+    meta, _ = a.load(Fetch("x@gmail.com", during=b.expire))
+    assert meta["loaded_at"] == 0
+    fetch = Fetch("x@gmail.com")
+    assert b.load(fetch)[0]["loaded_at"] > 0 and fetch.calls == 1
+
+
+@pytest.fixture
+def indexes(path, monkeypatch):
+    # 每次查詢都去看共用快照
+    monkeypatch.setattr(sheet_index, "SHARED_POLL", 0.0)
+    ws = FakeWorksheet(make_rows(5))
+    return ws, [SheetIndex(ttl=60, shared=SharedSnapshot(path, "sheet", ttl=60)) for _ in range(2)]
+
+
+def test_indexes_share_writes_through_the_snapshot(indexes):
+    ws, (first, second) = indexes
+    first.find_email("client1@gmail.com", lambda: ws)
+    assert second.find_email("client1@gmail.com", lambda: ws)[0] == 3
+    assert ws.calls["get_all_records"] == 1
+    first.patch(3, {"budget": "999"})
+    assert second.find_email("client1@gmail.com", lambda: ws)[1]["budget"] == "999"
+    assert ws.calls["get_all_records"] == 1
+
+
+def test_epoch_bump_reloads_every_index(indexes):
+    ws, (first, second) = indexes
+    first.find_email("client1@gmail.com", lambda: ws)
+    second.find_email("client1@gmail.com", lambda: ws)
+    # 別的程序刪了第 2 列，列號整個往上移
+    del ws.values[1]
+    first.invalidate()
+    assert second.find_email("client1@gmail.com", lambda: ws)[0] == 2
+    assert first.find_email("client1@gmail.com", lambda: ws)[0] == 2
+    # 兩個程序只重讀一次 Sheet
+    assert ws.calls["get_all_records"] == 2
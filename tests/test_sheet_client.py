@@ -0,0 +1,68 @@
+"""SheetConnection：access token 快到期時只換一次，同時進來的請求不會各自去換。
+
+    python -m pytest -q
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.fake_sheet import FakeWorksheet, make_rows
+from services.quota import QuotaGate
+from services.sheet_client import REFRESH_MARGIN, SheetConnection, set_gate
+
+
+class Credentials:
+    """google-auth 憑證替身：expiry 是不帶時區的 UTC；refresh 要花點時間，讓並行的呼叫疊在一起。"""
+
+    def __init__(self, expires_in):
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + expires_in
+        self.refreshed = 0
+
+    def refresh(self, request):
+        time.sleep(0.05)
+        self.refreshed += 1
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+
+
+def connection(auth):
+    conn = SheetConnection("https://example.invalid/sheet")
+    conn.attach(FakeWorksheet(make_rows(3)))
+    # gspread 6 的 client 把憑證放在 http_client.auth
+    conn._client = type("Client", (), {"http_client": type("HTTPClient", (), {"auth": auth})()})()
+    return conn
+
+
+def read_concurrently(conn, threads=8):
+    barrier = threading.Barrier(threads)
+
+    def read():
+        barrier.wait()
+        conn.worksheet().get_all_records()
+    workers = [threading.Thread(target=read) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(10)
+
+
+@pytest.fixture(autouse=True)
+def gate():
+    set_gate(QuotaGate(read_per_minute=10 ** 9, write_per_minute=10 ** 9))
+
+
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+def test_token_near_expiry_is_refreshed_once():
+    auth = Credentials(REFRESH_MARGIN - timedelta(minutes=1))
+    conn = connection(auth)
+    read_concurrently(conn)
+    assert auth.refreshed == 1
+    read_concurrently(conn)
+    assert auth.refreshed == 1
+
+
+def test_token_outside_the_margin_is_left_alone():
+    auth = Credentials(REFRESH_MARGIN + timedelta(minutes=1))
+    read_concurrently(connection(auth))
+    assert auth.refreshed == 0
@@ -0,0 +1,289 @@
+"""WriteCoordinator / WriteJournal：對 benchmarks.fake_sheet 的假工作表執行，不連網。
+
+    python -m pytest -q
+"""
+import threading
+import time
+import uuid
+
+import pytest
+
+from benchmarks.fake_sheet import FakeWorksheet, make_rows
+from services.journal import JournalInUseError, WriteJournal
+from services.quota import QuotaGate, SheetQuotaError
+from services.shared_cache import RowEpoch
+from services.sheet_client import get_connection, set_gate
+from services.storage import SHEET_COLUMNS, get_storage
+from services.write_coordinator import ClientNotFoundError, DuplicateClientError, StaleWriteError, WriteCoordinator
+
+
+class FlakyWorksheet(FakeWorksheet):
+    """down = True 時每次 API 呼叫都失敗，模擬 Sheet 停擺；slow 設成 Event 時整表讀取等它 set 才回來。"""
+
+    down = False
+    slow = None
+
+    def _api(self, name):
+        if self.down:
+            raise SheetQuotaError("sheet is down")
+        super()._api(name)
+        if self.slow is not None and name == "get_all_records":
+            self.slow.wait(10)
+
+
+def new_row(email, case_id, name="王小明"):
+    values = {"Email": email, "case_id": case_id, "party_a": name}
+    return [values.get(h, "") for h in SHEET_COLUMNS]
+
+
+def sheet_rows(ws):
+    return [dict(zip(ws.values[0], r)) for r in ws.values[1:]]
+
+
+@pytest.fixture(autouse=True)
+def gate():
+    set_gate(QuotaGate(read_per_minute=10 ** 9, write_per_minute=10 ** 9))
+
+
+@pytest.fixture
+def sheet():
+    # 每個測試一份新的試算表網址：連線、索引、storage 都是依網址共用的
+    url = f"https://docs.google.com/spreadsheets/d/test-{uuid.uuid4().hex}"
+    ws = FlakyWorksheet(make_rows(5))
+    get_connection(url).attach(ws)
+    return get_storage(url), ws
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal.jsonl")
+
+
+@pytest.fixture
+def journaled(sheet, journal_path):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage, journal_path=journal_path)
+    yield coordinator, ws
+    coordinator.journal.stop()
+
+
+def expire(storage):
+    # 模擬索引與封存分頁清單都過了存活時間
+    storage.index._loaded_at -= storage.index.ttl
+    storage.archive._listed_at -= storage.archive.ttl
+
+
+def test_same_case_id_for_two_clients_stays_separate(journaled):
+    coordinator, ws = journaled
+    coordinator.register(new_row("a@gmail.com", "王小明_20260101", "甲"), "a@gmail.com")
+    coordinator.register(new_row("b@gmail.com", "王小明_20260101", "乙"), "b@gmail.com")
+
+    assert coordinator.find_by_email("a@gmail.com")[1]["party_a"] == "甲"
+    assert coordinator.find_by_email("b@gmail.com")[1]["party_a"] == "乙"
+    coordinator.update({"budget": "B"}, case_id="王小明_20260101", email="b@gmail.com")
+    assert coordinator.journal.flush(timeout=10)
+
+    rows = {r["Email"]: r for r in sheet_rows(ws)}
+    assert len(ws.values) - 1 == 7
+    assert rows["b@gmail.com"]["budget"] == "B"
+    assert rows["a@gmail.com"]["budget"] == ""
+
+
+def test_empty_sheet_gets_headers_through_storage():
+    url = f"https://docs.google.com/spreadsheets/d/test-{uuid.uuid4().hex}"
+    ws = FlakyWorksheet([], headers=[])
+    get_connection(url).attach(ws)
+    storage = get_storage(url)
+    assert storage.headers == []
+
+    assert storage.ensure_headers(SHEET_COLUMNS) == SHEET_COLUMNS
+    assert storage.ensure_headers(SHEET_COLUMNS) == SHEET_COLUMNS
+    assert ws.calls["append_row"] == 1 and ws.values == [SHEET_COLUMNS]
+    # 索引已換上新表頭：接著建檔與查詢都對得上欄位
+    coordinator = WriteCoordinator(storage)
+    row = new_row("a@gmail.com", "甲_20260101", "甲")
+    coordinator.register(row, "a@gmail.com")
+    assert coordinator.find_by_email("a@gmail.com") == (2, dict(zip(SHEET_COLUMNS, row)))
+
+
+def test_update_rejects_case_id_of_another_client(sheet):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage)
+    with pytest.raises(ClientNotFoundError):
+        coordinator.update({"budget": "1"}, case_id="客戶0_20260101", email="client1@gmail.com")
+    assert all(r["budget"] == "30000" for r in sheet_rows(ws))
+
+
+def test_register_rejects_existing_email(sheet):
+    storage, _ = sheet
+    coordinator = WriteCoordinator(storage)
+    with pytest.raises(DuplicateClientError):
+        coordinator.register(new_row("CLIENT2@gmail.com", "x_20260101"), "CLIENT2@gmail.com")
+
+
+def test_stale_write(sheet):
+    storage, _ = sheet
+    coordinator = WriteCoordinator(storage)
+    version = coordinator.find_by_case("客戶3_20260101")[1]["last_update_at"]
+    new_version = coordinator.update({"budget": "1"}, case_id="客戶3_20260101", email="client3@gmail.com",
+                                     expected_version=version)
+    with pytest.raises(StaleWriteError):
+        coordinator.update({"budget": "2"}, case_id="客戶3_20260101", email="client3@gmail.com",
+                           expected_version=version)
+    coordinator.update({"budget": "3"}, case_id="客戶3_20260101", email="client3@gmail.com",
+                       expected_version=new_version)
+    assert coordinator.find_by_case("客戶3_20260101")[1]["budget"] == "3"
+
+
+def test_replay_skips_only_rows_already_written(sheet, journal_path):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage, journal_path=journal_path)
+    coordinator.register(new_row("a@gmail.com", "甲_20260101"), "a@gmail.com")
+    # 與表上 client0 同一個 case_id，但是不同的客戶
+    coordinator.register(new_row("b@gmail.com", "客戶0_20260101"), "b@gmail.com")
+    assert coordinator.journal.flush(timeout=10)
+    coordinator.journal.stop()
+    # 模擬套用完、checkpoint 還沒寫就當掉：重啟後整份日誌再套用一次
+    with open(journal_path + ".checkpoint", "w", encoding="utf-8") as f:
+        f.write("0")
+
+    restarted = WriteCoordinator(storage, journal_path=journal_path)
+    try:
+        assert restarted.journal.flush(timeout=10)
+    finally:
+        restarted.journal.stop()
+    emails = [r["Email"] for r in sheet_rows(ws)]
+    assert emails.count("a@gmail.com") == 1
+    assert emails.count("b@gmail.com") == 1
+    assert len(emails) == 7
+
+
+def test_outage_longer_than_ttl_still_journals(journaled):
+    coordinator, ws = journaled
+    storage = coordinator.storage
+    # 先讀過一次：索引與封存分頁清單都在記憶體裡
+    assert coordinator.find_by_email("nobody@gmail.com")[0] is None
+    ws.down = True
+    expire(storage)
+
+    assert coordinator.register(new_row("new@gmail.com", "新_20260101"), "new@gmail.com") < 0
+    coordinator.update({"budget": "9"}, case_id="客戶1_20260101", email="client1@gmail.com")
+    assert coordinator.find_by_email("client1@gmail.com")[1]["budget"] == "9"
+    time.sleep(0.2)
+    assert coordinator.journal.backlog() == 2
+
+    ws.down = False
+    assert coordinator.journal.flush(timeout=10)
+    rows = {r["Email"]: r for r in sheet_rows(ws)}
+    assert rows["client1@gmail.com"]["budget"] == "9"
+    assert "new@gmail.com" in rows
+
+
+def test_expired_index_reloads_in_background(sheet):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage)
+    budget = SHEET_COLUMNS.index("budget")
+    assert storage.find_by_email("client0@gmail.com")[1]["budget"] == 30000
+    # 別人直接改了表，索引也過了存活時間；重讀整張表要很久
+    ws.values[1][budget] = "1"
+    ws.slow = threading.Event()
+    storage.index._loaded_at -= storage.index.ttl
+
+    started = time.monotonic()
+    assert storage.find_by_email("client0@gmail.com")[1]["budget"] == 30000
+    # 重讀期間本程序的寫入照樣就地更新，換上新內容後也不會不見
+    coordinator.update({"budget": "5"}, case_id="客戶1_20260101", email="client1@gmail.com")
+    assert time.monotonic() - started < 1
+    ws.slow.set()
+
+    deadline = time.monotonic() + 5
+    while storage.find_by_email("client0@gmail.com")[1]["budget"] != 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert storage.find_by_email("client1@gmail.com")[1]["budget"] in ("5", 5)
+    assert ws.calls["get_all_records"] == 2
+
+
+def test_invalidated_index_does_not_serve_stale_rows(sheet):
+    storage, ws = sheet
+    storage.find_by_email("client0@gmail.com")
+    storage.index.invalidate()
+    ws.down = True
+    # 失效代表列號可能變了：寧可失敗也不用舊列號
+    with pytest.raises(SheetQuotaError):
+        storage.find_by_email("client0@gmail.com")
+
+
+def test_journal_has_a_single_owner(journal_path):
+    journal = WriteJournal(journal_path, lambda entries: None)
+    try:
+        with pytest.raises(JournalInUseError):
+            WriteJournal(journal_path, lambda entries: None)
+    finally:
+        journal.stop()
+    WriteJournal(journal_path, lambda entries: None).stop()
+
+
+def delete_row_elsewhere(storage, ws, row_num):
+    # 命令列封存在另一個程序的做法：自己的 RowEpoch 物件，只和 app 共用檔案
+    other = RowEpoch(storage.index.rows.path)
+    with other.moving():
+        del ws.values[row_num - 1]
+        other.bump()
+
+
+def test_update_is_one_api_call(sheet):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage)
+    coordinator.find_by_email("client3@gmail.com")
+    before = ws.api_calls
+    coordinator.update({"budget": "7"}, case_id="客戶3_20260101", email="client3@gmail.com")
+    assert ws.api_calls - before == 1
+
+
+def test_rows_deleted_by_another_process(sheet):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage)
+    assert coordinator.find_by_email("client3@gmail.com")[0] == 5
+    # 例如命令列封存在另一個程序刪了第 2 列：索引裡的列號全部差一列
+    delete_row_elsewhere(storage, ws, 2)
+    coordinator.update({"budget": "7"}, case_id="客戶3_20260101", email="client3@gmail.com")
+    rows = {r["Email"]: r for r in sheet_rows(ws)}
+    assert rows["client3@gmail.com"]["budget"] == "7"
+    assert rows["client4@gmail.com"]["budget"] == "30000"
+
+
+def test_update_waits_for_rows_being_moved(sheet):
+    storage, ws = sheet
+    coordinator = WriteCoordinator(storage)
+    assert coordinator.find_by_email("client3@gmail.com")[0] == 5
+    other = RowEpoch(storage.index.rows.path)
+    with other.moving():
+        writer = threading.Thread(target=coordinator.update, args=({"budget": "7"}, "客戶3_20260101",
+                                                                   "client3@gmail.com"))
+        writer.start()
+        time.sleep(0.2)
+        # 刪列還沒做完：寫入在等，沒有寫進舊列號
+        assert writer.is_alive()
+        assert all(r["budget"] == "30000" for r in sheet_rows(ws))
+        del ws.values[1]
+        other.bump()
+    writer.join(timeout=10)
+    rows = {r["Email"]: r for r in sheet_rows(ws)}
+    assert rows["client3@gmail.com"]["budget"] == "7"
+    assert rows["client4@gmail.com"]["budget"] == "30000"
+
+
+def test_replay_after_rows_deleted_by_another_process(journaled):
+    coordinator, ws = journaled
+    assert coordinator.find_by_email("client2@gmail.com")[0] == 4
+    # Sheet 暫時連不上：更新只進日誌，列號 4 留在 overlay 裡
+    ws.down = True
+    coordinator.update({"budget": "8"}, case_id="客戶2_20260101", email="client2@gmail.com")
+    delete_row_elsewhere(coordinator.storage, ws, 2)
+    ws.down = False
+    # 套用前發現列號世代變了，先重載索引再找列
+    assert coordinator.journal.flush(timeout=15)
+    rows = {r["Email"]: r for r in sheet_rows(ws)}
+    assert rows["client2@gmail.com"]["budget"] == "8"
+    assert rows["client3@gmail.com"]["budget"] == "30000"